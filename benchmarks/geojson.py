@@ -0,0 +1,59 @@
+"""
+Compare the native GeoJSON parser with the Python `parse_data` path.
+
+Usage:
+    python benchmarks/geojson.py [feature_count]
+"""
+import sys
+import time
+
+import numpy as np
+import orjson
+from metacity.geometry import parse_geojson_bytes
+from metacity.io.geojson import parse_data
+
+
+def footprint(rng: np.random.Generator, vertex_count=12):
+    center = rng.random(2) * 10000
+    angles = np.sort(rng.random(vertex_count) * 2 * np.pi)
+    ring = center + np.stack([np.cos(angles), np.sin(angles)], axis=1) * 10
+    ring = np.append(ring, [ring[0]], axis=0)
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [ring.tolist()]
+        },
+        "properties": {
+            "height": float(rng.random() * 50),
+            "name": "building"
+        }
+    }
+
+
+def generate(feature_count: int):
+    rng = np.random.default_rng(0)
+    return orjson.dumps({
+        "type": "FeatureCollection",
+        "features": [footprint(rng) for _ in range(feature_count)]
+    })
+
+
+def measure(title: str, fn):
+    start = time.perf_counter()
+    models = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{title:>8}: {elapsed:8.3f}s, {len(models)} models")
+    return elapsed
+
+
+def main(feature_count: int):
+    contents = generate(feature_count)
+    print(f"{feature_count} features, {len(contents) / 2**20:.1f} MiB")
+    python = measure("python", lambda: parse_data(orjson.loads(contents)))
+    native = measure("native", lambda: parse_geojson_bytes(contents).get_models())
+    print(f" speedup: {python / native:8.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,63 @@
+"""
+Compare the BVH ray tracer with the triangle rasterizer when building heightmaps.
+
+Usage:
+    python benchmarks/heightmap.py [building_count]
+"""
+import sys
+import time
+
+import numpy as np
+from metacity.geometry import Attribute, HeightmapMethod, LegoBuilder, Layer, Model
+
+
+EXTENT = 1000
+
+
+def building(rng: np.random.Generator):
+    x, y = rng.random(2) * (EXTENT - 20)
+    w, d = 5 + rng.random(2) * 15
+    z, h = rng.random() * 10, 5 + rng.random() * 40
+    box = np.array([[x, y], [x + w, y], [x + w, y + d], [x, y + d]])
+    walls = []
+    for (ax, ay), (bx, by) in zip(box, np.roll(box, -1, axis=0)):
+        walls += [[ax, ay, z], [bx, by, z], [bx, by, z + h], [ax, ay, z], [bx, by, z + h], [ax, ay, z + h]]
+    roof = np.concatenate([box, np.full((4, 1), z + h)], axis=1)
+    return np.array(walls, dtype=np.float32), roof.astype(np.float32)
+
+
+def generate(building_count: int):
+    rng = np.random.default_rng(0)
+    layer = Layer()
+    for _ in range(building_count):
+        walls, roof = building(rng)
+        attribute = Attribute()
+        for i in range(0, len(walls), 3):
+            attribute.push_polygon3D(walls[i:i + 3], np.array([0, 3]))
+        attribute.push_polygon3D(roof, np.array([0, 4]))
+        model = Model()
+        model.add_attribute("POSITION", attribute)
+        layer.add_model(model)
+    return layer
+
+
+def measure(builder: LegoBuilder, resolution: float, method: HeightmapMethod):
+    start = time.perf_counter()
+    builder.build_heightmap(0, 0, EXTENT, EXTENT, resolution, method=method)
+    return time.perf_counter() - start, builder.heightmap.copy()
+
+
+def main(building_count: int):
+    builder = LegoBuilder()
+    builder.insert_layer(generate(building_count))
+    print(f"{building_count} buildings over {EXTENT}x{EXTENT} units")
+    for resolution in [0.5, 1, 2, 4]:
+        trace, traced = measure(builder, resolution, HeightmapMethod.TRACE)
+        raster, rasterized = measure(builder, resolution, HeightmapMethod.RASTER)
+        error = np.abs(traced - rasterized).max()
+        print(f"{traced.shape[1]:>5}x{traced.shape[0]:<5} trace: {trace:7.3f}s, raster: {raster:7.3f}s, "
+              f"speedup: {trace / raster:6.2f}x, max difference: {error:.2e}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,306 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+import metacity.utils.filesystem as fs
+import numpy as np
+import os
+import struct
+import zlib
+
+
+def valid_range(heightmap: np.ndarray) -> Tuple[float, float]:
+    """
+    Height range of the pixels covered by geometry, (0, 0) if there are none.
+    """
+    finite = heightmap[np.isfinite(heightmap)]
+    if finite.size == 0:
+        return 0.0, 0.0
+    return float(finite.min()), float(finite.max())
+
+
+def resolve_range(heightmap: np.ndarray, low: Optional[float], high: Optional[float]) -> Tuple[float, float]:
+    vlow, vhigh = valid_range(heightmap)
+    return vlow if low is None else low, vhigh if high is None else high
+
+
+def neighbourhood_sum(values: np.ndarray) -> np.ndarray:
+    rows, cols = values.shape
+    padded = np.pad(values, 1)
+    return sum(padded[j:j + rows, i:i + cols] for j in range(3) for i in range(3))
+
+
+def denoise(heightmap: np.ndarray, low: Optional[float] = None, high: Optional[float] = None) -> np.ndarray:
+    """
+    Replace heights outside of [low, high] with the average of their valid 8-neighbours, or with low if there are none.
+    All pixels read the input heights, the result does not depend on any scan order.
+
+    Args:
+        heightmap (np.ndarray): The heightmap, pixels without geometry are -inf.
+        low (float): The lowest valid height, defaults to the lowest covered pixel.
+        high (float): The highest valid height, defaults to the highest covered pixel.
+
+    Returns:
+        np.ndarray: The denoised float32 heightmap.
+    """
+    low, high = resolve_range(heightmap, low, high)
+    valid = (heightmap >= low) & (heightmap <= high)
+    total = neighbourhood_sum(np.where(valid, heightmap, 0).astype(np.float64))
+    count = neighbourhood_sum(valid.astype(np.int32))
+    filled = np.where(count > 0, np.maximum(total / np.maximum(count, 1), low), low)
+    return np.where(valid, heightmap, filled).astype(np.float32)
+
+
+def clamp(heightmap: np.ndarray, low: Optional[float] = None, high: Optional[float] = None) -> np.ndarray:
+    """
+    Clamp heights into [low, high], the range defaults to the covered pixels.
+    """
+    low, high = resolve_range(heightmap, low, high)
+    return np.clip(heightmap, low, high).astype(np.float32)
+
+
+def summed_area_table(heightmap: np.ndarray) -> np.ndarray:
+    """
+    Summed-area table with a leading row and column of zeros, table[j, i] is the sum of heightmap[:j, :i].
+    """
+    rows, cols = heightmap.shape
+    table = np.zeros((rows + 1, cols + 1), dtype=np.float64)
+    np.cumsum(heightmap, axis=0, dtype=np.float64, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+
+def block_means(table: np.ndarray, size: int) -> np.ndarray:
+    """
+    Average heights of non-overlapping size x size blocks read from a summed-area table, incomplete blocks are dropped.
+    """
+    rows, cols = (table.shape[0] - 1) // size, (table.shape[1] - 1) // size
+    corners = table[np.ix_(np.arange(rows + 1) * size, np.arange(cols + 1) * size)]
+    sums = corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+    return (sums / (size * size)).astype(np.float32)
+
+
+def box_filters(heightmap: np.ndarray, sizes: Iterable[int]) -> Dict[int, np.ndarray]:
+    """
+    Box filter the heightmap with all the sizes at once, every block costs four table lookups regardless of its size.
+
+    Args:
+        heightmap (np.ndarray): The heightmap, it should not contain infinite values.
+        sizes (Iterable[int]): The box filter sizes in pixels.
+
+    Returns:
+        Dict[int, np.ndarray]: The block averages for every size.
+    """
+    table = summed_area_table(heightmap)
+    return {size: block_means(table, size) for size in sizes}
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+FILTERS = ["none", "sub", "up", "average", "paeth"]
+
+
+def shifted(rows: np.ndarray, bpp: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    left = np.zeros_like(rows)
+    left[:, bpp:] = rows[:, :-bpp]
+    up = np.zeros_like(rows)
+    up[1:] = rows[:-1]
+    upleft = np.zeros_like(rows)
+    upleft[1:] = left[:-1]
+    return left, up, upleft
+
+
+def paeth_predictor(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    a, b, c = a.astype(np.int16), b.astype(np.int16), c.astype(np.int16)
+    p = a + b - c
+    pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+    return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c)).astype(np.uint8)
+
+
+def filter_rows(rows: np.ndarray, bpp: int, filter: str = "adaptive") -> bytes:
+    """
+    Apply PNG row filters to a (rows, stride) uint8 array, every row is prefixed with its filter type.
+    The adaptive filter picks the filter with the smallest sum of absolute signed residuals for every row.
+    """
+    left, up, upleft = shifted(rows, bpp)
+    candidates = np.stack([
+        rows,
+        rows - left,
+        rows - up,
+        rows - ((left.astype(np.uint16) + up) // 2).astype(np.uint8),
+        rows - paeth_predictor(left, up, upleft)
+    ])
+    if filter == "adaptive":
+        choice = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2).argmin(axis=0)
+    else:
+        choice = np.full(rows.shape[0], FILTERS.index(filter))
+    filtered = candidates[choice, np.arange(rows.shape[0])]
+    return np.hstack([choice[:, None].astype(np.uint8), filtered]).tobytes()
+
+
+def unfilter_rows(data: bytes, height: int, stride: int, bpp: int) -> np.ndarray:
+    """
+    Reverse PNG row filters. A pixel depends only on its left, upper and upper-left neighbours,
+    so the pixels of every anti-diagonal are reconstructed at once, whatever the filters of their rows.
+    """
+    filtered = np.frombuffer(data, dtype=np.uint8).reshape(height, stride + 1)
+    kinds = filtered[:, 0]
+    if height and kinds.max() >= len(FILTERS):
+        raise Exception(f"Unknown PNG filter type {kinds.max()}")
+    width = stride // bpp
+    residuals = filtered[:, 1:].reshape(height, width, bpp).astype(np.int16)
+    #a row and a column of zeros above and left of the image stand for the missing neighbours
+    rows = np.zeros((height + 1, width + 1, bpp), dtype=np.int16)
+    for d in range(height + width - 1):
+        j = np.arange(max(0, d - width + 1), min(height, d + 1))
+        i = d - j
+        a, b, c = rows[j + 1, i], rows[j, i + 1], rows[j, i]
+        p = a + b - c
+        pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+        paeth = np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+        prediction = np.choose(kinds[j, None], [np.zeros_like(a), a, b, (a + b) >> 1, paeth])
+        rows[j + 1, i + 1] = (residuals[j, i] + prediction) & 0xFF
+    return rows[1:, 1:].astype(np.uint8).reshape(height, stride)
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+#the largest sample marks pixels without geometry, heights use the samples below it
+PNG_NODATA = 65535
+PNG_LEVELS = PNG_NODATA - 1
+
+
+def quantize(heightmap: np.ndarray, low: float, high: float) -> np.ndarray:
+    scale = PNG_LEVELS / (high - low) if high > low else 0
+    nodata = np.isnan(heightmap) | np.isneginf(heightmap)
+    samples = np.round((np.clip(np.where(nodata, low, heightmap), low, high) - low) * scale)
+    return np.where(nodata, PNG_NODATA, samples).astype(np.uint16)
+
+
+def encode_png16(heightmap: np.ndarray, low: Optional[float] = None, high: Optional[float] = None, level: int = 6, filter: str = "adaptive") -> bytes:
+    """
+    Encode the heightmap as a 16-bit grayscale PNG, heights in [low, high] are mapped onto [0, 65534]
+    and pixels without geometry (-inf or NaN) are stored as 65535. The range and the nodata sample
+    are stored in the "low", "high" and "nodata" text chunks so that heights can be restored.
+
+    Args:
+        heightmap (np.ndarray): The heightmap.
+        low (float): The height mapped to 0, defaults to the lowest covered pixel.
+        high (float): The height mapped to 65534, defaults to the highest covered pixel.
+        level (int): The zlib compression level from 0 to 9.
+        filter (str): The PNG row filter, one of none, sub, up, average, paeth or adaptive.
+
+    Returns:
+        bytes: The PNG file contents.
+    """
+    low, high = resolve_range(heightmap, low, high)
+    height, width = heightmap.shape
+    rows = quantize(heightmap, low, high).astype(">u2").view(np.uint8).reshape(height, width * 2)
+    header = struct.pack(">IIBBBBB", width, height, 16, 0, 0, 0, 0)
+    return b"".join([
+        PNG_SIGNATURE,
+        png_chunk(b"IHDR", header),
+        png_chunk(b"tEXt", b"low\0" + repr(low).encode()),
+        png_chunk(b"tEXt", b"high\0" + repr(high).encode()),
+        png_chunk(b"tEXt", b"nodata\0" + str(PNG_NODATA).encode()),
+        png_chunk(b"IDAT", zlib.compress(filter_rows(rows, 2, filter), level)),
+        png_chunk(b"IEND", b"")
+    ])
+
+
+def decode_png16(data: bytes) -> np.ndarray:
+    """
+    Decode a PNG written by encode_png16 back into float32 heights, pixels without geometry become -inf.
+    """
+    if data[:8] != PNG_SIGNATURE:
+        raise Exception("Not a PNG file")
+    position, idat, text = 8, [], {}
+    while position < len(data):
+        length, = struct.unpack(">I", data[position:position + 4])
+        kind, body = data[position + 4:position + 8], data[position + 8:position + 8 + length]
+        position += length + 12
+        if kind == b"IHDR":
+            width, height, depth, color = struct.unpack(">IIBB", body[:10])
+            if depth != 16 or color != 0:
+                raise Exception("Only 16-bit grayscale PNG heightmaps are supported")
+        elif kind == b"tEXt":
+            key, value = body.split(b"\0", 1)
+            text[key.decode()] = float(value)
+        elif kind == b"IDAT":
+            idat.append(body)
+    rows = unfilter_rows(zlib.decompress(b"".join(idat)), height, width * 2, 2)
+    samples = rows.view(">u2")
+    low, high = text.get("low", 0.0), text.get("high", 65535.0)
+    #files without a nodata sample use the full range for heights
+    levels = PNG_LEVELS if "nodata" in text else 65535
+    heights = low + samples.astype(np.float64) * ((high - low) / levels)
+    if "nodata" in text:
+        heights[samples == int(text["nodata"])] = -np.inf
+    return heights.astype(np.float32)
+
+
+def encode_raw(heightmap: np.ndarray, level: int = 6, filter: str = "adaptive") -> bytes:
+    """
+    Encode the heightmap as zlib compressed little-endian float32 rows with PNG row filters.
+    The shape is not stored, it is recorded in the tile layout.
+    """
+    height, width = heightmap.shape
+    rows = np.ascontiguousarray(heightmap, dtype="<f4").view(np.uint8).reshape(height, width * 4)
+    return zlib.compress(filter_rows(rows, 4, filter), level)
+
+
+def decode_raw(data: bytes, height: int, width: int) -> np.ndarray:
+    return unfilter_rows(zlib.decompress(data), height, width * 4, 4).view("<f4").astype(np.float32)
+
+
+def write_heightmap(filename: str, heightmap: np.ndarray, format: str = "png16", level: int = 6, low: Optional[float] = None, high: Optional[float] = None):
+    """
+    Write the heightmap as a 16-bit grayscale PNG (format="png16") or as compressed float32 rows (format="raw").
+    """
+    if format == "png16":
+        data = encode_png16(heightmap, low, high, level)
+    elif format == "raw":
+        data = encode_raw(heightmap, level)
+    else:
+        raise Exception(f"Unknown heightmap format {format}")
+    with open(filename, "wb") as file:
+        file.write(data)
+
+
+def write_heightmap_tiles(folder: str, heightmap: np.ndarray, tile_size: int = 256, format: str = "png16", level: int = 6, threads: int = 0):
+    """
+    Split the heightmap into square tiles and write them in parallel together with a layout.json.
+    All png16 tiles share the height range of the whole heightmap.
+
+    Args:
+        folder (str): The output folder.
+        heightmap (np.ndarray): The heightmap, the first row is the northernmost one.
+        tile_size (int): The tile size in pixels.
+        format (str): png16 or raw, see write_heightmap.
+        level (int): The zlib compression level from 0 to 9.
+        threads (int): The number of threads compressing the tiles, 0 uses all cores.
+
+    Returns:
+        dict: The layout, tiles are indexed by their column and row.
+    """
+    fs.create_dir_if_not_exists(folder)
+    low, high = valid_range(heightmap)
+    height, width = heightmap.shape
+    extension = "png" if format == "png16" else "f32.zz"
+    tiles = [{"x": x, "y": y, "file": f"tile{x}_{y}.{extension}",
+              "width": min(tile_size, width - x * tile_size), "height": min(tile_size, height - y * tile_size)}
+             for y in range((height + tile_size - 1) // tile_size)
+             for x in range((width + tile_size - 1) // tile_size)]
+
+    def write(tile):
+        data = heightmap[tile["y"] * tile_size:(tile["y"] + 1) * tile_size, tile["x"] * tile_size:(tile["x"] + 1) * tile_size]
+        write_heightmap(os.path.join(folder, tile["file"]), data, format, level, low, high)
+
+    #zlib releases the GIL while compressing, threads are enough to use all cores
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as pool:
+        list(pool.map(write, tiles))
+
+    layout = {"format": format, "tileSize": tile_size, "width": width, "height": height, "low": low, "high": high, "tiles": tiles}
+    if format == "png16":
+        layout["nodata"] = PNG_NODATA
+    fs.write_json(os.path.join(folder, "layout.json"), layout)
+    return layout
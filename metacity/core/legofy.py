@@ -1,33 +1,72 @@
 from typing import Tuple
-#from metacity.datamodel.project import Project
-from metacity.geometry import LegoBuilder
+from metacity.core.heightmap import box_filters, denoise, write_heightmap
+from metacity.geometry import LegoBuilder, Layer
 from metacity.utils.filesystem import write_json
 import metacity.utils.filesystem as fs
-from tqdm import tqdm
-#from metacity.utils.transform import tile_coords_in_range
+import numpy as np
 import os
 
 
-def legofy(output_dir: str, start: Tuple[float, float], end: Tuple[float, float], coordinates_decimal_precision=2, box_filter_size_range=(5, 45), box_filter_step=5):
+# size of lego brick in milimeters
+LEGODIM = 8.0  # width
+LEGOSTEP = 3.2  # third of height
+
+
+def lego_model(bricks: np.ndarray, box_size: int, resolution: float, start: Tuple[float, float], end: Tuple[float, float]):
     """
-    Generate lego tiles from a project. The lego tiles are generated in the output directory, stores json and png with heightmap.
-    
+    Quantise box filtered heights into a lego model, heights are counted in bricks from the lowest one.
+
+    Args:
+        bricks (np.ndarray): The box filtered heightmap, one value per brick.
+        box_size (int): The box filter size in heightmap pixels.
+        resolution (float): The heightmap pixels per unit of original coordinates.
+        start (Tuple[float, float]): The start coordinates of the selected rectangle.
+        end (Tuple[float, float]): The end coordinates of the selected rectangle.
+
+    Returns:
+        dict: The model dimensions and the map of brick counts.
+    """
+    low, high = (float(bricks.min()), float(bricks.max())) if bricks.size else (0.0, 0.0)
+    height_step = box_size / resolution / LEGODIM * LEGOSTEP
+    dimy, dimx = bricks.shape
+    dimz = int((high - low) / height_step)
+    return {
+        "coord_size": {"x": end[0] - start[0], "y": end[1] - start[1], "z": high - low},
+        "model_size_mm": {"x": dimx * LEGODIM, "y": dimy * LEGODIM, "z": dimz * LEGOSTEP},
+        "lego_size": {"x": dimx, "y": dimy, "z": dimz},
+        "map": np.floor((bricks - low) / height_step).astype(np.int64).tolist()
+    }
+
+
+def legofy(layer: Layer, output_dir: str, start: Tuple[float, float], end: Tuple[float, float], coordinates_decimal_precision=2, box_filter_size_range=(5, 45), box_filter_step=5, threads=0) -> np.ndarray:
+    """
+    Generate lego models from a layer. The heightmap of the selected rectangle is rasterized from the layer geometry,
+    one json with the lego model is stored in the output directory for every box filter size
+    next to the heightmap saved as a 16-bit grayscale PNG.
+
     Args:
-        project (str): The project to generate lego tiles from.
-        output_dir (str): The directory to write the lego tiles to.
-        start (Tuple[float, float]): The start coordinates of the lego tiles.
-        end (Tuple[float, float]): The end coordinates of the lego tiles.
-        coordinates_decimal_precision (int): The number of decimal places to round the coordinates to.
+        layer (Layer): The layer to generate lego models from.
+        output_dir (str): The directory to write the lego models to.
+        start (Tuple[float, float]): The absolute start coordinates of the selected rectangle, the layer origin is taken into account.
+        end (Tuple[float, float]): The absolute end coordinates of the selected rectangle.
+        coordinates_decimal_precision (int): The number of decimal places to round the coordinates to, sets the heightmap resolution.
         box_filter_size_range (Tuple[int, int]): The range of box filter sizes to use.
         box_filter_step (int): The step size of the box filter.
+        threads (int): The number of threads building the heightmap, 0 uses all cores.
 
     Returns:
-        None
+        numpy.ndarray: The denoised float32 heightmap, the first row is the northernmost one.
     """
-    pass
+    fs.create_dir_if_not_exists(output_dir)
+    builder = LegoBuilder()
+    builder.insert_layer(layer)
+    resolution = 10 ** coordinates_decimal_precision
+    builder.build_heightmap(start[0], start[1], end[0], end[1], resolution, threads=threads)
 
-    #fs.create_dir_if_not_exists(output_dir)
-    #tiles = tile_coords_in_range(start, end, 1000)
-    #builder = LegoBuilder()
+    heightmap = denoise(builder.heightmap)
+    write_heightmap(os.path.join(output_dir, "heightmap.png"), heightmap)
+    sizes = range(box_filter_size_range[0], box_filter_size_range[1], box_filter_step)
+    for box_size, bricks in box_filters(heightmap, sizes).items():
+        write_json(os.path.join(output_dir, f"lego_{box_size}.json"), lego_model(bricks, box_size, resolution, start, end))
 
-    #TODO
+    return heightmap
@@ -1,32 +1,141 @@
-from typing import Dict, List, Tuple
+import numpy
+from typing import Dict, List, Tuple, overload
+
+class AttributeType:
+    NONE: AttributeType
+    POINT: AttributeType
+    SEGMENT: AttributeType
+    POLYGON: AttributeType
+    NORMAL: AttributeType
+    def __init__(self, value: int) -> None: ...
+    @property
+    def name(self) -> str: ...
+    @property
+    def value(self) -> int: ...
 
 class Attribute:
-    def __init__(self) -> None: ...
+    def __init__(self, indexed: bool = ...) -> None: ...
+    @overload
+    def push_line2D(self, vertices: numpy.ndarray[numpy.float32]) -> None: ...
+    @overload
+    def push_line2D(self, vertices: numpy.ndarray[numpy.float64]) -> None: ...
+    @overload
     def push_line2D(self, arg0: List[float]) -> None: ...
+    @overload
+    def push_line3D(self, vertices: numpy.ndarray[numpy.float32]) -> None: ...
+    @overload
+    def push_line3D(self, vertices: numpy.ndarray[numpy.float64]) -> None: ...
+    @overload
     def push_line3D(self, arg0: List[float]) -> None: ...
+    @overload
+    def push_point2D(self, vertices: numpy.ndarray[numpy.float32]) -> None: ...
+    @overload
+    def push_point2D(self, vertices: numpy.ndarray[numpy.float64]) -> None: ...
+    @overload
     def push_point2D(self, arg0: List[float]) -> None: ...
+    @overload
+    def push_point3D(self, vertices: numpy.ndarray[numpy.float32]) -> None: ...
+    @overload
+    def push_point3D(self, vertices: numpy.ndarray[numpy.float64]) -> None: ...
+    @overload
     def push_point3D(self, arg0: List[float]) -> None: ...
+    @overload
+    def push_polygon2D(self, vertices: numpy.ndarray[numpy.float32], ring_offsets: numpy.ndarray[numpy.int64]) -> None: ...
+    @overload
+    def push_polygon2D(self, vertices: numpy.ndarray[numpy.float64], ring_offsets: numpy.ndarray[numpy.int64]) -> None: ...
+    @overload
     def push_polygon2D(self, arg0: List[List[float]]) -> None: ...
+    @overload
+    def push_polygon3D(self, vertices: numpy.ndarray[numpy.float32], ring_offsets: numpy.ndarray[numpy.int64]) -> None: ...
+    @overload
+    def push_polygon3D(self, vertices: numpy.ndarray[numpy.float64], ring_offsets: numpy.ndarray[numpy.int64]) -> None: ...
+    @overload
     def push_polygon3D(self, arg0: List[List[float]]) -> None: ...
+    def simplified(self, cell_size: float) -> Attribute: ...
+    def to_indexed(self) -> None: ...
+    def to_soup(self) -> None: ...
+    @property
+    def borrowed(self) -> bool: ...
+    @property
+    def indexed(self) -> bool: ...
+    @property
+    def indices(self) -> numpy.ndarray[numpy.uint32]: ...
+    @property
+    def size(self) -> int: ...
+    @property
+    def sum(self) -> Tuple[float,float,float]: ...
+    @property
+    def type(self) -> AttributeType: ...
+    @property
+    def vertices(self) -> numpy.ndarray[numpy.float32]: ...
+    @property
+    def vmax(self) -> Tuple[float,float,float]: ...
+    @property
+    def vmin(self) -> Tuple[float,float,float]: ...
 
 class Grid:
-    def __init__(self, arg0: float, arg1: float) -> None: ...
+    def __init__(self, width: float, height: float, spill_folder: str = ..., spill_budget: int = ...) -> None: ...
     def add_layer(self, arg0: Layer) -> None: ...
     def add_model(self, arg0: Model) -> None: ...
-    def to_gltf(self, arg0: str, arg1: bool) -> None: ...
+    @staticmethod
+    def load(filename: str, mmap: bool = ..., verify: bool = ...) -> Grid: ...
+    def save(self, filename: str) -> None: ...
+    def set_origin(self, origin: Tuple[float,float,float]) -> None: ...
+    def to_gltf(self, folder: str, merge: bool, binary: bool = ..., pretty: bool = ..., threads: int = ..., levels: int = ..., resolution: int = ..., incremental: bool = ...) -> Dict[str,List[str]]: ...
     @property
     def grid(self) -> Dict[Tuple[int,int],List[Model]]: ...
+    @property
+    def origin(self) -> Tuple[float,float,float]: ...
+
+class HeightmapMethod:
+    TRACE: HeightmapMethod
+    RASTER: HeightmapMethod
+    def __init__(self, value: int) -> None: ...
+    @property
+    def name(self) -> str: ...
+    @property
+    def value(self) -> int: ...
 
 class Layer:
-    def __init__(self) -> None: ...
+    def __init__(self, compact: bool = ...) -> None: ...
     def add_model(self, arg0: Model) -> None: ...
     def add_models(self, arg0: List[Model]) -> None: ...
-    def from_gltf(self, arg0: str) -> None: ...
+    @overload
+    def add_polygons_batch(self, vertices: numpy.ndarray[numpy.float32], ring_offsets: numpy.ndarray[numpy.int64], polygon_offsets: numpy.ndarray[numpy.int64], model_offsets: numpy.ndarray[numpy.int64], threads: int = ...) -> None: ...
+    @overload
+    def add_polygons_batch(self, vertices: numpy.ndarray[numpy.float64], ring_offsets: numpy.ndarray[numpy.int64], polygon_offsets: numpy.ndarray[numpy.int64], model_offsets: numpy.ndarray[numpy.int64], threads: int = ...) -> None: ...
+    def build_index(self, node_size: int = ...) -> None: ...
+    def compact(self, threads: int = ...) -> None: ...
+    def from_gltf(self, filename: str, lazy: bool = ...) -> None: ...
+    def get_model(self, index: int) -> Model: ...
     def get_models(self) -> List[Model]: ...
-    def to_gltf(self, arg0: str) -> None: ...
+    @staticmethod
+    def load(filename: str, mmap: bool = ..., verify: bool = ...) -> Layer: ...
+    def query_bbox(self, min: Tuple[float,float], max: Tuple[float,float]) -> List[int]: ...
+    def query_nearest(self, x: float, y: float, k: int = ...) -> List[int]: ...
+    def query_point(self, x: float, y: float) -> List[int]: ...
+    def save(self, filename: str) -> None: ...
+    def set_origin(self, origin: Tuple[float,float,float], threads: int = ...) -> None: ...
+    def to_gltf(self, filename: str, binary: bool = ..., pretty: bool = ...) -> None: ...
+    def transform(self, matrix: numpy.ndarray[numpy.float64], threads: int = ...) -> None: ...
+    @property
+    def is_compact(self) -> bool: ...
+    @property
+    def origin(self) -> Tuple[float,float,float]: ...
     @property
     def size(self) -> int: ...
 
+class LegoBuilder:
+    def __init__(self) -> None: ...
+    def build_heightmap(self, xmin: float, ymin: float, xmax: float, ymax: float, resolution: float, threads: int = ..., method: HeightmapMethod = ...) -> None: ...
+    def insert_grid(self, arg0: Grid) -> None: ...
+    def insert_layer(self, arg0: Layer) -> None: ...
+    def insert_model(self, arg0: Model) -> None: ...
+    @property
+    def heightmap(self) -> numpy.ndarray[numpy.float32]: ...
+    @property
+    def origin(self) -> Tuple[float,float,float]: ...
+
 class Model:
     def __init__(self) -> None: ...
     def add_attribute(self, arg0: str, arg1: Attribute) -> None: ...
@@ -35,3 +144,5 @@ class Model:
     def set_metadata(self, arg0: json) -> None: ...
     @property
     def metadata(self) -> json: ...
+
+def parse_geojson_bytes(buffer: bytes, threads: int = ..., origin: Tuple[float,float,float] = ...) -> Layer: ...
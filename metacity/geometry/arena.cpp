@@ -0,0 +1,328 @@
+#include <sstream>
+#include "arena.hpp"
+#include "parallel.hpp"
+#include "gltf/json.hpp"
+
+//vertices per block, large models get a block of their own size
+static const size_t block_capacity = 1 << 16;
+
+ModelArena::ModelArena() : attribute_offsets(1, 0), properties(make_shared<PropertyTable>()) {}
+
+size_t ModelArena::size() const
+{
+    return attribute_offsets.size() - 1;
+}
+
+size_t ModelArena::memory() const
+{
+    size_t bytes = attribute_offsets.capacity() * sizeof(uint32_t);
+    bytes += (block_ids.capacity() + vertex_offsets.capacity() + vertex_counts.capacity()
+              + index_offsets.capacity() + index_counts.capacity()) * sizeof(uint32_t);
+    bytes += types.capacity() * sizeof(uint8_t) + names.capacity() * sizeof(uint16_t);
+    for (const auto & block : blocks)
+        bytes += sizeof(ArenaBlock) + block->vertices.capacity() * sizeof(tvec3) + block->indices.capacity() * sizeof(uint32_t);
+    return bytes;
+}
+
+uint16_t ModelArena::name_index(const string & name)
+{
+    for (size_t i = 0; i < name_table.size(); i++)
+        if (name_table[i] == name)
+            return i;
+    if (name_table.size() == UINT16_MAX)
+        throw runtime_error("Too many attribute names in arena");
+    name_table.push_back(name);
+    return name_table.size() - 1;
+}
+
+ArenaBlock & ModelArena::reserve(const size_t vertices, const size_t indices)
+{
+    if (!blocks.empty())
+    {
+        //blocks loaded from a snapshot are full
+        auto & block = *blocks.back();
+        if (!block.vertices.borrowed() && !block.indices.borrowed() &&
+            block.vertices.size() + vertices <= block.vertices.capacity() && block.indices.size() + indices <= block.indices.capacity())
+            return block;
+    }
+
+    if (blocks.size() == UINT32_MAX)
+        throw runtime_error("Too many blocks in arena");
+    auto block = make_shared<ArenaBlock>();
+    block->vertices.reserve(max(block_capacity, vertices));
+    block->indices.reserve(max(block_capacity, indices));
+    blocks.push_back(block);
+    return *block;
+}
+
+//ranges are assigned serially, the data is copied in parallel; the blocks never reallocate
+void ModelArena::append(const vector<shared_ptr<Model>> & models, const size_t threads)
+{
+    struct Copy {
+        shared_ptr<Attribute> attribute;
+        tvec3 * vertices;
+        uint32_t * indices;
+    };
+    vector<Copy> copies;
+
+    for (const auto & model : models)
+    {
+        for (const auto & name : model->get_attribute_names())
+        {
+            auto attribute = model->get_attribute(name);
+            const size_t vcount = attribute->get_data().size();
+            const size_t icount = attribute->is_indexed() ? attribute->get_indices().size() : 0;
+            auto & block = reserve(vcount, icount);
+
+            block_ids.push_back(blocks.size() - 1);
+            vertex_offsets.push_back(block.vertices.size());
+            vertex_counts.push_back(vcount);
+            index_offsets.push_back(block.indices.size());
+            index_counts.push_back(attribute->is_indexed() ? icount : UINT32_MAX);
+            types.push_back(attribute->get_type());
+            names.push_back(name_index(name));
+
+            block.vertices.resize(block.vertices.size() + vcount);
+            block.indices.resize(block.indices.size() + icount);
+            copies.push_back({attribute, block.vertices.mut().data() + vertex_offsets.back(), block.indices.mut().data() + index_offsets.back()});
+        }
+        attribute_offsets.push_back(block_ids.size());
+        model->export_metadata(*properties);
+    }
+
+    parallel_for(copies.size(), threads, [&](size_t i) {
+        const auto & copy = copies[i];
+        const auto & data = copy.attribute->get_data();
+        std::copy(data.begin(), data.end(), copy.vertices);
+        if (copy.attribute->is_indexed())
+        {
+            const auto & indices = copy.attribute->get_indices();
+            std::copy(indices.begin(), indices.end(), copy.indices);
+        }
+    });
+}
+
+//a model whose attributes borrow the arena memory, modifications copy them out of the arena
+shared_ptr<Model> ModelArena::view(const size_t index) const
+{
+    auto model = make_shared<Model>();
+    for (uint32_t a = attribute_offsets[index]; a < attribute_offsets[index + 1]; a++)
+    {
+        const auto & block = blocks[block_ids[a]];
+        auto attribute = make_shared<Attribute>();
+        attribute->borrow((AttributeType) types[a], block, block->vertices.data() + vertex_offsets[a], vertex_counts[a]);
+        if (index_counts[a] != UINT32_MAX)
+            attribute->borrow_indices(block, block->indices.data() + index_offsets[a], index_counts[a]);
+        model->add_attribute(name_table[names[a]], attribute);
+    }
+    model->bind_metadata(properties, index);
+    return model;
+}
+
+int ModelArena::position_attribute(const size_t index) const
+{
+    for (uint32_t a = attribute_offsets[index]; a < attribute_offsets[index + 1]; a++)
+        if (name_table[names[a]] == "POSITION")
+            return a;
+    return -1;
+}
+
+bool ModelArena::bounds(const size_t index, tvec3 & min, tvec3 & max) const
+{
+    const int a = position_attribute(index);
+    if (a < 0)
+        return false;
+
+    Attribute attribute;
+    attribute.borrow((AttributeType) types[a], blocks[block_ids[a]], blocks[block_ids[a]]->vertices.data() + vertex_offsets[a], vertex_counts[a]);
+    min = attribute.vmin();
+    max = attribute.vmax();
+    return true;
+}
+
+bool ModelArena::contains_xy(const size_t index, const tfloat x, const tfloat y) const
+{
+    const int a = position_attribute(index);
+    if (a < 0)
+        return false;
+
+    const auto & block = blocks[block_ids[a]];
+    Attribute attribute;
+    attribute.borrow((AttributeType) types[a], block, block->vertices.data() + vertex_offsets[a], vertex_counts[a]);
+    if (index_counts[a] != UINT32_MAX)
+        attribute.borrow_indices(block, block->indices.data() + index_offsets[a], index_counts[a]);
+    return attribute.contains_xy(x, y);
+}
+
+//blocks referenced by views (e.g. models bucketed in a grid) or borrowed from a snapshot are replaced by a copy,
+//the views keep the previous block and are not affected by the following in-place modifications
+void ModelArena::detach()
+{
+    for (auto & block : blocks)
+    {
+        if (block.use_count() == 1 && !block->vertices.borrowed() && !block->indices.borrowed())
+            continue;
+        auto copy = make_shared<ArenaBlock>();
+        copy->vertices.reserve(block->vertices.capacity());
+        copy->vertices.assign(block->vertices.begin(), block->vertices.end());
+        copy->indices.reserve(block->indices.capacity());
+        copy->indices.assign(block->indices.begin(), block->indices.end());
+        block = copy;
+    }
+}
+
+//in place, detach() has to be called first so that outstanding views are not modified
+void ModelArena::transform(const size_t index, const tmat4d & matrix, const tvec3d & origin)
+{
+    for (uint32_t a = attribute_offsets[index]; a < attribute_offsets[index + 1]; a++)
+    {
+        tvec3 * vertices = blocks[block_ids[a]]->vertices.mut().data() + vertex_offsets[a];
+        for (uint32_t i = 0; i < vertex_counts[a]; i++)
+            vertices[i] = tvec3(tvec3d(matrix * glm::dvec4(origin + tvec3d(vertices[i]), 1.0)) - origin);
+    }
+}
+
+void ModelArena::translate(const size_t index, const tvec3d & offset)
+{
+    for (uint32_t a = attribute_offsets[index]; a < attribute_offsets[index + 1]; a++)
+    {
+        tvec3 * vertices = blocks[block_ids[a]]->vertices.mut().data() + vertex_offsets[a];
+        for (uint32_t i = 0; i < vertex_counts[a]; i++)
+            vertices[i] = tvec3(tvec3d(vertices[i]) + offset);
+    }
+}
+
+//===============================================================================
+// Snapshots
+
+//the models are written as a single block, attributes keep the layout of the arena;
+//vertices are written while the layout is collected, indices in a second pass over the models
+void ModelArena::save(SnapshotWriter & writer, const ModelVisitor & visit)
+{
+    ModelArena layout;
+    uint64_t vertex_total = 0, index_total = 0;
+    size_t models = 0;
+
+    writer.begin("vertices");
+    visit([&](const shared_ptr<Model> & model) {
+        for (const auto & name : model->get_attribute_names())
+        {
+            auto attribute = model->get_attribute(name);
+            const size_t vcount = attribute->get_data().size();
+            const size_t icount = attribute->is_indexed() ? attribute->get_indices().size() : 0;
+            if (vertex_total + vcount >= UINT32_MAX || index_total + icount >= UINT32_MAX)
+                throw runtime_error("Too many vertices for a snapshot");
+
+            layout.block_ids.push_back(0);
+            layout.vertex_offsets.push_back(vertex_total);
+            layout.vertex_counts.push_back(vcount);
+            layout.index_offsets.push_back(index_total);
+            layout.index_counts.push_back(attribute->is_indexed() ? icount : UINT32_MAX);
+            layout.types.push_back(attribute->get_type());
+            layout.names.push_back(layout.name_index(name));
+            vertex_total += vcount;
+            index_total += icount;
+            writer.append(attribute->get_data().data(), vcount * sizeof(tvec3));
+        }
+        layout.attribute_offsets.push_back(layout.block_ids.size());
+        model->export_metadata(*layout.properties);
+        models++;
+    });
+    writer.end();
+
+    uint64_t index_written = 0;
+    writer.begin("indices");
+    visit([&](const shared_ptr<Model> & model) {
+        for (const auto & name : model->get_attribute_names())
+        {
+            auto attribute = model->get_attribute(name);
+            if (!attribute->is_indexed())
+                continue;
+            const auto & indices = attribute->get_indices();
+            index_written += indices.size();
+            if (index_written > index_total)
+                throw runtime_error("Models changed while saving a snapshot");
+            writer.append(indices.data(), indices.size() * sizeof(uint32_t));
+        }
+    });
+    writer.end();
+    if (index_written != index_total)
+        throw runtime_error("Models changed while saving a snapshot");
+
+    writer.add("arena", nlohmann::json({{"models", models}, {"names", layout.name_table}}).dump());
+    writer.add_array("attribute_offsets", layout.attribute_offsets);
+    writer.add_array("vertex_offsets", layout.vertex_offsets);
+    writer.add_array("vertex_counts", layout.vertex_counts);
+    writer.add_array("index_offsets", layout.index_offsets);
+    writer.add_array("index_counts", layout.index_counts);
+    writer.add_array("types", layout.types);
+    writer.add_array("names", layout.names);
+
+    ostringstream properties;
+    layout.properties->serialize(properties);
+    writer.add("properties", properties.str());
+}
+
+void ModelArena::save(SnapshotWriter & writer, const vector<shared_ptr<Model>> & models)
+{
+    save(writer, [&](const function<void(const shared_ptr<Model> &)> & write) {
+        for (const auto & model : models)
+            write(model);
+    });
+}
+
+template <typename T>
+void load_section(const SnapshotReader & reader, const string & name, vector<T> & out, const size_t count)
+{
+    const auto section = reader.array<T>(name);
+    if (section.second != count)
+        throw runtime_error("Corrupted snapshot section " + name);
+    out.assign(section.first, section.first + section.second);
+}
+
+//the per-attribute arrays are copied, vertices and indices stay in the mapped or loaded snapshot
+shared_ptr<ModelArena> ModelArena::load(const SnapshotReader & reader)
+{
+    auto arena = make_shared<ModelArena>();
+    const auto info = nlohmann::json::parse(reader.text("arena"));
+    const size_t models = info.at("models").get<size_t>();
+    arena->name_table = info.at("names").get<vector<string>>();
+
+    load_section(reader, "attribute_offsets", arena->attribute_offsets, models + 1);
+    const size_t count = arena->attribute_offsets.back();
+    load_section(reader, "vertex_offsets", arena->vertex_offsets, count);
+    load_section(reader, "vertex_counts", arena->vertex_counts, count);
+    load_section(reader, "index_offsets", arena->index_offsets, count);
+    load_section(reader, "index_counts", arena->index_counts, count);
+    load_section(reader, "types", arena->types, count);
+    load_section(reader, "names", arena->names, count);
+    arena->block_ids.assign(count, 0);
+
+    const auto vertices = reader.array<tvec3>("vertices");
+    const auto indices = reader.array<uint32_t>("indices");
+    if (arena->attribute_offsets[0] != 0)
+        throw runtime_error("Corrupted snapshot section attribute_offsets");
+    for (size_t i = 0; i < models; i++)
+        if (arena->attribute_offsets[i] > arena->attribute_offsets[i + 1])
+            throw runtime_error("Corrupted snapshot section attribute_offsets");
+    for (size_t a = 0; a < count; a++)
+    {
+        const bool indexed = arena->index_counts[a] != UINT32_MAX;
+        if ((uint64_t) arena->vertex_offsets[a] + arena->vertex_counts[a] > vertices.second ||
+            (indexed && (uint64_t) arena->index_offsets[a] + arena->index_counts[a] > indices.second) ||
+            arena->types[a] > AttributeType::NORMAL || arena->names[a] >= arena->name_table.size())
+            throw runtime_error("Corrupted snapshot attributes");
+    }
+
+    auto block = make_shared<ArenaBlock>();
+    block->source = reader.owner();
+    block->vertices.borrow(block->source, vertices.first, vertices.second);
+    block->indices.borrow(block->source, indices.first, indices.second);
+    arena->blocks.push_back(block);
+
+    istringstream properties(reader.text("properties"));
+    arena->properties->deserialize(properties);
+    if (arena->properties->size() != models)
+        throw runtime_error("Corrupted snapshot section properties");
+    return arena;
+}
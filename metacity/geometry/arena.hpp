@@ -0,0 +1,68 @@
+#pragma once
+#include <vector>
+#include <string>
+#include <memory>
+#include <functional>
+#include "types.hpp"
+#include "model.hpp"
+#include "properties.hpp"
+#include "snapshot.hpp"
+
+using namespace std;
+
+//vertices and indices of many models, blocks are allocated with a fixed capacity
+//so that views borrowing from them stay valid when more models are appended
+struct ArenaBlock {
+    CowArray<tvec3> vertices;
+    CowArray<uint32_t> indices;
+    //snapshot the block was loaded from, views keep borrowing it after the block is copied on modification
+    shared_ptr<const void> source;
+};
+
+//struct-of-arrays storage of models, per model it keeps only the range of its attributes,
+//per attribute a block reference, two ranges and type tags; metadata lives in a property table
+class ModelArena {
+public:
+    ModelArena();
+    size_t size() const;
+    size_t memory() const;
+    void append(const vector<shared_ptr<Model>> & models, const size_t threads = 0);
+
+    shared_ptr<Model> view(const size_t index) const;
+    bool bounds(const size_t index, tvec3 & min, tvec3 & max) const;
+    bool contains_xy(const size_t index, const tfloat x, const tfloat y) const;
+
+    //gives the arena exclusive owned blocks, required before models are transformed or translated
+    void detach();
+    void transform(const size_t index, const tmat4d & matrix, const tvec3d & origin);
+    void translate(const size_t index, const tvec3d & offset);
+
+    //the visitor calls the given function for each saved model in the same order on every call,
+    //models are visited twice so that they can be loaded and released piece by piece
+    using ModelVisitor = function<void(const function<void(const shared_ptr<Model> &)> &)>;
+    static void save(SnapshotWriter & writer, const ModelVisitor & visit);
+    static void save(SnapshotWriter & writer, const vector<shared_ptr<Model>> & models);
+    static shared_ptr<ModelArena> load(const SnapshotReader & reader);
+
+protected:
+    uint16_t name_index(const string & name);
+    int position_attribute(const size_t index) const;
+    ArenaBlock & reserve(const size_t vertices, const size_t indices);
+
+    vector<shared_ptr<ArenaBlock>> blocks;
+
+    //per model, attributes of model i are [attribute_offsets[i], attribute_offsets[i + 1])
+    vector<uint32_t> attribute_offsets;
+
+    //per attribute
+    vector<uint32_t> block_ids;
+    vector<uint32_t> vertex_offsets;
+    vector<uint32_t> vertex_counts;
+    vector<uint32_t> index_offsets;
+    vector<uint32_t> index_counts;
+    vector<uint8_t> types;
+    vector<uint16_t> names;
+
+    vector<string> name_table;
+    shared_ptr<PropertyTable> properties;
+};
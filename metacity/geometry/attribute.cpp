@@ -1,7 +1,10 @@
+#include <unordered_map>
 #include "attribute.hpp"
 #include "triangulation.hpp"
+#include "gltfio.hpp"
+#include "serialization.hpp"
 
-Attribute::Attribute() : type(AttributeType::NONE) {}
+Attribute::Attribute(const bool indexed_) : type(AttributeType::NONE), indexed(indexed_) {}
 
 
 void Attribute::allowedAttributeType(AttributeType type) {
@@ -11,54 +14,172 @@ void Attribute::allowedAttributeType(AttributeType type) {
     this->type = type;
 }
 
-void Attribute::push_point2D(const vector<tfloat> & ivertices)
+template <typename T>
+inline tvec3 read_vertex(const T * ivertex, const size_t dim)
 {
-    allowedAttributeType(AttributeType::POINT);
+    return tvec3(ivertex[0], ivertex[1], dim == 3 ? ivertex[2] : 0);
+}
 
-    if (ivertices.size() % tvec2::length())
+template <typename T>
+void read_ring(const T * iring, const size_t count, const size_t dim, vector<vector<tvec3>> & polygon)
+{
+    if (count % dim)
         throw runtime_error("Unexpected number of elements in input array");
 
-    for (size_t i = 0; i < ivertices.size(); i += tvec2::length())
-        data.emplace_back(ivertices[i], ivertices[i + 1], 0);
+    if ((count / dim) < 3) // only a single point or a line
+        return;
+
+    vector<tvec3> ring;
+    ring.reserve(count / dim);
+    for (size_t i = 0; i < count; i += dim)
+        ring.push_back(read_vertex(iring + i, dim));
+    polygon.emplace_back(move(ring));
 }
 
-void Attribute::push_point3D(const vector<tfloat> & ivertices)
+template <typename T>
+void Attribute::push_points(const T * ivertices, const size_t count, const size_t dim)
 {
     allowedAttributeType(AttributeType::POINT);
 
-    if (ivertices.size() % tvec3::length())
+    if (count % dim)
         throw runtime_error("Unexpected number of elements in input array");
 
-    for (size_t i = 0; i < ivertices.size(); i += tvec3::length())
-        data.emplace_back(ivertices[i], ivertices[i + 1], ivertices[i + 2]);
+    data.reserve(data.size() + count / dim);
+    for (size_t i = 0; i < count; i += dim)
+    {
+        if (indexed)
+            indices.push_back(data.size());
+        data.push_back(read_vertex(ivertices + i, dim));
+    }
 }
 
-void Attribute::push_line2D(const vector<tfloat> & ivertices)
+template <typename T>
+void Attribute::push_line(const T * ivertices, const size_t count, const size_t dim)
 {
     allowedAttributeType(AttributeType::SEGMENT);
 
-    if (ivertices.size() % tvec2::length() || (ivertices.size() < tvec2::length() * 2))
+    if (count % dim || (count < dim * 2))
         throw runtime_error("Unexpected number of elements in input array");
 
-    for (size_t i = 1; i < ivertices.size() - 1; i += tvec2::length())
+    if (indexed)
+    {
+        const uint32_t base = data.size();
+        for (size_t i = 0; i < count; i += dim)
+            data.push_back(read_vertex(ivertices + i, dim));
+        for (uint32_t i = 1; i < count / dim; i++)
+        {
+            indices.push_back(base + i - 1);
+            indices.push_back(base + i);
+        }
+        return;
+    }
+
+    data.reserve(data.size() + (count / dim - 1) * 2);
+    for (size_t i = 0; i + dim < count; i += dim)
     {
-        data.emplace_back(ivertices[i], ivertices[i + 1], 0);
-        data.emplace_back(ivertices[i + 2], ivertices[i + 3], 0);
+        data.push_back(read_vertex(ivertices + i, dim));
+        data.push_back(read_vertex(ivertices + i + dim, dim));
     }
 }
 
-void Attribute::push_line3D(const vector<tfloat> & ivertices)
+template <typename T>
+void Attribute::push_polygon(const T * ivertices, const size_t count, const int64_t * ring_offsets, const size_t ring_count, const size_t dim)
 {
-    allowedAttributeType(AttributeType::SEGMENT);
+    allowedAttributeType(AttributeType::POLYGON);
 
-    if (ivertices.size() % tvec3::length() || (ivertices.size() < tvec3::length() * 2))
+    if (count % dim)
         throw runtime_error("Unexpected number of elements in input array");
 
-    for (size_t i = 1; i < ivertices.size() - 1; i += tvec3::length())
+    const int64_t vertex_count = count / dim;
+    vector<vector<tvec3>> polygon;
+    for (size_t r = 0; r < ring_count; r++)
     {
-        data.emplace_back(ivertices[i], ivertices[i + 1], ivertices[i + 2]);
-        data.emplace_back(ivertices[i + 2], ivertices[i + 3], ivertices[i + 4]);
+        const int64_t begin = ring_offsets[r], end = ring_offsets[r + 1];
+        if (begin < 0 || end < begin || end > vertex_count)
+            throw runtime_error("Ring offsets out of range");
+        read_ring(ivertices + begin * dim, (end - begin) * dim, dim, polygon);
     }
+
+    push_triangulated(polygon);
+}
+
+void Attribute::push_triangulated(vector<vector<tvec3>> & polygon)
+{
+    if (!indexed)
+        return triangulate(polygon, data.mut());
+
+    //closing vertices would be stored without ever being referenced
+    for (auto & ring : polygon)
+        if (ring.size() > 3 && ring.front() == ring.back())
+            ring.pop_back();
+    triangulate(polygon, data.mut(), indices.mut());
+}
+
+template <typename T>
+void Attribute::push_point2D(const T * ivertices, const size_t count)
+{
+    push_points(ivertices, count, tvec2::length());
+}
+
+template <typename T>
+void Attribute::push_point3D(const T * ivertices, const size_t count)
+{
+    push_points(ivertices, count, tvec3::length());
+}
+
+template <typename T>
+void Attribute::push_line2D(const T * ivertices, const size_t count)
+{
+    push_line(ivertices, count, tvec2::length());
+}
+
+template <typename T>
+void Attribute::push_line3D(const T * ivertices, const size_t count)
+{
+    push_line(ivertices, count, tvec3::length());
+}
+
+template <typename T>
+void Attribute::push_polygon2D(const T * ivertices, const size_t count, const int64_t * ring_offsets, const size_t ring_count)
+{
+    push_polygon(ivertices, count, ring_offsets, ring_count, tvec2::length());
+}
+
+template <typename T>
+void Attribute::push_polygon3D(const T * ivertices, const size_t count, const int64_t * ring_offsets, const size_t ring_count)
+{
+    push_polygon(ivertices, count, ring_offsets, ring_count, tvec3::length());
+}
+
+#define INSTANTIATE_PUSH(T) \
+    template void Attribute::push_point2D<T>(const T *, const size_t); \
+    template void Attribute::push_point3D<T>(const T *, const size_t); \
+    template void Attribute::push_line2D<T>(const T *, const size_t); \
+    template void Attribute::push_line3D<T>(const T *, const size_t); \
+    template void Attribute::push_polygon2D<T>(const T *, const size_t, const int64_t *, const size_t); \
+    template void Attribute::push_polygon3D<T>(const T *, const size_t, const int64_t *, const size_t);
+
+INSTANTIATE_PUSH(float)
+INSTANTIATE_PUSH(double)
+
+void Attribute::push_point2D(const vector<tfloat> & ivertices)
+{
+    push_point2D(ivertices.data(), ivertices.size());
+}
+
+void Attribute::push_point3D(const vector<tfloat> & ivertices)
+{
+    push_point3D(ivertices.data(), ivertices.size());
+}
+
+void Attribute::push_line2D(const vector<tfloat> & ivertices)
+{
+    push_line2D(ivertices.data(), ivertices.size());
+}
+
+void Attribute::push_line3D(const vector<tfloat> & ivertices)
+{
+    push_line3D(ivertices.data(), ivertices.size());
 }
 
 void Attribute::push_polygon2D(const vector<vector<tfloat>> & ivertices)
@@ -67,20 +188,9 @@ void Attribute::push_polygon2D(const vector<vector<tfloat>> & ivertices)
 
     vector<vector<tvec3>> polygon;
     for (const auto &iring : ivertices)
-    {
-        if (iring.size() % tvec2::length())
-            throw runtime_error("Unexpected number of elements in input array");
+        read_ring(iring.data(), iring.size(), tvec2::length(), polygon);
 
-        if ((iring.size() / tvec2::length()) < 3) // only a single point or a line
-            continue;
-
-        vector<tvec3> ring;
-        for (size_t i = 0; i < iring.size(); i += tvec2::length())
-            ring.emplace_back(iring[i], iring[i + 1], 0);
-        polygon.emplace_back(move(ring));
-    }
-
-    triangulate(polygon, data);
+    push_triangulated(polygon);
 }
 
 void Attribute::push_polygon3D(const vector<vector<tfloat>> & ivertices)
@@ -89,25 +199,16 @@ void Attribute::push_polygon3D(const vector<vector<tfloat>> & ivertices)
 
     vector<vector<tvec3>> polygon;
     for (const auto &iring : ivertices)
-    {
-        if (iring.size() % tvec3::length())
-            throw runtime_error("Unexpected number of elements in input array");
-
-        if ((iring.size() / tvec3::length()) < 3) // only a single point or a line
-            continue;
+        read_ring(iring.data(), iring.size(), tvec3::length(), polygon);
 
-        vector<tvec3> ring;
-        for (size_t i = 0; i < iring.size(); i += tvec3::length())
-            ring.emplace_back(iring[i], iring[i + 1], iring[i + 2]);
-        polygon.emplace_back(move(ring));
-    }
-
-    triangulate(polygon, data);
+    push_triangulated(polygon);
 }
 
 void Attribute::fill_normal_triangle(const tvec3 & normal)
 {
     allowedAttributeType(AttributeType::NORMAL);
+    if (indexed)
+        throw runtime_error("Normals are not supported for indexed attributes");
     data.push_back(normal);
     data.push_back(normal);
     data.push_back(normal);
@@ -143,57 +244,337 @@ tvec3 Attribute::sum() const
     return sum;
 }
 
+bool triangle_contains_xy(const tvec3 & a, const tvec3 & b, const tvec3 & c, const tfloat x, const tfloat y)
+{
+    auto side = [&](const tvec3 & p, const tvec3 & q) { return (q.x - p.x) * (y - p.y) - (q.y - p.y) * (x - p.x); };
+    const tfloat d1 = side(a, b), d2 = side(b, c), d3 = side(c, a);
+    const bool negative = d1 < 0 || d2 < 0 || d3 < 0;
+    const bool positive = d1 > 0 || d2 > 0 || d3 > 0;
+    return !(negative && positive);
+}
+
+//whether the point lies in any triangle projected onto the XY plane,
+//other primitives only check the bounding box
+bool Attribute::contains_xy(const tfloat x, const tfloat y) const
+{
+    const tvec3 min = vmin(), max = vmax();
+    if (x < min.x || x > max.x || y < min.y || y > max.y)
+        return false;
+
+    if (type != AttributeType::POLYGON)
+        return true;
+
+    const size_t count = indexed ? indices.size() : data.size();
+    for (size_t i = 0; i + 2 < count; i += 3)
+    {
+        if (indexed && triangle_contains_xy(data[indices[i]], data[indices[i + 1]], data[indices[i + 2]], x, y))
+            return true;
+        if (!indexed && triangle_contains_xy(data[i], data[i + 1], data[i + 2], x, y))
+            return true;
+    }
+    return false;
+}
+
 size_t Attribute::size() const
 {
     return data.size();
 }
 
+AttributeType Attribute::get_type() const
+{
+    return type;
+}
+
+const CowArray<tvec3> & Attribute::get_data() const
+{
+    return data;
+}
+
+const CowArray<uint32_t> & Attribute::get_indices() const
+{
+    return indices;
+}
+
+bool Attribute::is_indexed() const
+{
+    return indexed;
+}
+
+bool Attribute::is_borrowed() const
+{
+    return data.borrowed() || indices.borrowed();
+}
+
+void Attribute::borrow(AttributeType type_, shared_ptr<const void> owner, const tvec3 * vertices, const size_t count)
+{
+    type = type_;
+    data.borrow(owner, vertices, count);
+    indices.clear();
+    indexed = false;
+}
+
+void Attribute::borrow_indices(shared_ptr<const void> owner, const uint32_t * indices_, const size_t count)
+{
+    for (size_t i = 0; i < count; i++)
+        if (indices_[i] >= data.size())
+            throw runtime_error("Index out of range");
+
+    indices.borrow(owner, indices_, count);
+    indexed = true;
+}
+
+struct vertex_hash {
+    size_t operator()(const tvec3 & v) const
+    {
+        //adding zero maps -0.0 to 0.0 so that equal vertices hash equally
+        const tfloat c[3] = {v.x + 0.0f, v.y + 0.0f, v.z + 0.0f};
+        size_t h = 0;
+        for (const auto f : c)
+        {
+            uint32_t bits;
+            memcpy(&bits, &f, sizeof(bits));
+            h ^= std::hash<uint32_t>()(bits) + 0x9e3779b9 + (h << 6) + (h >> 2);
+        }
+        return h;
+    }
+};
+
+void Attribute::to_indexed()
+{
+    if (indexed)
+        return;
+
+    unordered_map<tvec3, uint32_t, vertex_hash> lookup;
+    vector<tvec3> unique;
+    indices.clear();
+    indices.reserve(data.size());
+    for (const auto & v : data)
+    {
+        const auto it = lookup.emplace(v, unique.size());
+        if (it.second)
+            unique.push_back(v);
+        indices.push_back(it.first->second);
+    }
+
+    data = move(unique);
+    indexed = true;
+}
+
+void Attribute::to_soup()
+{
+    if (!indexed)
+        return;
+
+    vector<tvec3> soup;
+    soup.reserve(indices.size());
+    for (const auto i : indices)
+        soup.push_back(data[i]);
+
+    data = move(soup);
+    indices.clear();
+    indices.shrink_to_fit();
+    indexed = false;
+}
+
+//vertices are relative to origin, the matrix is applied to the absolute positions in double precision
+void Attribute::transform(const tmat4d & matrix, const tvec3d & origin)
+{
+    for (auto & v : data.mut())
+        v = tvec3(tvec3d(matrix * glm::dvec4(origin + tvec3d(v), 1.0)) - origin);
+}
+
+void Attribute::translate(const tvec3d & offset)
+{
+    for (auto & v : data.mut())
+        v = tvec3(tvec3d(v) + offset);
+}
+
 shared_ptr<Attribute> Attribute::clone() const
 {
-    auto clone = make_shared<Attribute>();
+    auto clone = make_shared<Attribute>(indexed);
     clone->type = type;
     clone->data = data;
+    clone->indices = indices;
     return clone;
 }
 
-void Attribute::merge(shared_ptr<Attribute> other)
+struct cell_hash {
+    size_t operator()(const glm::i64vec3 & c) const
+    {
+        size_t h = 0;
+        for (int i = 0; i < 3; i++)
+            h ^= std::hash<int64_t>()(c[i]) + 0x9e3779b9 + (h << 6) + (h >> 2);
+        return h;
+    }
+};
+
+size_t primitive_size(const AttributeType type)
 {
-    if (type != other->type)
-        throw runtime_error("Cannot merge attributes of different types");
-    data.insert(data.end(), other->data.begin(), other->data.end());
+    switch (type)
+    {
+    case AttributeType::SEGMENT:
+        return 2;
+    case AttributeType::POLYGON:
+        return 3;
+    default:
+        return 1;
+    }
 }
 
-void Attribute::to_gltf(tinygltf::Model & model, AttributeType & type_, int & accessor_index) const
+//vertex clustering - vertices sharing a grid cell collapse into their mean,
+//primitives that degenerate in the process are dropped
+shared_ptr<Attribute> Attribute::simplified(const tfloat cell_size) const
 {
-    int buffer_index, buffer_size, buffer_view_index;
-    to_gltf_buffer(model, buffer_index, buffer_size);
-    to_gltf_buffer_view(model, buffer_index, buffer_size, buffer_view_index);
-    to_gltf_accessor(model, buffer_view_index, accessor_index);
-    type_ = type;
+    if (cell_size <= 0 || type == AttributeType::NONE || type == AttributeType::NORMAL)
+        return clone();
+
+    unordered_map<glm::i64vec3, uint32_t, cell_hash> cells;
+    vector<tvec3> sums;
+    vector<uint32_t> counts, cluster(data.size());
+    for (size_t i = 0; i < data.size(); i++)
+    {
+        const glm::i64vec3 cell(glm::floor(glm::dvec3(data[i]) / (double) cell_size));
+        const auto it = cells.emplace(cell, sums.size());
+        if (it.second)
+        {
+            sums.emplace_back(0);
+            counts.push_back(0);
+        }
+        sums[it.first->second] += data[i];
+        counts[it.first->second]++;
+        cluster[i] = it.first->second;
+    }
+
+    auto out = make_shared<Attribute>(indexed);
+    out->type = type;
+    vector<uint32_t> remap(sums.size(), UINT32_MAX);
+    auto emit = [&](const uint32_t c) {
+        if (!indexed)
+            return out->data.push_back(sums[c] / (tfloat) counts[c]);
+        if (remap[c] == UINT32_MAX)
+        {
+            remap[c] = out->data.size();
+            out->data.push_back(sums[c] / (tfloat) counts[c]);
+        }
+        out->indices.push_back(remap[c]);
+    };
+
+    const size_t k = primitive_size(type);
+    const size_t elements = indexed ? indices.size() : data.size();
+    vector<bool> seen(type == AttributeType::POINT ? sums.size() : 0, false);
+    for (size_t p = 0; p + k <= elements; p += k)
+    {
+        uint32_t c[3];
+        for (size_t j = 0; j < k; j++)
+            c[j] = cluster[indexed ? indices[p + j] : p + j];
+
+        if (type == AttributeType::POINT)
+        {
+            if (seen[c[0]])
+                continue;
+            seen[c[0]] = true;
+        }
+        else if (c[0] == c[1] || (k == 3 && (c[1] == c[2] || c[0] == c[2])))
+            continue;
+
+        for (size_t j = 0; j < k; j++)
+            emit(c[j]);
+    }
+
+    return out;
+}
+
+//merges attributes of one type in a single pass into storage sized up front, every vertex copied from
+//parts[i] gets ids[i] in vertex_ids; the result stays indexed only if all parts are
+shared_ptr<Attribute> Attribute::merged(const vector<shared_ptr<Attribute>> & parts, const vector<uint32_t> & ids, vector<uint32_t> & vertex_ids)
+{
+    bool all_indexed = true;
+    for (const auto & part : parts)
+    {
+        if (part->type != parts[0]->type)
+            throw runtime_error("Cannot merge attributes of different types");
+        all_indexed = all_indexed && part->indexed;
+    }
+
+    size_t vertex_count = 0, index_count = 0;
+    for (const auto & part : parts)
+    {
+        vertex_count += (all_indexed || !part->indexed) ? part->data.size() : part->indices.size();
+        index_count += all_indexed ? part->indices.size() : 0;
+    }
+    if (vertex_count > UINT32_MAX)
+        throw runtime_error("Too many vertices to merge");
+
+    auto out = make_shared<Attribute>(all_indexed);
+    out->type = parts.empty() ? AttributeType::NONE : parts[0]->type;
+    auto & data = out->data.mut();
+    auto & indices = out->indices.mut();
+    data.reserve(vertex_count);
+    indices.reserve(index_count);
+    vertex_ids.clear();
+    vertex_ids.reserve(vertex_count);
+
+    for (size_t i = 0; i < parts.size(); i++)
+    {
+        const auto & part = *parts[i];
+        const uint32_t base = data.size();
+        if (!all_indexed && part.indexed)
+            for (const auto index : part.indices)
+                data.push_back(part.data[index]);
+        else
+            data.insert(data.end(), part.data.begin(), part.data.end());
+
+        if (all_indexed)
+            for (const auto index : part.indices)
+                indices.push_back(base + index);
+        vertex_ids.resize(data.size(), ids[i]);
+    }
+    return out;
+}
+
+void Attribute::serialize(ostream & out) const
+{
+    write_value<uint8_t>(out, type);
+    write_value<uint8_t>(out, indexed);
+    write_vector(out, data);
+    write_vector(out, indices);
 }
 
-void Attribute::to_gltf_buffer(tinygltf::Model & model, int & buffer_index, int & size) const
+void Attribute::deserialize(istream & in)
 {
-    tinygltf::Buffer buffer;
-    size = data.size() * sizeof(tvec3);
-    buffer.data = vector<unsigned char>(size);
-    memcpy(buffer.data.data(), data.data(), buffer.data.size());
-    model.buffers.push_back(buffer);
-    buffer_index = model.buffers.size() - 1;
+    type = (AttributeType) read_value<uint8_t>(in);
+    indexed = read_value<uint8_t>(in);
+    read_vector(in, data.mut());
+    read_vector(in, indices.mut());
 }
 
-void Attribute::to_gltf_buffer_view(tinygltf::Model & model, const int buffer_index, const int size, int & buffer_view_index) const
+//offset is subtracted from the exported vertices, e.g. the center of a tile
+void Attribute::to_gltf(tinygltf::Model & model, AttributeType & type_, int & accessor_index, int & indices_accessor_index, const tvec3 & offset) const
 {
-    tinygltf::BufferView bufferView;
-    bufferView.buffer = buffer_index;
-    bufferView.byteLength = size;
-    bufferView.byteOffset = 0;
-    bufferView.target = TINYGLTF_TARGET_ARRAY_BUFFER;
-    model.bufferViews.push_back(bufferView);
-    buffer_view_index = model.bufferViews.size() - 1;
+    int buffer_view_index;
+    to_gltf_buffer_view(model, buffer_view_index, offset);
+    to_gltf_accessor(model, buffer_view_index, accessor_index, offset);
+    indices_accessor_index = -1;
+    if (indexed)
+        to_gltf_indices(model, indices_accessor_index);
+    type_ = type;
 }
 
-void Attribute::to_gltf_accessor(tinygltf::Model & model, const int buffer_view_index, int & accessor_index) const
+void Attribute::to_gltf_buffer_view(tinygltf::Model & model, int & buffer_view_index, const tvec3 & offset) const
+{
+    if (offset == tvec3(0))
+    {
+        buffer_view_index = gltf_append_buffer_view(model, data.data(), data.size() * sizeof(tvec3), TINYGLTF_TARGET_ARRAY_BUFFER);
+        return;
+    }
+
+    vector<tvec3> shifted(data.size());
+    for (size_t i = 0; i < data.size(); i++)
+        shifted[i] = data[i] - offset;
+    buffer_view_index = gltf_append_buffer_view(model, shifted.data(), shifted.size() * sizeof(tvec3), TINYGLTF_TARGET_ARRAY_BUFFER);
+}
+
+void Attribute::to_gltf_accessor(tinygltf::Model & model, const int buffer_view_index, int & accessor_index, const tvec3 & offset) const
 {
     tinygltf::Accessor accessor;
     accessor.bufferView = buffer_view_index;
@@ -201,17 +582,42 @@ void Attribute::to_gltf_accessor(tinygltf::Model & model, const int buffer_view_
     accessor.componentType = TINYGLTF_COMPONENT_TYPE_FLOAT;
     accessor.count = data.size();
     accessor.type = TINYGLTF_TYPE_VEC3;
-    tvec3 min = vmin();
-    tvec3 max = vmax();
+    tvec3 min = vmin() - offset;
+    tvec3 max = vmax() - offset;
     accessor.minValues = {min.x, min.y, min.z};
     accessor.maxValues = {max.x, max.y, max.z};
     model.accessors.push_back(accessor);
     accessor_index = model.accessors.size() - 1;
 }
 
+void Attribute::to_gltf_indices(tinygltf::Model & model, int & accessor_index) const
+{
+    //the largest value of the component type is reserved by glTF
+    const bool short_indices = data.size() <= 0xFFFF;
+    const size_t component_size = short_indices ? sizeof(uint16_t) : sizeof(uint32_t);
+
+    int buffer_view_index;
+    if (short_indices)
+    {
+        vector<uint16_t> short_data(indices.begin(), indices.end());
+        buffer_view_index = gltf_append_buffer_view(model, short_data.data(), short_data.size() * component_size, TINYGLTF_TARGET_ELEMENT_ARRAY_BUFFER);
+    } else {
+        buffer_view_index = gltf_append_buffer_view(model, indices.data(), indices.size() * component_size, TINYGLTF_TARGET_ELEMENT_ARRAY_BUFFER);
+    }
+
+    tinygltf::Accessor accessor;
+    accessor.bufferView = buffer_view_index;
+    accessor.byteOffset = 0;
+    accessor.componentType = short_indices ? TINYGLTF_COMPONENT_TYPE_UNSIGNED_SHORT : TINYGLTF_COMPONENT_TYPE_UNSIGNED_INT;
+    accessor.count = indices.size();
+    accessor.type = TINYGLTF_TYPE_SCALAR;
+    model.accessors.push_back(accessor);
+    accessor_index = model.accessors.size() - 1;
+}
+
 //===============================================================================
 
-void Attribute::from_gltf(const tinygltf::Model & model, AttributeType type_, const int accessor_index)
+void Attribute::from_gltf(const tinygltf::Model & model, AttributeType type_, const int accessor_index, const int indices_accessor_index)
 {
     attr_type_check(model, accessor_index);
     const tinygltf::Accessor & accessor = model.accessors[accessor_index];
@@ -219,8 +625,64 @@ void Attribute::from_gltf(const tinygltf::Model & model, AttributeType type_, co
     const tinygltf::Buffer & buffer = model.buffers[bufferView.buffer];
     type = type_;
 
-    data.resize(accessor.count);
-    memcpy(data.data(), buffer.data.data() + bufferView.byteOffset + accessor.byteOffset, bufferView.byteLength);
+    if (bufferView.byteOffset + accessor.byteOffset + accessor.count * sizeof(tvec3) > buffer.data.size())
+        throw runtime_error("Attribute buffer view size mismatch");
+
+    auto & vertices = data.mut();
+    vertices.resize(accessor.count);
+    memcpy(vertices.data(), buffer.data.data() + bufferView.byteOffset + accessor.byteOffset, accessor.count * sizeof(tvec3));
+
+    indexed = indices_accessor_index >= 0;
+    indices.clear();
+    if (indexed)
+        from_gltf_indices(model, indices_accessor_index);
+}
+
+template <typename T>
+void read_indices(const unsigned char * ptr, const size_t count, const size_t stride, vector<uint32_t> & indices)
+{
+    indices.reserve(count);
+    for (size_t i = 0; i < count; i++)
+    {
+        T index;
+        memcpy(&index, ptr + i * stride, sizeof(T));
+        indices.push_back(index);
+    }
+}
+
+void Attribute::from_gltf_indices(const tinygltf::Model & model, const int accessor_index)
+{
+    const tinygltf::Accessor & accessor = model.accessors[accessor_index];
+    const tinygltf::BufferView & bufferView = model.bufferViews[accessor.bufferView];
+    const tinygltf::Buffer & buffer = model.buffers[bufferView.buffer];
+    const unsigned char * ptr = buffer.data.data() + bufferView.byteOffset + accessor.byteOffset;
+
+    if (accessor.type != TINYGLTF_TYPE_SCALAR)
+        throw runtime_error("Indices type mismatch");
+
+    const size_t component_size = tinygltf::GetComponentSizeInBytes(accessor.componentType);
+    const size_t stride = bufferView.byteStride ? bufferView.byteStride : component_size;
+    if (bufferView.byteOffset + accessor.byteOffset + (accessor.count ? (accessor.count - 1) * stride + component_size : 0) > buffer.data.size())
+        throw runtime_error("Indices buffer view size mismatch");
+
+    switch (accessor.componentType)
+    {
+    case TINYGLTF_COMPONENT_TYPE_UNSIGNED_BYTE:
+        read_indices<uint8_t>(ptr, accessor.count, stride, indices.mut());
+        break;
+    case TINYGLTF_COMPONENT_TYPE_UNSIGNED_SHORT:
+        read_indices<uint16_t>(ptr, accessor.count, stride, indices.mut());
+        break;
+    case TINYGLTF_COMPONENT_TYPE_UNSIGNED_INT:
+        read_indices<uint32_t>(ptr, accessor.count, stride, indices.mut());
+        break;
+    default:
+        throw runtime_error("Indices component type mismatch");
+    }
+
+    for (const auto i : indices)
+        if (i >= data.size())
+            throw runtime_error("Index out of range");
 }
 
 //===============================================================================
@@ -1,6 +1,7 @@
 #pragma once
 #include <vector>
 #include "types.hpp"
+#include "cow.hpp"
 #include "gltf/tiny_gltf.h"
 
 using namespace std;
@@ -17,34 +18,76 @@ enum AttributeType {
 
 class Attribute {
 public:
-    Attribute();
+    Attribute(const bool indexed = false);
     void push_point2D(const vector<tfloat> & ivertices);
     void push_point3D(const vector<tfloat> & ivertices);
     void push_line2D(const vector<tfloat> & ivertices);
     void push_line3D(const vector<tfloat> & ivertices); 
     void push_polygon2D(const vector<vector<tfloat>> & ivertices);
     void push_polygon3D(const vector<vector<tfloat>> & ivertices); 
+
+    template <typename T>
+    void push_point2D(const T * ivertices, const size_t count);
+    template <typename T>
+    void push_point3D(const T * ivertices, const size_t count);
+    template <typename T>
+    void push_line2D(const T * ivertices, const size_t count);
+    template <typename T>
+    void push_line3D(const T * ivertices, const size_t count);
+    template <typename T>
+    void push_polygon2D(const T * ivertices, const size_t count, const int64_t * ring_offsets, const size_t ring_count);
+    template <typename T>
+    void push_polygon3D(const T * ivertices, const size_t count, const int64_t * ring_offsets, const size_t ring_count);
+
     void fill_normal_triangle(const tvec3 & normal);
-    void to_gltf(tinygltf::Model & model, AttributeType & type, int & accessor_index) const;
-    void from_gltf(const tinygltf::Model & model, AttributeType type, const int accessor_index);
+    void to_gltf(tinygltf::Model & model, AttributeType & type, int & accessor_index, int & indices_accessor_index, const tvec3 & offset = tvec3(0)) const;
+    void from_gltf(const tinygltf::Model & model, AttributeType type, const int accessor_index, const int indices_accessor_index = -1);
     tvec3 sum() const;
+    tvec3 vmin() const;
+    tvec3 vmax() const;
+    bool contains_xy(const tfloat x, const tfloat y) const;
     size_t size() const;
+    AttributeType get_type() const;
+    const CowArray<tvec3> & get_data() const;
+    const CowArray<uint32_t> & get_indices() const;
+    bool is_indexed() const;
+    bool is_borrowed() const;
+    //references memory kept alive by owner until the attribute is modified
+    void borrow(AttributeType type, shared_ptr<const void> owner, const tvec3 * vertices, const size_t count);
+    void borrow_indices(shared_ptr<const void> owner, const uint32_t * indices, const size_t count);
+    void to_indexed();
+    void to_soup();
+    void transform(const tmat4d & matrix, const tvec3d & origin);
+    void translate(const tvec3d & offset);
     shared_ptr<Attribute> clone() const;
-    void merge(shared_ptr<Attribute> attribute);
+    shared_ptr<Attribute> simplified(const tfloat cell_size) const;
+    static shared_ptr<Attribute> merged(const vector<shared_ptr<Attribute>> & parts, const vector<uint32_t> & ids, vector<uint32_t> & vertex_ids);
 
-protected:
-    tvec3 vmin() const;
-    tvec3 vmax() const;
+    void serialize(ostream & out) const;
+    void deserialize(istream & in);
 
-    void to_gltf_buffer(tinygltf::Model & model, int & buffer_index, int & size) const;
-    void to_gltf_buffer_view(tinygltf::Model & model, const int buffer_index, const int size, int & buffer_view_index) const;
-    void to_gltf_accessor(tinygltf::Model & model, const int buffer_view_index, int & accessor_index) const;
+protected:
+    void to_gltf_buffer_view(tinygltf::Model & model, int & buffer_view_index, const tvec3 & offset) const;
+    void to_gltf_accessor(tinygltf::Model & model, const int buffer_view_index, int & accessor_index, const tvec3 & offset) const;
+    void to_gltf_indices(tinygltf::Model & model, int & accessor_index) const;
+    void from_gltf_indices(const tinygltf::Model & model, const int accessor_index);
 
     void allowedAttributeType(AttributeType type);
+
+    template <typename T>
+    void push_points(const T * ivertices, const size_t count, const size_t dim);
+    template <typename T>
+    void push_line(const T * ivertices, const size_t count, const size_t dim);
+    template <typename T>
+    void push_polygon(const T * ivertices, const size_t count, const int64_t * ring_offsets, const size_t ring_count, const size_t dim);
+    void push_triangulated(vector<vector<tvec3>> & polygon);
     void attr_type_check(const tinygltf::Model & model, const int attribute_index) const;
 
-    vector<tvec3> data;
+    CowArray<tvec3> data;
+    //unique vertices are stored in data and referenced by indices when indexed
+    CowArray<uint32_t> indices;
     AttributeType type;
+    bool indexed;
 };
 
 
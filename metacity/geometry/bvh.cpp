@@ -0,0 +1,183 @@
+#include <algorithm>
+#include <cmath>
+#include "bvh.hpp"
+
+#define BVH_BINS 16
+#define BVH_MAX_SAH_DEPTH 64
+#define BVH_STACK_SIZE 128
+
+tfloat half_area(const tvec3 & min, const tvec3 & max)
+{
+    const tvec3 d = max - min;
+    return d.x * d.y + d.y * d.z + d.z * d.x;
+}
+
+BVH::BVH(const vector<tvec3> & soup, const size_t leaf_size_) : leaf_size(max(leaf_size_, (size_t) 1))
+{
+    const size_t count = soup.size() / 3;
+    vector<tvec3> bmin(count), bmax(count), centroids(count);
+    vector<uint32_t> order(count);
+    for (size_t i = 0; i < count; i++)
+    {
+        const tvec3 & a = soup[i * 3], & b = soup[i * 3 + 1], & c = soup[i * 3 + 2];
+        bmin[i] = glm::min(a, glm::min(b, c));
+        bmax[i] = glm::max(a, glm::max(b, c));
+        centroids[i] = (bmin[i] + bmax[i]) * 0.5f;
+        order[i] = i;
+    }
+
+    if (count == 0)
+        return;
+
+    nodes.reserve(2 * count / leaf_size + 1);
+    build(order, bmin, bmax, centroids, 0, count, 0);
+
+    triangles.reserve(count);
+    for (const auto i : order)
+    {
+        const tvec3 & a = soup[i * 3];
+        triangles.push_back({a, soup[i * 3 + 1] - a, soup[i * 3 + 2] - a});
+    }
+}
+
+uint32_t BVH::build(vector<uint32_t> & order, const vector<tvec3> & bmin, const vector<tvec3> & bmax,
+                    const vector<tvec3> & centroids, const size_t start, const size_t end, const size_t depth)
+{
+    const uint32_t index = nodes.size();
+    nodes.push_back({});
+
+    tvec3 lo(INFINITY), hi(-INFINITY), cmin(INFINITY), cmax(-INFINITY);
+    for (size_t i = start; i < end; i++)
+    {
+        lo = glm::min(lo, bmin[order[i]]);
+        hi = glm::max(hi, bmax[order[i]]);
+        cmin = glm::min(cmin, centroids[order[i]]);
+        cmax = glm::max(cmax, centroids[order[i]]);
+    }
+    nodes[index].min = lo;
+    nodes[index].max = hi;
+
+    const size_t count = end - start;
+    const tvec3 extent = cmax - cmin;
+    const int axis = extent.x > extent.y ? (extent.x > extent.z ? 0 : 2) : (extent.y > extent.z ? 1 : 2);
+    if (count <= leaf_size || extent[axis] <= 0)
+    {
+        nodes[index].offset = start;
+        nodes[index].count = count;
+        return index;
+    }
+
+    //bin the centroids along the longest axis and sweep for the cheapest split
+    size_t bin_count[BVH_BINS] = {};
+    tvec3 bin_min[BVH_BINS], bin_max[BVH_BINS];
+    fill(bin_min, bin_min + BVH_BINS, tvec3(INFINITY));
+    fill(bin_max, bin_max + BVH_BINS, tvec3(-INFINITY));
+    const tfloat scale = BVH_BINS / extent[axis];
+    auto bin = [&](const uint32_t i) { return min((int) ((centroids[i][axis] - cmin[axis]) * scale), BVH_BINS - 1); };
+
+    for (size_t i = start; i < end; i++)
+    {
+        const int b = bin(order[i]);
+        bin_count[b]++;
+        bin_min[b] = glm::min(bin_min[b], bmin[order[i]]);
+        bin_max[b] = glm::max(bin_max[b], bmax[order[i]]);
+    }
+
+    tfloat right_cost[BVH_BINS];
+    tvec3 acc_min(INFINITY), acc_max(-INFINITY);
+    size_t acc_count = 0;
+    for (int b = BVH_BINS - 1; b > 0; b--)
+    {
+        acc_min = glm::min(acc_min, bin_min[b]);
+        acc_max = glm::max(acc_max, bin_max[b]);
+        acc_count += bin_count[b];
+        right_cost[b] = acc_count ? acc_count * half_area(acc_min, acc_max) : 0;
+    }
+
+    int split = -1;
+    tfloat best = INFINITY;
+    acc_min = tvec3(INFINITY), acc_max = tvec3(-INFINITY), acc_count = 0;
+    for (int b = 0; b < BVH_BINS - 1; b++)
+    {
+        acc_min = glm::min(acc_min, bin_min[b]);
+        acc_max = glm::max(acc_max, bin_max[b]);
+        acc_count += bin_count[b];
+        if (acc_count == 0 || acc_count == count)
+            continue;
+        const tfloat cost = acc_count * half_area(acc_min, acc_max) + right_cost[b + 1];
+        if (cost < best)
+            best = cost, split = b;
+    }
+
+    //deep in the tree fall back to median splits to keep the depth within the trace stack
+    size_t mid = start;
+    if (split >= 0 && depth < BVH_MAX_SAH_DEPTH)
+        mid = partition(order.begin() + start, order.begin() + end, [&](const uint32_t i) { return bin(i) <= split; }) - order.begin();
+
+    if (mid == start || mid == end)
+    {
+        mid = start + count / 2;
+        nth_element(order.begin() + start, order.begin() + mid, order.begin() + end,
+                    [&](const uint32_t a, const uint32_t b) { return centroids[a][axis] < centroids[b][axis]; });
+    }
+
+    build(order, bmin, bmax, centroids, start, mid, depth + 1);
+    const uint32_t right = build(order, bmin, bmax, centroids, mid, end, depth + 1);
+    nodes[index].offset = right;
+    nodes[index].count = 0;
+    return index;
+}
+
+tfloat BVH::trace_down(const tfloat x, const tfloat y) const
+{
+    tfloat top = -INFINITY;
+    if (nodes.empty())
+        return top;
+
+    uint32_t stack[BVH_STACK_SIZE];
+    size_t depth = 0;
+    stack[depth++] = 0;
+
+    while (depth > 0)
+    {
+        const BVHNode & node = nodes[stack[--depth]];
+        if (x < node.min.x || x > node.max.x || y < node.min.y || y > node.max.y || node.max.z <= top)
+            continue;
+
+        if (node.count == 0)
+        {
+            //visit the child reaching higher first, it is more likely to occlude the other one
+            const uint32_t left = &node - nodes.data() + 1, right = node.offset;
+            if (nodes[left].max.z > nodes[right].max.z)
+                stack[depth++] = right, stack[depth++] = left;
+            else
+                stack[depth++] = left, stack[depth++] = right;
+            continue;
+        }
+
+        tfloat z;
+        for (size_t i = node.offset; i < node.offset + node.count; i++)
+            if (vertical_hit(triangles[i], x, y, z))
+                top = max(top, z);
+    }
+    return top;
+}
+
+tvec3 BVH::vmin() const
+{
+    if (nodes.empty())
+        return tvec3(0);
+    return nodes[0].min;
+}
+
+tvec3 BVH::vmax() const
+{
+    if (nodes.empty())
+        return tvec3(0);
+    return nodes[0].max;
+}
+
+size_t BVH::size() const
+{
+    return triangles.size();
+}
@@ -0,0 +1,58 @@
+#pragma once
+#include <vector>
+#include <cmath>
+#include "types.hpp"
+
+using namespace std;
+
+//triangle stored as an origin and two edges, ready for the intersection test
+struct BVHTriangle {
+    tvec3 a;
+    tvec3 e1;
+    tvec3 e2;
+};
+
+//vertical ray through (x, y) against the triangle, Möller-Trumbore reduced to the xy plane;
+//shared by the tracer and the rasterizer so that both produce the same heights
+inline bool vertical_hit(const BVHTriangle & t, const tfloat x, const tfloat y, tfloat & z)
+{
+    const tfloat det = t.e1.x * t.e2.y - t.e1.y * t.e2.x;
+    if (fabs(det) < 1e-12f)
+        return false;
+    const tfloat px = x - t.a.x, py = y - t.a.y;
+    const tfloat u = (px * t.e2.y - py * t.e2.x) / det;
+    const tfloat v = (t.e1.x * py - t.e1.y * px) / det;
+    if (u < 0 || v < 0 || u + v > 1)
+        return false;
+    z = t.a.z + u * t.e1.z + v * t.e2.z;
+    return true;
+}
+
+//interior nodes keep the left child right after themselves and point to the right one,
+//leaves point to their first triangle; count == 0 marks an interior node
+struct BVHNode {
+    tvec3 min;
+    uint32_t offset;
+    tvec3 max;
+    uint32_t count;
+};
+
+//bounding volume hierarchy over a triangle soup, built with binned SAH
+//and stored depth-first in a single node array
+class BVH {
+public:
+    BVH(const vector<tvec3> & triangles, const size_t leaf_size = 4);
+    //height of the topmost surface under the point (x, y), -INFINITY if there is none
+    tfloat trace_down(const tfloat x, const tfloat y) const;
+    tvec3 vmin() const;
+    tvec3 vmax() const;
+    size_t size() const;
+
+protected:
+    uint32_t build(vector<uint32_t> & order, const vector<tvec3> & bmin, const vector<tvec3> & bmax,
+                   const vector<tvec3> & centroids, const size_t start, const size_t end, const size_t depth);
+
+    size_t leaf_size;
+    vector<BVHNode> nodes;
+    vector<BVHTriangle> triangles;
+};
@@ -0,0 +1,110 @@
+#pragma once
+#include <vector>
+#include <memory>
+
+using namespace std;
+
+//array that either owns its items or borrows a read-only range kept alive by an owner,
+//e.g. a memory-mapped file; borrowed items are copied into owned storage on the first modification;
+//owned items can be shared, e.g. with Python buffers, and are copied when modified while shared
+template <typename T>
+class CowArray {
+public:
+    CowArray() {}
+    CowArray(const vector<T> & items_) : items(make_shared<vector<T>>(items_)) {}
+    CowArray(vector<T> && items_) : items(make_shared<vector<T>>(move(items_))) {}
+
+    CowArray & operator=(vector<T> && other)
+    {
+        release();
+        items = make_shared<vector<T>>(move(other));
+        return *this;
+    }
+
+    void borrow(shared_ptr<const void> owner_, const T * ptr_, const size_t count_)
+    {
+        items.reset();
+        owner = owner_;
+        ptr = ptr_;
+        count = count_;
+    }
+
+    //keeps the current items alive and unchanged, later modifications of the array work on a copy
+    shared_ptr<const void> share() const
+    {
+        if (owner)
+            return owner;
+        return items;
+    }
+
+    bool borrowed() const { return owner != nullptr; }
+    size_t size() const { return owner ? count : (items ? items->size() : 0); }
+    size_t capacity() const { return owner ? count : (items ? items->capacity() : 0); }
+    bool empty() const { return size() == 0; }
+    const T * data() const { return owner ? ptr : (items ? items->data() : nullptr); }
+    const T * begin() const { return data(); }
+    const T * end() const { return data() + size(); }
+    const T & operator[](const size_t i) const { return data()[i]; }
+
+    vector<T> & mut()
+    {
+        if (owner)
+        {
+            items = make_shared<vector<T>>(ptr, ptr + count);
+            release();
+        }
+        else if (!items)
+        {
+            items = make_shared<vector<T>>();
+        }
+        else if (items.use_count() > 1)
+        {
+            auto copy = make_shared<vector<T>>();
+            copy->reserve(items->capacity());
+            copy->assign(items->begin(), items->end());
+            items = copy;
+        }
+        return *items;
+    }
+
+    void reserve(const size_t size) { mut().reserve(size); }
+    void resize(const size_t size) { mut().resize(size); }
+    void push_back(const T & item) { mut().push_back(item); }
+    template <typename It>
+    void insert(const T * position, It first, It last)
+    {
+        //the inserted range may be borrowed from the same owner or shared storage
+        const auto keep = share();
+        const size_t at = position - begin();
+        auto & v = mut();
+        v.insert(v.begin() + at, first, last);
+    }
+
+    void assign(const T * first, const T * last)
+    {
+        const auto keep = share();
+        if (owner || !items || items.use_count() > 2)
+        {
+            release();
+            items = make_shared<vector<T>>(first, last);
+        }
+        else
+            items->assign(first, last);
+    }
+
+    void clear() { release(); items.reset(); }
+    void shrink_to_fit() { mut().shrink_to_fit(); }
+
+protected:
+    void release()
+    {
+        owner.reset();
+        ptr = nullptr;
+        count = 0;
+    }
+
+    shared_ptr<vector<T>> items;
+    shared_ptr<const void> owner;
+    const T * ptr = nullptr;
+    size_t count = 0;
+};
@@ -0,0 +1,230 @@
+#include <algorithm>
+#include "geojson.hpp"
+#include "gltf/json.hpp"
+#include "parallel.hpp"
+
+using json = nlohmann::json;
+
+struct GeoJSONBatch {
+    //subtracted from all positions before they are narrowed to float
+    tvec3d origin;
+    vector<shared_ptr<Model>> models;
+    //polygon triangulation is deferred and run in parallel once all features are read
+    vector<function<void()>> triangulations;
+};
+
+//===============================================================================
+// Coordinates
+
+size_t geometry_dim(const json & coordinates)
+{
+    const json * d = &coordinates;
+    while (d->is_array() && !d->empty() && d->front().is_array())
+        d = &d->front();
+
+    const size_t dim = d->size();
+    if (dim < 2 || dim > 3)
+        throw runtime_error("Encountered primitive with unsupported dimension " + to_string(dim));
+    return dim;
+}
+
+void flatten_position(const json & position, const size_t dim, const tvec3d & origin, vector<double> & out)
+{
+    if (position.size() != dim)
+        throw runtime_error("Encountered primitive with inconsistent dimension");
+
+    for (size_t i = 0; i < dim; i++)
+        out.push_back(position[i].get<double>() - origin[i]);
+}
+
+void flatten_positions(const json & positions, const size_t dim, const tvec3d & origin, vector<double> & out)
+{
+    for (const auto & position : positions)
+        flatten_position(position, dim, origin, out);
+}
+
+void flatten_rings(const json & rings, const size_t dim, const tvec3d & origin, vector<double> & out, vector<int64_t> & offsets)
+{
+    offsets.push_back(out.size() / dim);
+    for (const auto & ring : rings)
+    {
+        flatten_positions(ring, dim, origin, out);
+        offsets.push_back(out.size() / dim);
+    }
+}
+
+//===============================================================================
+// Geometry types
+
+void push_points(Attribute & attr, const vector<double> & v, const size_t dim)
+{
+    if (dim == 2)
+        attr.push_point2D(v.data(), v.size());
+    else
+        attr.push_point3D(v.data(), v.size());
+}
+
+void push_line(Attribute & attr, const vector<double> & v, const size_t dim)
+{
+    if (dim == 2)
+        attr.push_line2D(v.data(), v.size());
+    else
+        attr.push_line3D(v.data(), v.size());
+}
+
+shared_ptr<Model> to_model(shared_ptr<Attribute> attr)
+{
+    auto model = make_shared<Model>();
+    model->add_attribute("POSITION", attr);
+    return model;
+}
+
+void model_from_geometry(const json & geometry, GeoJSONBatch & batch);
+
+void model_from_point(const json & coordinates, GeoJSONBatch & batch)
+{
+    auto attr = make_shared<Attribute>();
+    const size_t dim = geometry_dim(coordinates);
+    vector<double> v;
+    flatten_position(coordinates, dim, batch.origin, v);
+    push_points(*attr, v, dim);
+    batch.models.push_back(to_model(attr));
+}
+
+void model_from_multipoint(const json & coordinates, GeoJSONBatch & batch)
+{
+    auto attr = make_shared<Attribute>();
+    const size_t dim = geometry_dim(coordinates);
+    vector<double> v;
+    flatten_positions(coordinates, dim, batch.origin, v);
+    push_points(*attr, v, dim);
+    batch.models.push_back(to_model(attr));
+}
+
+void model_from_linestring(const json & coordinates, GeoJSONBatch & batch)
+{
+    auto attr = make_shared<Attribute>();
+    const size_t dim = geometry_dim(coordinates);
+    vector<double> v;
+    flatten_positions(coordinates, dim, batch.origin, v);
+    push_line(*attr, v, dim);
+    batch.models.push_back(to_model(attr));
+}
+
+void model_from_multilinestring(const json & coordinates, GeoJSONBatch & batch)
+{
+    auto attr = make_shared<Attribute>();
+    const size_t dim = geometry_dim(coordinates);
+    vector<double> v;
+    for (const auto & line : coordinates)
+    {
+        v.clear();
+        flatten_positions(line, dim, batch.origin, v);
+        push_line(*attr, v, dim);
+    }
+    batch.models.push_back(to_model(attr));
+}
+
+void model_from_polygons(const vector<const json *> & polygons, const size_t dim, GeoJSONBatch & batch)
+{
+    auto attr = make_shared<Attribute>();
+    vector<double> v;
+    //ring_offsets hold the bounds of each polygon's rings, polygon_offsets index into them
+    vector<int64_t> ring_offsets, polygon_offsets;
+    for (const auto polygon : polygons)
+    {
+        polygon_offsets.push_back(ring_offsets.size());
+        flatten_rings(*polygon, dim, batch.origin, v, ring_offsets);
+    }
+    polygon_offsets.push_back(ring_offsets.size());
+
+    batch.triangulations.emplace_back([attr, dim, v = move(v), ring_offsets = move(ring_offsets), polygon_offsets = move(polygon_offsets)]() {
+        for (size_t p = 0; p + 1 < polygon_offsets.size(); p++)
+        {
+            const int64_t * rings = ring_offsets.data() + polygon_offsets[p];
+            const size_t ring_count = polygon_offsets[p + 1] - polygon_offsets[p] - 1;
+            if (dim == 2)
+                attr->push_polygon2D(v.data(), v.size(), rings, ring_count);
+            else
+                attr->push_polygon3D(v.data(), v.size(), rings, ring_count);
+        }
+    });
+    batch.models.push_back(to_model(attr));
+}
+
+void model_from_polygon(const json & coordinates, GeoJSONBatch & batch)
+{
+    model_from_polygons({&coordinates}, geometry_dim(coordinates), batch);
+}
+
+void model_from_multipolygon(const json & coordinates, GeoJSONBatch & batch)
+{
+    vector<const json *> polygons;
+    for (const auto & polygon : coordinates)
+        polygons.push_back(&polygon);
+    model_from_polygons(polygons, geometry_dim(coordinates), batch);
+}
+
+void model_from_geometrycollection(const json & geometry, GeoJSONBatch & batch)
+{
+    for (const auto & subgeometry : geometry.at("geometries"))
+        model_from_geometry(subgeometry, batch);
+}
+
+void model_from_geometry(const json & geometry, GeoJSONBatch & batch)
+{
+    string type = geometry.at("type").get<string>();
+    transform(type.begin(), type.end(), type.begin(), ::tolower);
+
+    if (type == "geometrycollection")
+        return model_from_geometrycollection(geometry, batch);
+
+    const json & coordinates = geometry.at("coordinates");
+    if (type == "point")
+        model_from_point(coordinates, batch);
+    else if (type == "multipoint")
+        model_from_multipoint(coordinates, batch);
+    else if (type == "linestring")
+        model_from_linestring(coordinates, batch);
+    else if (type == "multilinestring")
+        model_from_multilinestring(coordinates, batch);
+    else if (type == "polygon")
+        model_from_polygon(coordinates, batch);
+    else if (type == "multipolygon")
+        model_from_multipolygon(coordinates, batch);
+    else
+        throw runtime_error("Unsupported geometry type " + type);
+}
+
+//===============================================================================
+
+void parse_feature(const json & feature, GeoJSONBatch & batch)
+{
+    const size_t first = batch.models.size();
+    model_from_geometry(feature.at("geometry"), batch);
+
+    const auto properties = feature.find("properties");
+    const json metadata = properties != feature.end() ? *properties : json{{"data", nullptr}};
+    for (size_t i = first; i < batch.models.size(); i++)
+        batch.models[i]->set_metadata(metadata);
+}
+
+shared_ptr<Layer> parse_geojson(const char * buffer, const size_t size, const size_t threads, const tvec3d & origin)
+{
+    GeoJSONBatch batch;
+    batch.origin = origin;
+    {
+        const json data = json::parse(buffer, buffer + size);
+        for (const auto & feature : data.at("features"))
+            parse_feature(feature, batch);
+    }
+
+    parallel_for(batch.triangulations.size(), threads, [&](size_t i) {
+        batch.triangulations[i]();
+    });
+
+    auto layer = make_shared<Layer>();
+    layer->set_origin(origin);
+    layer->add_models(batch.models);
+    return layer;
+}
@@ -0,0 +1,7 @@
+#pragma once
+#include "types.hpp"
+#include "layer.hpp"
+
+using namespace std;
+
+shared_ptr<Layer> parse_geojson(const char * buffer, const size_t size, const size_t threads = 0, const tvec3d & origin = tvec3d(0));
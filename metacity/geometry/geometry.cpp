@@ -1,12 +1,15 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
 #include <pybind11/functional.h>
+#include <pybind11/numpy.h>
 #include <filesystem>
 #include "gltf/pybind11_json.hpp"
 #include "model.hpp"
 #include "attribute.hpp"
 #include "layer.hpp"
 #include "grid.hpp"
+#include "geojson.hpp"
+#include "legobuilder.hpp"
 
 #define TINYGLTF_IMPLEMENTATION
 #define STB_IMAGE_IMPLEMENTATION
@@ -16,16 +19,164 @@
 namespace py = pybind11;
 using namespace std;
 
+template <typename T>
+using carray = py::array_t<T, py::array::c_style>;
+using offset_array = py::array_t<int64_t, py::array::c_style | py::array::forcecast>;
+
+template <typename T, void (Attribute::*push)(const T *, const size_t)>
+void push_array(Attribute & self, const carray<T> & ivertices)
+{
+    const T * ptr = ivertices.data();
+    const size_t count = ivertices.size();
+    py::gil_scoped_release release;
+    (self.*push)(ptr, count);
+}
+
+template <typename T, void (Attribute::*push)(const T *, const size_t, const int64_t *, const size_t)>
+void push_polygon_array(Attribute & self, const carray<T> & ivertices, const offset_array & ring_offsets)
+{
+    const T * ptr = ivertices.data();
+    const size_t count = ivertices.size();
+    const int64_t * offsets = ring_offsets.data();
+    const size_t ring_count = ring_offsets.size() ? ring_offsets.size() - 1 : 0;
+    py::gil_scoped_release release;
+    (self.*push)(ptr, count, offsets, ring_count);
+}
+
+
+py::tuple vec_to_tuple(const tvec3 & v)
+{
+    return py::make_tuple(v.x, v.y, v.z);
+}
+
+py::tuple dvec_to_tuple(const tvec3d & v)
+{
+    return py::make_tuple(v.x, v.y, v.z);
+}
+
+tvec3d tuple_to_dvec(const array<double, 3> & v)
+{
+    return tvec3d(v[0], v[1], v[2]);
+}
+
+py::array readonly(py::array view)
+{
+    py::detail::array_proxy(view.ptr())->flags &= ~py::detail::npy_api::NPY_ARRAY_WRITEABLE_;
+    return view;
+}
+
+//the returned object keeps the shared items alive as the base of a numpy array
+py::capsule keep_alive(shared_ptr<const void> owner)
+{
+    return py::capsule(new shared_ptr<const void>(move(owner)), [](void * ptr) {
+        delete static_cast<shared_ptr<const void> *>(ptr);
+    });
+}
+
+//read-only views over the attribute data share its storage, any further modification
+//of the attribute works on a copy so that the view stays valid and unchanged
+py::array attribute_vertices(const Attribute & self)
+{
+    const auto & data = self.get_data();
+    return readonly(py::array_t<tfloat>({data.size(), (size_t) tvec3::length()},
+                                        {sizeof(tvec3), sizeof(tfloat)},
+                                        reinterpret_cast<const tfloat *>(data.data()), keep_alive(data.share())));
+}
+
+py::array attribute_indices(const Attribute & self)
+{
+    const auto & indices = self.get_indices();
+    return readonly(py::array_t<uint32_t>(indices.size(), indices.data(), keep_alive(indices.share())));
+}
+
+py::array builder_heightmap(const LegoBuilder & builder)
+{
+    const auto & heightmap = builder.get_heightmap();
+    return readonly(py::array_t<tfloat>({builder.get_height(), builder.get_width()},
+                                        {builder.get_width() * sizeof(tfloat), sizeof(tfloat)},
+                                        heightmap.data(), keep_alive(heightmap.share())));
+}
+
+template <typename T>
+void add_polygons_batch(Layer & self, const carray<T> & vertices, const offset_array & ring_offsets,
+                        const offset_array & polygon_offsets, const offset_array & model_offsets, const size_t threads)
+{
+    if (vertices.ndim() != 2)
+        throw runtime_error("Expected vertices of shape (N, 2) or (N, 3)");
+
+    auto items = [](const offset_array & offsets) { return offsets.size() ? (size_t) offsets.size() - 1 : 0; };
+    const T * ptr = vertices.data();
+    const size_t count = vertices.size(), dim = vertices.shape(1);
+    py::gil_scoped_release release;
+    self.add_polygons_batch(ptr, count, dim,
+                            ring_offsets.data(), items(ring_offsets),
+                            polygon_offsets.data(), items(polygon_offsets),
+                            model_offsets.data(), items(model_offsets), threads);
+}
+
+shared_ptr<Layer> parse_geojson_bytes(const py::buffer & buffer, const size_t threads, const array<double, 3> & origin)
+{
+    const py::buffer_info info = buffer.request();
+    const char * data = static_cast<const char *>(info.ptr);
+    const size_t size = info.size * info.itemsize;
+    py::gil_scoped_release release;
+    return parse_geojson(data, size, threads, tuple_to_dvec(origin));
+}
+
+void layer_transform(Layer & self, const py::array_t<double, py::array::c_style | py::array::forcecast> & matrix, const size_t threads)
+{
+    if (matrix.ndim() != 2 || matrix.shape(0) != 4 || matrix.shape(1) != 4)
+        throw runtime_error("Expected a 4x4 matrix");
+
+    //glm matrices are column-major
+    tmat4d m;
+    for (int r = 0; r < 4; r++)
+        for (int c = 0; c < 4; c++)
+            m[c][r] = matrix.at(r, c);
+    py::gil_scoped_release release;
+    self.transform(m, threads);
+}
 
 PYBIND11_MODULE(geometry, m) {
+    py::enum_<AttributeType>(m, "AttributeType")
+        .value("NONE", AttributeType::NONE)
+        .value("POINT", AttributeType::POINT)
+        .value("SEGMENT", AttributeType::SEGMENT)
+        .value("POLYGON", AttributeType::POLYGON)
+        .value("NORMAL", AttributeType::NORMAL);
+
     py::class_<Attribute, std::shared_ptr<Attribute>>(m, "Attribute")
-        .def(py::init<>())
-        .def("push_point2D", &Attribute::push_point2D)
-        .def("push_point3D", &Attribute::push_point3D)
-        .def("push_line2D", &Attribute::push_line2D)
-        .def("push_line3D", &Attribute::push_line3D)
-        .def("push_polygon2D", &Attribute::push_polygon2D)
-        .def("push_polygon3D", &Attribute::push_polygon3D);
+        .def(py::init<bool>(), py::arg("indexed") = false)
+        .def("push_point2D", &push_array<float, &Attribute::push_point2D<float>>, py::arg("vertices").noconvert())
+        .def("push_point2D", &push_array<double, &Attribute::push_point2D<double>>, py::arg("vertices").noconvert())
+        .def("push_point3D", &push_array<float, &Attribute::push_point3D<float>>, py::arg("vertices").noconvert())
+        .def("push_point3D", &push_array<double, &Attribute::push_point3D<double>>, py::arg("vertices").noconvert())
+        .def("push_line2D", &push_array<float, &Attribute::push_line2D<float>>, py::arg("vertices").noconvert())
+        .def("push_line2D", &push_array<double, &Attribute::push_line2D<double>>, py::arg("vertices").noconvert())
+        .def("push_line3D", &push_array<float, &Attribute::push_line3D<float>>, py::arg("vertices").noconvert())
+        .def("push_line3D", &push_array<double, &Attribute::push_line3D<double>>, py::arg("vertices").noconvert())
+        .def("push_polygon2D", &push_polygon_array<float, &Attribute::push_polygon2D<float>>, py::arg("vertices").noconvert(), py::arg("ring_offsets"))
+        .def("push_polygon2D", &push_polygon_array<double, &Attribute::push_polygon2D<double>>, py::arg("vertices").noconvert(), py::arg("ring_offsets"))
+        .def("push_polygon3D", &push_polygon_array<float, &Attribute::push_polygon3D<float>>, py::arg("vertices").noconvert(), py::arg("ring_offsets"))
+        .def("push_polygon3D", &push_polygon_array<double, &Attribute::push_polygon3D<double>>, py::arg("vertices").noconvert(), py::arg("ring_offsets"))
+        .def("push_point2D", static_cast<void (Attribute::*)(const vector<tfloat> &)>(&Attribute::push_point2D))
+        .def("push_point3D", static_cast<void (Attribute::*)(const vector<tfloat> &)>(&Attribute::push_point3D))
+        .def("push_line2D", static_cast<void (Attribute::*)(const vector<tfloat> &)>(&Attribute::push_line2D))
+        .def("push_line3D", static_cast<void (Attribute::*)(const vector<tfloat> &)>(&Attribute::push_line3D))
+        .def("push_polygon2D", static_cast<void (Attribute::*)(const vector<vector<tfloat>> &)>(&Attribute::push_polygon2D))
+        .def("push_polygon3D", static_cast<void (Attribute::*)(const vector<vector<tfloat>> &)>(&Attribute::push_polygon3D))
+        .def("simplified", &Attribute::simplified, py::arg("cell_size"))
+        .def("to_indexed", &Attribute::to_indexed)
+        .def("to_soup", &Attribute::to_soup)
+        .def_property_readonly("indexed", &Attribute::is_indexed)
+        .def_property_readonly("borrowed", &Attribute::is_borrowed)
+        .def_property_readonly("indices", &attribute_indices)
+        .def_property_readonly("vertices", &attribute_vertices)
+        .def_property_readonly("vmin", [](const Attribute & self) { return vec_to_tuple(self.vmin()); })
+        .def_property_readonly("vmax", [](const Attribute & self) { return vec_to_tuple(self.vmax()); })
+        .def_property_readonly("sum", [](const Attribute & self) { return vec_to_tuple(self.sum()); })
+        .def_property_readonly("size", &Attribute::size)
+        .def_property_readonly("type", &Attribute::get_type);
 
     py::class_<Model, std::shared_ptr<Model>>(m, "Model")
         .def(py::init<>())
@@ -36,18 +187,64 @@ PYBIND11_MODULE(geometry, m) {
         .def("attribute_exists", &Model::attribute_exists);
 
     py::class_<Layer, std::shared_ptr<Layer>>(m, "Layer")
-        .def(py::init<>())
+        .def(py::init<const bool>(), py::arg("compact") = false)
         .def("add_model", &Layer::add_model)
         .def("add_models", &Layer::add_models)
+        .def("add_polygons_batch", &add_polygons_batch<float>, py::arg("vertices").noconvert(), py::arg("ring_offsets"),
+             py::arg("polygon_offsets"), py::arg("model_offsets"), py::arg("threads") = 0)
+        .def("add_polygons_batch", &add_polygons_batch<double>, py::arg("vertices").noconvert(), py::arg("ring_offsets"),
+             py::arg("polygon_offsets"), py::arg("model_offsets"), py::arg("threads") = 0)
         .def("get_models", &Layer::get_models)
-        .def("to_gltf", &Layer::to_gltf)
-        .def("from_gltf", &Layer::from_gltf)
+        .def("get_model", &Layer::get_model, py::arg("index"))
+        .def("compact", &Layer::compact, py::arg("threads") = 0, py::call_guard<py::gil_scoped_release>())
+        .def("save", &Layer::save, py::arg("filename"), py::call_guard<py::gil_scoped_release>())
+        .def_static("load", &Layer::load, py::arg("filename"), py::arg("mmap") = true, py::arg("verify") = true,
+                    py::call_guard<py::gil_scoped_release>())
+        .def_property_readonly("is_compact", &Layer::is_compact)
+        .def("set_origin", [](Layer & self, const array<double, 3> & origin, const size_t threads) {
+            self.set_origin(tuple_to_dvec(origin), threads);
+        }, py::arg("origin"), py::arg("threads") = 0, py::call_guard<py::gil_scoped_release>())
+        .def_property_readonly("origin", [](const Layer & self) { return dvec_to_tuple(self.get_origin()); })
+        .def("transform", &layer_transform, py::arg("matrix"), py::arg("threads") = 0)
+        .def("build_index", &Layer::build_index, py::arg("node_size") = 16, py::call_guard<py::gil_scoped_release>())
+        .def("query_bbox", [](Layer & self, const array<double, 2> & min, const array<double, 2> & max) {
+            return self.query_bbox(tvec2d(min[0], min[1]), tvec2d(max[0], max[1]));
+        }, py::arg("min"), py::arg("max"), py::call_guard<py::gil_scoped_release>())
+        .def("query_point", &Layer::query_point, py::arg("x"), py::arg("y"), py::call_guard<py::gil_scoped_release>())
+        .def("query_nearest", &Layer::query_nearest, py::arg("x"), py::arg("y"), py::arg("k") = 1, py::call_guard<py::gil_scoped_release>())
+        .def("to_gltf", &Layer::to_gltf, py::arg("filename"), py::arg("binary") = false, py::arg("pretty") = true)
+        .def("from_gltf", &Layer::from_gltf, py::arg("filename"), py::arg("lazy") = false)
         .def_property_readonly("size", &Layer::size);
 
     py::class_<Grid, std::shared_ptr<Grid>>(m, "Grid")
-        .def(py::init<tfloat, tfloat>())
+        .def(py::init<tfloat, tfloat, const string &, size_t>(), py::arg("width"), py::arg("height"),
+             py::arg("spill_folder") = "", py::arg("spill_budget") = 256 << 20)
         .def("add_layer", &Grid::add_layer)
         .def("add_model", &Grid::add_model)
-        .def("to_gltf", &Grid::to_gltf)
+        .def("to_gltf", &Grid::to_gltf, py::arg("folder"), py::arg("merge"), py::arg("binary") = false, py::arg("pretty") = true,
+             py::arg("threads") = 0, py::arg("levels") = 1, py::arg("resolution") = 64,
+             py::arg("incremental") = false, py::call_guard<py::gil_scoped_release>())
+        .def("save", &Grid::save, py::arg("filename"), py::call_guard<py::gil_scoped_release>())
+        .def_static("load", &Grid::load, py::arg("filename"), py::arg("mmap") = true, py::arg("verify") = true,
+                    py::call_guard<py::gil_scoped_release>())
+        .def("set_origin", [](Grid & self, const array<double, 3> & origin) { self.set_origin(tuple_to_dvec(origin)); }, py::arg("origin"))
+        .def_property_readonly("origin", [](const Grid & self) { return dvec_to_tuple(self.get_origin()); })
         .def_property_readonly("grid", &Grid::get_grid);
+
+    py::enum_<HeightmapMethod>(m, "HeightmapMethod")
+        .value("TRACE", HeightmapMethod::TRACE)
+        .value("RASTER", HeightmapMethod::RASTER);
+
+    py::class_<LegoBuilder, std::shared_ptr<LegoBuilder>>(m, "LegoBuilder")
+        .def(py::init<>())
+        .def("insert_model", &LegoBuilder::insert_model)
+        .def("insert_layer", &LegoBuilder::insert_layer)
+        .def("insert_grid", &LegoBuilder::insert_grid)
+        .def("build_heightmap", &LegoBuilder::build_heightmap, py::arg("xmin"), py::arg("ymin"), py::arg("xmax"), py::arg("ymax"),
+             py::arg("resolution"), py::arg("threads") = 0, py::arg("method") = HeightmapMethod::RASTER, py::call_guard<py::gil_scoped_release>())
+        .def_property_readonly("heightmap", &builder_heightmap)
+        .def_property_readonly("origin", [](const LegoBuilder & self) { return dvec_to_tuple(self.get_origin()); });
+
+    m.def("parse_geojson_bytes", &parse_geojson_bytes, py::arg("buffer"), py::arg("threads") = 0,
+          py::arg("origin") = array<double, 3>{0, 0, 0});
 }
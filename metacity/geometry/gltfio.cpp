@@ -0,0 +1,104 @@
+#include <iostream>
+#include <fstream>
+#include <cstring>
+#include "gltfio.hpp"
+
+tinygltf::Model gltf_model_init()
+{
+    tinygltf::Model model;
+    model.asset.version = "2.0";
+    model.asset.generator = "Metacity";
+    return model;
+}
+
+//all data of a file is packed into the first buffer, so that GLB files keep it in a single BIN chunk
+int gltf_append_buffer_view(tinygltf::Model & model, const void * data, const size_t size, const int target, const size_t alignment)
+{
+    if (model.buffers.empty())
+        model.buffers.emplace_back();
+
+    auto & buffer = model.buffers[0].data;
+    const size_t offset = (buffer.size() + alignment - 1) / alignment * alignment;
+    buffer.resize(offset + size);
+    if (size)
+        memcpy(buffer.data() + offset, data, size);
+
+    tinygltf::BufferView bufferView;
+    bufferView.buffer = 0;
+    bufferView.byteLength = size;
+    bufferView.byteOffset = offset;
+    bufferView.target = target;
+    model.bufferViews.push_back(bufferView);
+    return model.bufferViews.size() - 1;
+}
+
+void gltf_write(tinygltf::Model & model, const string & filename, const bool binary, const bool pretty)
+{
+    tinygltf::TinyGLTF gltf;
+    if (!gltf.WriteGltfSceneToFile(&model, filename, true, true, pretty, binary))
+        throw runtime_error("Failed to write " + filename);
+}
+
+bool is_binary_gltf(const string & filename)
+{
+    char magic[4] = {0};
+    ifstream file(filename, ios::binary);
+    file.read(magic, sizeof(magic));
+    return file && memcmp(magic, "glTF", sizeof(magic)) == 0;
+}
+
+bool gltf_read(tinygltf::Model & model, const string & filename)
+{
+    tinygltf::TinyGLTF gltf;
+    string err, warn;
+
+    bool ret;
+    if (is_binary_gltf(filename))
+        ret = gltf.LoadBinaryFromFile(&model, &err, &warn, filename);
+    else
+        ret = gltf.LoadASCIIFromFile(&model, &err, &warn, filename);
+
+    if (!err.empty()) {
+        cout << err << endl;
+    }
+
+    if (!warn.empty()) {
+        cout << warn << endl;
+    }
+
+    return ret;
+}
+
+
+//vertices are written relative to origin, the nodes carry the exact offset as RTC-style translation
+void gltf_set_origin(tinygltf::Model & model, const tvec3d & origin)
+{
+    if (origin == tvec3d(0))
+        return;
+
+    for (auto & node : model.nodes)
+        node.translation = {origin.x, origin.y, origin.z};
+}
+
+//translation of the first node referencing each mesh, rotations, scales and node hierarchies are not applied
+vector<tvec3d> gltf_mesh_translations(const tinygltf::Model & model)
+{
+    vector<tvec3d> translations(model.meshes.size(), tvec3d(0));
+    vector<bool> found(model.meshes.size(), false);
+    for (const auto & node : model.nodes)
+    {
+        if (node.mesh < 0 || node.mesh >= (int) model.meshes.size() || found[node.mesh])
+            continue;
+        found[node.mesh] = true;
+        if (node.translation.size() == 3)
+            translations[node.mesh] = tvec3d(node.translation[0], node.translation[1], node.translation[2]);
+    }
+    return translations;
+}
+
+//application-specific attributes start with an underscore, e.g. _FEATURE_ID_0 of merged tiles,
+//they are skipped on import
+bool gltf_imported_attribute(const string & name)
+{
+    return name.empty() || name[0] != '_';
+}
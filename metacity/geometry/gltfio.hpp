@@ -0,0 +1,14 @@
+#pragma once
+#include <string>
+#include "gltf/tiny_gltf.h"
+#include "types.hpp"
+
+using namespace std;
+
+tinygltf::Model gltf_model_init();
+int gltf_append_buffer_view(tinygltf::Model & model, const void * data, const size_t size, const int target, const size_t alignment = 4);
+void gltf_write(tinygltf::Model & model, const string & filename, const bool binary, const bool pretty);
+bool gltf_read(tinygltf::Model & model, const string & filename);
+void gltf_set_origin(tinygltf::Model & model, const tvec3d & origin);
+vector<tvec3d> gltf_mesh_translations(const tinygltf::Model & model);
+bool gltf_imported_attribute(const string & name);
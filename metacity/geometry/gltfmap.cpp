@@ -0,0 +1,266 @@
+#include <cstring>
+#include <filesystem>
+#include "gltfmap.hpp"
+#include "cppcodec/base64_rfc4648.hpp"
+#include "gltf/tiny_gltf.h"
+#include "gltfio.hpp"
+
+#define GLB_HEADER_SIZE 12
+#define GLB_CHUNK_JSON 0x4E4F534A
+#define GLB_CHUNK_BIN 0x004E4942
+
+uint32_t read_u32(const uint8_t * ptr)
+{
+    uint32_t value;
+    memcpy(&value, ptr, sizeof(value));
+    return value;
+}
+
+GltfMapping::GltfMapping(const string & filename)
+{
+    auto file = make_shared<MappedFile>(filename);
+    Range bin = {nullptr, 0};
+    if (file->size() >= 4 && memcmp(file->data(), "glTF", 4) == 0)
+        parse_glb(file, bin);
+    else
+        document = nlohmann::json::parse(file->data(), file->data() + file->size());
+
+    resolve_buffers(filesystem::path(filename).parent_path().string(), bin);
+
+    properties = PropertyTable::from_gltf(document.value("extensions", nlohmann::json::object()),
+                                          [this](size_t index) { return view_data(index); });
+    if (properties && properties->size() != mesh_count())
+        properties.reset();
+
+    const size_t meshes = mesh_count();
+    for (size_t i = 0; i < meshes; i++)
+        for (size_t j = 0; j < document.at("meshes")[i].at("primitives").size(); j++)
+            parts.emplace_back(i, j);
+
+    translations.assign(meshes, tvec3d(0));
+    vector<bool> found(meshes, false);
+    for (const auto & node : document.value("nodes", nlohmann::json::array()))
+    {
+        const size_t mesh = node.value("mesh", meshes);
+        if (mesh >= meshes || found[mesh])
+            continue;
+        found[mesh] = true;
+        const auto translation = node.value("translation", vector<double>());
+        if (translation.size() == 3)
+            translations[mesh] = tvec3d(translation[0], translation[1], translation[2]);
+    }
+}
+
+void GltfMapping::parse_glb(const shared_ptr<MappedFile> & file, Range & bin)
+{
+    if (file->size() < GLB_HEADER_SIZE)
+        throw runtime_error("Truncated GLB header");
+
+    const uint8_t * data = file->data();
+    const size_t size = min((size_t) read_u32(data + 8), file->size());
+    size_t offset = GLB_HEADER_SIZE;
+    while (offset + 8 <= size)
+    {
+        const size_t length = read_u32(data + offset);
+        const uint32_t type = read_u32(data + offset + 4);
+        const uint8_t * chunk = data + offset + 8;
+        if (offset + 8 + length > size)
+            throw runtime_error("Truncated GLB chunk");
+
+        if (type == GLB_CHUNK_JSON)
+            document = nlohmann::json::parse(chunk, chunk + length);
+        else if (type == GLB_CHUNK_BIN && !bin.data)
+            bin = {chunk, length};
+        offset += 8 + length;
+    }
+
+    if (document.is_null())
+        throw runtime_error("GLB file without JSON chunk");
+    //the BIN chunk is referenced in place
+    if (bin.data)
+        files.push_back(file);
+}
+
+void GltfMapping::resolve_buffers(const string & folder, const Range & bin)
+{
+    for (const auto & buffer : document.value("buffers", nlohmann::json::array()))
+    {
+        const size_t length = buffer.value("byteLength", (size_t) 0);
+        Range range;
+        if (!buffer.count("uri"))
+        {
+            if (!bin.data || !buffers.empty())
+                throw runtime_error("Buffer without uri outside of the GLB BIN chunk");
+            range = bin;
+        }
+        else
+        {
+            const string uri = buffer.at("uri");
+            if (uri.rfind("data:", 0) == 0)
+            {
+                const size_t comma = uri.find(',');
+                if (comma == string::npos)
+                    throw runtime_error("Malformed data uri");
+                auto bytes = make_shared<vector<uint8_t>>(cppcodec::base64_rfc4648::decode(uri.data() + comma + 1, uri.size() - comma - 1));
+                decoded.push_back(bytes);
+                range = {bytes->data(), bytes->size()};
+            }
+            else
+            {
+                auto file = make_shared<MappedFile>((filesystem::path(folder) / uri).string());
+                files.push_back(file);
+                range = {file->data(), file->size()};
+            }
+        }
+
+        if (range.size < length)
+            throw runtime_error("Buffer shorter than its byteLength");
+        buffers.push_back(range);
+    }
+}
+
+size_t GltfMapping::mesh_count() const
+{
+    return document.count("meshes") ? document.at("meshes").size() : 0;
+}
+
+size_t GltfMapping::model_count() const
+{
+    return parts.size();
+}
+
+tvec3d GltfMapping::model_translation(const size_t model_index) const
+{
+    return translations.at(parts.at(model_index).first);
+}
+
+pair<const uint8_t *, size_t> GltfMapping::view_data(const size_t view_index) const
+{
+    const auto & view = document.at("bufferViews").at(view_index);
+    const size_t buffer = view.at("buffer").get<size_t>();
+    if (buffer >= buffers.size())
+        throw runtime_error("Buffer index out of range");
+
+    const size_t offset = view.value("byteOffset", (size_t) 0);
+    const size_t length = view.at("byteLength").get<size_t>();
+    if (offset + length > buffers[buffer].size)
+        throw runtime_error("Buffer view out of range");
+    return {buffers[buffer].data + offset, length};
+}
+
+const uint8_t * GltfMapping::accessor_data(const nlohmann::json & accessor, const size_t element_size, size_t & count, size_t & stride) const
+{
+    if (!accessor.count("bufferView"))
+        throw runtime_error("Accessors without buffer views are not supported");
+
+    const size_t view_index = accessor.at("bufferView").get<size_t>();
+    const auto view = view_data(view_index);
+    const size_t offset = accessor.value("byteOffset", (size_t) 0);
+    count = accessor.at("count").get<size_t>();
+    stride = document.at("bufferViews").at(view_index).value("byteStride", element_size);
+
+    if (count && offset + (count - 1) * stride + element_size > view.second)
+        throw runtime_error("Accessor out of range");
+    return view.first + offset;
+}
+
+template <typename T>
+bool aligned(const uint8_t * ptr, const size_t stride)
+{
+    return stride == sizeof(T) && reinterpret_cast<uintptr_t>(ptr) % alignof(T) == 0;
+}
+
+void GltfMapping::load_positions(Attribute & attribute, const AttributeType type, const size_t accessor_index) const
+{
+    const auto & accessor = document.at("accessors").at(accessor_index);
+    if (accessor.value("type", "") != "VEC3")
+        throw runtime_error("Attribute type mismatch");
+    if (accessor.value("componentType", 0) != TINYGLTF_COMPONENT_TYPE_FLOAT)
+        throw runtime_error("Attribute component type mismatch");
+
+    size_t count, stride;
+    const uint8_t * ptr = accessor_data(accessor, sizeof(tvec3), count, stride);
+    if (aligned<tvec3>(ptr, stride))
+    {
+        attribute.borrow(type, shared_from_this(), reinterpret_cast<const tvec3 *>(ptr), count);
+        return;
+    }
+
+    //interleaved or misaligned data is gathered once
+    auto vertices = make_shared<vector<tvec3>>(count);
+    for (size_t i = 0; i < count; i++)
+        memcpy(&(*vertices)[i], ptr + i * stride, sizeof(tvec3));
+    attribute.borrow(type, vertices, vertices->data(), count);
+}
+
+template <typename T>
+shared_ptr<vector<uint32_t>> widen_indices(const uint8_t * ptr, const size_t count, const size_t stride)
+{
+    auto indices = make_shared<vector<uint32_t>>(count);
+    for (size_t i = 0; i < count; i++)
+    {
+        T index;
+        memcpy(&index, ptr + i * stride, sizeof(T));
+        (*indices)[i] = index;
+    }
+    return indices;
+}
+
+void GltfMapping::load_indices(Attribute & attribute, const size_t accessor_index) const
+{
+    const auto & accessor = document.at("accessors").at(accessor_index);
+    if (accessor.value("type", "") != "SCALAR")
+        throw runtime_error("Indices type mismatch");
+
+    const int component = accessor.value("componentType", 0);
+    const size_t component_size = tinygltf::GetComponentSizeInBytes(component);
+    if (component != TINYGLTF_COMPONENT_TYPE_UNSIGNED_BYTE && component != TINYGLTF_COMPONENT_TYPE_UNSIGNED_SHORT
+        && component != TINYGLTF_COMPONENT_TYPE_UNSIGNED_INT)
+        throw runtime_error("Indices component type mismatch");
+
+    size_t count, stride;
+    const uint8_t * ptr = accessor_data(accessor, component_size, count, stride);
+    if (component == TINYGLTF_COMPONENT_TYPE_UNSIGNED_INT && aligned<uint32_t>(ptr, stride))
+    {
+        attribute.borrow_indices(shared_from_this(), reinterpret_cast<const uint32_t *>(ptr), count);
+        return;
+    }
+
+    //narrower indices are widened once
+    shared_ptr<vector<uint32_t>> indices;
+    if (component == TINYGLTF_COMPONENT_TYPE_UNSIGNED_BYTE)
+        indices = widen_indices<uint8_t>(ptr, count, stride);
+    else if (component == TINYGLTF_COMPONENT_TYPE_UNSIGNED_SHORT)
+        indices = widen_indices<uint16_t>(ptr, count, stride);
+    else
+        indices = widen_indices<uint32_t>(ptr, count, stride);
+    attribute.borrow_indices(indices, indices->data(), count);
+}
+
+shared_ptr<Model> GltfMapping::load_model(const size_t model_index) const
+{
+    const size_t mesh_index = parts.at(model_index).first;
+    const auto & mesh = document.at("meshes").at(mesh_index);
+    const auto & primitive = mesh.at("primitives").at(parts[model_index].second);
+    const auto & attributes = primitive.at("attributes");
+    size_t imported = 0;
+    for (auto it = attributes.begin(); it != attributes.end(); ++it)
+        imported += gltf_imported_attribute(it.key());
+    if (imported != 1)
+        throw runtime_error("Only one attribute per primitive is supported");
+    if (!attributes.count("POSITION"))
+        throw runtime_error("Attribute does not exist");
+
+    auto attribute = make_shared<Attribute>();
+    load_positions(*attribute, type_from_gltf(primitive.value("mode", TINYGLTF_MODE_TRIANGLES)), attributes.at("POSITION").get<size_t>());
+    if (primitive.count("indices"))
+        load_indices(*attribute, primitive.at("indices").get<size_t>());
+
+    auto model = make_shared<Model>();
+    model->add_attribute("POSITION", attribute);
+    if (properties)
+        model->bind_metadata(properties, mesh_index);
+    else
+        model->set_metadata(mesh.value("extras", nlohmann::json::object()));
+    return model;
+}
@@ -0,0 +1,47 @@
+#pragma once
+#include <vector>
+#include "types.hpp"
+#include "model.hpp"
+#include "mapped.hpp"
+#include "properties.hpp"
+#include "gltf/json.hpp"
+
+using namespace std;
+
+//glTF document with memory-mapped buffers, GLB chunks and external .bin files are mapped,
+//embedded data URIs are decoded once; meshes are turned into models on request and their
+//attributes borrow the vertex data straight from the buffers
+class GltfMapping : public enable_shared_from_this<GltfMapping> {
+public:
+    GltfMapping(const string & filename);
+    //every primitive of a mesh becomes a model, the models follow the order of the meshes
+    size_t model_count() const;
+    tvec3d model_translation(const size_t model_index) const;
+    shared_ptr<Model> load_model(const size_t model_index) const;
+
+protected:
+    struct Range {
+        const uint8_t * data;
+        size_t size;
+    };
+
+    void parse_glb(const shared_ptr<MappedFile> & file, Range & bin);
+    void resolve_buffers(const string & folder, const Range & bin);
+    pair<const uint8_t *, size_t> view_data(const size_t view_index) const;
+    const uint8_t * accessor_data(const nlohmann::json & accessor, const size_t element_size, size_t & count, size_t & stride) const;
+    void load_positions(Attribute & attribute, const AttributeType type, const size_t accessor_index) const;
+    void load_indices(Attribute & attribute, const size_t accessor_index) const;
+
+    size_t mesh_count() const;
+
+    nlohmann::json document;
+    vector<Range> buffers;
+    vector<shared_ptr<MappedFile>> files;
+    vector<shared_ptr<vector<uint8_t>>> decoded;
+    //metadata of the meshes, one row per mesh
+    shared_ptr<const PropertyTable> properties;
+    //translation of the first node referencing each mesh
+    vector<tvec3d> translations;
+    //mesh and primitive of every model
+    vector<pair<size_t, size_t>> parts;
+};
@@ -1,19 +1,84 @@
 #include <fstream>
+#include <sstream>
+#include <algorithm>
+#include <map>
+#include <filesystem>
+#include <random>
+#include <regex>
 #include "grid.hpp"
 #include "progress.hpp"
 #include "gltf/json.hpp"
+#include "gltfio.hpp"
+#include "parallel.hpp"
+#include "snapshot.hpp"
 
 
-Grid::Grid(tfloat _width, tfloat _height) : width(_width), height(_height) {}
+static const int GRID_MANIFEST_VERSION = 1;
+
+Grid::Grid(tfloat _width, tfloat _height, const string & _spill_folder, const size_t _spill_budget) 
+    : width(_width), height(_height), spill_folder(_spill_folder), spill_budget(_spill_budget), pending_size(0) 
+{
+    if (streaming()) {
+        //every grid spills into a directory of its own, files left in the folder by other grids
+        //or by interrupted runs are never read
+        filesystem::create_directories(spill_folder);
+        random_device random;
+        do {
+            char name[32];
+            snprintf(name, sizeof(name), "grid_%08x%08x", random(), random());
+            spill_directory = spill_folder + "/" + name;
+        } while (!filesystem::create_directory(spill_directory));
+    }
+}
+
+Grid::~Grid()
+{
+    if (streaming()) {
+        error_code ignored;
+        filesystem::remove_all(spill_directory, ignored);
+    }
+}
 
 void Grid::add_layer(shared_ptr<Layer> layer) {
+    if (grid.empty() && spilled.empty() && !origin_set) {
+        origin = layer->get_origin();
+    }
+
+    //models of layers with another origin are moved into copies
+    const tvec3d shift = layer->get_origin() - origin;
     Progress bar("Creating grid");
-    for (auto model : layer->get_models()) {
+    //views of compact layers are not cached in the layer
+    const size_t count = layer->size();
+    for (size_t i = 0; i < count; i++) {
+        auto model = layer->view(i);
         bar.update();
+        if (shift != tvec3d(0)) {
+            model = model->clone();
+            model->translate(shift);
+        }
         add_model(model);
     }
 }
 
+tvec3d Grid::get_origin() const
+{
+    return origin;
+}
+
+//models added later are expected relative to the origin, layers are moved to it
+void Grid::set_origin(const tvec3d & new_origin)
+{
+    if (new_origin == origin) {
+        origin_set = true;
+        return;
+    }
+    if (!grid.empty() || !spilled.empty()) {
+        throw runtime_error("The origin of a grid can only be changed before models are added");
+    }
+    origin = new_origin;
+    origin_set = true;
+}
+
 void Grid::add_model(shared_ptr<Model> model) 
 {
     tvec3 centroid = model->get_centroid();
@@ -21,60 +86,455 @@ void Grid::add_model(shared_ptr<Model> model)
     int y = (int) floor(centroid.y / height);
     
     pair<int, int> key = make_pair(x, y);
+    if (streaming()) {
+        spill_model(key, model);
+        return;
+    }
+
     if (grid.find(key) == grid.end()) {
         grid[key] = vector<shared_ptr<Model>>();
     }
     grid[key].push_back(model);
 }
 
-void Grid::to_gltf(const string & folder, bool merge) const
+string tile_name(const pair<int, int> & key, const bool binary)
+{
+    return "tile" + to_string(key.first) + "_" + to_string(key.second) + (binary ? ".glb" : ".gltf");
+}
+
+bool Grid::streaming() const
+{
+    return !spill_folder.empty();
+}
+
+string Grid::spill_file(const pair<int, int> & key) const
+{
+    return spill_directory + "/tile" + to_string(key.first) + "_" + to_string(key.second) + ".spill";
+}
+
+void Grid::spill_model(const pair<int, int> & key, shared_ptr<Model> model)
+{
+    ostringstream record;
+    model->serialize(record);
+    const string data = record.str();
+
+    pending[key] += data;
+    pending_size += data.size();
+    spilled[key]++;
+
+    if (pending_size > spill_budget) {
+        flush_spill();
+    }
+}
+
+void Grid::flush_spill()
 {
-    Progress bar("Exporting grid");
+    for (auto & pair : pending) {
+        ofstream file(spill_file(pair.first), ios::binary | ios::app);
+        file.write(pair.second.data(), pair.second.size());
+        if (!file) {
+            throw runtime_error("Failed to write " + spill_file(pair.first));
+        }
+    }
+    pending.clear();
+    pending_size = 0;
+}
+
+vector<shared_ptr<Model>> Grid::tile_models(const pair<int, int> & key) const
+{
+    if (!streaming()) {
+        return grid.at(key);
+    }
+
+    vector<shared_ptr<Model>> models;
+    ifstream file(spill_file(key), ios::binary);
+    for (size_t i = 0; i < spilled.at(key); i++) {
+        auto model = make_shared<Model>();
+        model->deserialize(file);
+        models.push_back(model);
+    }
+    return models;
+}
+
+size_t Grid::tile_size(const pair<int, int> & key) const
+{
+    if (!streaming()) {
+        return grid.at(key).size();
+    }
+    return spilled.at(key);
+}
+
+unordered_map<pair<int, int>, vector<shared_ptr<Model>>, hash_pair> Grid::get_grid() const
+{
+    if (streaming()) {
+        throw runtime_error("Grid is streamed to disk, tiles are only available through to_gltf");
+    }
+    return grid;
+}
+
+vector<shared_ptr<Model>> Grid::get_models()
+{
+    flush_spill();
+    vector<shared_ptr<Model>> models;
+    for (const auto & key : sorted_keys()) {
+        const auto tile = tile_models(key);
+        models.insert(models.end(), tile.begin(), tile.end());
+    }
+    return models;
+}
+
+vector<pair<int, int>> Grid::sorted_keys() const
+{
+    vector<pair<int, int>> keys;
+    keys.reserve(grid.size() + spilled.size());
     for (auto & pair : grid) {
-        bar.update();
+        keys.push_back(pair.first);
+    }
+    for (auto & pair : spilled) {
+        keys.push_back(pair.first);
+    }
+    sort(keys.begin(), keys.end());
+    return keys;
+}
+
+string lod_tile_name(const pair<int, int> & key, const size_t level, const bool binary)
+{
+    if (level == 0) {
+        return tile_name(key, binary);
+    }
+    return "lod" + to_string(level) + "_" + tile_name(key, binary);
+}
+
+int floor_div(const int value, const int divisor)
+{
+    return (int) floor((double) value / divisor);
+}
+
+bool has_geometry(const shared_ptr<Model> & model)
+{
+    if (!model->attribute_exists("POSITION")) {
+        return false;
+    }
+    const auto position = model->get_attribute("POSITION");
+    return position->is_indexed() ? !position->get_indices().empty() : !position->get_data().empty();
+}
+
+//content hash of a tile, covers the export settings and the geometry and metadata of the member models in order
+class TileHash {
+public:
+    TileHash(const nlohmann::json & settings)
+    {
+        text(settings.dump());
+    }
+
+    void add(const vector<shared_ptr<Model>> & models)
+    {
+        for (auto & model : models) {
+            const auto names = model->get_attribute_names();
+            const uint64_t count = names.size();
+            bytes(&count, sizeof(count));
+            for (auto & name : names) {
+                const auto attribute = model->get_attribute(name);
+                const auto & data = attribute->get_data();
+                const uint64_t header[3] = {(uint64_t) attribute->get_type(), data.size(), attribute->is_indexed() ? attribute->get_indices().size() : UINT64_MAX};
+                text(name);
+                bytes(header, sizeof(header));
+                bytes(data.data(), data.size() * sizeof(tvec3));
+                if (attribute->is_indexed()) {
+                    bytes(attribute->get_indices().data(), attribute->get_indices().size() * sizeof(uint32_t));
+                }
+            }
+            text(model->get_metadata().dump());
+        }
+    }
+
+    string digest() const
+    {
+        char hex[17];
+        snprintf(hex, sizeof(hex), "%016llx", (unsigned long long) checksum.digest());
+        return hex;
+    }
+
+protected:
+    void bytes(const void * data, const size_t size)
+    {
+        checksum.update(static_cast<const uint8_t *>(data), size);
+    }
+
+    void text(const string & value)
+    {
+        const uint64_t size = value.size();
+        bytes(&size, sizeof(size));
+        bytes(value.data(), value.size());
+    }
+
+    SnapshotChecksum checksum;
+};
+
+//only files named by the export are removed, a stale or edited manifest cannot reach outside the folder
+bool is_tile_name(const string & name)
+{
+    static const regex pattern("(lod[0-9]+_)?tile-?[0-9]+_-?[0-9]+\\.(glb|gltf)");
+    return regex_match(name, pattern);
+}
+
+nlohmann::json read_manifest(const string & folder)
+{
+    ifstream file(folder + "/manifest.json");
+    if (!file) {
+        return nlohmann::json::object();
+    }
+    try {
+        auto manifest = nlohmann::json::parse(file);
+        if (manifest.is_object() && manifest.count("version") && manifest["version"] == GRID_MANIFEST_VERSION && manifest.count("tiles")) {
+            return manifest["tiles"];
+        }
+    } catch (const nlohmann::json::exception &) {}
+    //unreadable or outdated manifests trigger a full rebuild
+    return nlohmann::json::object();
+}
+
+void write_manifest(const string & folder, const nlohmann::json & tiles)
+{
+    const string filename = folder + "/manifest.json";
+    ofstream file(filename + ".partial");
+    file << nlohmann::json({{"version", GRID_MANIFEST_VERSION}, {"tiles", tiles}}).dump(1);
+    file.close();
+    if (!file) {
+        throw runtime_error("Failed to write " + filename);
+    }
+    filesystem::rename(filename + ".partial", filename);
+}
+
+//tiles are recorded in manifest.json next to layout.json, an incremental export keeps tiles whose
+//hash did not change; tiles of a previous export that are no longer produced are removed
+map<string, vector<string>> Grid::to_gltf(const string & folder, bool merge, const bool binary, const bool pretty, const size_t threads,
+                                          const size_t levels, const size_t resolution, const bool incremental)
+{
+    flush_spill();
+    const nlohmann::json previous = read_manifest(folder);
+    nlohmann::json manifest = nlohmann::json::object();
+    map<string, vector<string>> report = {{"written", {}}, {"skipped", {}}, {"removed", {}}};
+
+    nlohmann::json lods = nlohmann::json::array();
+    for (size_t level = 0; level < max(levels, (size_t) 1); level++) {
+        lods.push_back(export_level(folder, level, resolution, merge, binary, pretty, threads,
+                                    incremental ? previous : nlohmann::json::object(), manifest, report));
+    }
+
+    for (auto it = previous.begin(); it != previous.end(); ++it) {
+        if (manifest.count(it.key()) == 0 && is_tile_name(it.key())) {
+            error_code ignored;
+            filesystem::remove(folder + "/" + it.key(), ignored);
+            report["removed"].push_back(it.key());
+        }
+    }
+
+    export_layout(folder, lods);
+    write_manifest(folder, manifest);
+    return report;
+}
+
+//level L tile (x, y) aggregates the level 0 tiles (x * 2^L .. (x + 1) * 2^L - 1, ...),
+//coarse levels are simplified by vertex clustering with cells of tile size / resolution
+nlohmann::json Grid::export_level(const string & folder, const size_t level, const size_t resolution, 
+                                  const bool merge, const bool binary, const bool pretty, const size_t threads,
+                                  const nlohmann::json & previous, nlohmann::json & manifest, map<string, vector<string>> & report) const
+{
+    const int scale = 1 << level;
+    map<pair<int, int>, vector<pair<int, int>>> parents;
+    for (auto & key : sorted_keys()) {
+        parents[make_pair(floor_div(key.first, scale), floor_div(key.second, scale))].push_back(key);
+    }
+    vector<pair<pair<int, int>, vector<pair<int, int>>>> tiles(parents.begin(), parents.end());
+
+    const tfloat cell_size = level ? min(width, height) * scale / max(resolution, (size_t) 1) : 0;
+    nlohmann::json lod;
+    lod["level"] = level;
+    lod["tileWidth"] = width * scale;
+    lod["tileHeight"] = height * scale;
+    lod["geometricError"] = cell_size * sqrt(3.0f);
+    lod["tiles"] = nlohmann::json::array();
+    vector<nlohmann::json> entries(tiles.size());
+    vector<string> hashes(tiles.size());
 
-        string filename = folder + "/tile" + to_string(pair.first.first) + "_" + to_string(pair.first.second) + ".gltf";
+    enum TileState : uint8_t { EMPTY, WRITTEN, KEPT };
+    vector<uint8_t> states(tiles.size(), EMPTY);
+
+    //in streaming mode each worker holds a single child tile and the simplified members of its tile at a time
+    Progress bar("Exporting grid level " + to_string(level));
+    parallel_for(tiles.size(), threads, [&](size_t i) {
+        const auto & key = tiles[i].first;
+        const auto & children = tiles[i].second;
+        string file = lod_tile_name(key, level, binary);
+        const tvec3 center((key.first + 0.5f) * width * scale, (key.second + 0.5f) * height * scale, 0);
+        const tvec3d tile_origin = origin + tvec3d(center);
+
+        nlohmann::json & tile = entries[i];
+        tile["x"] = key.first;
+        tile["y"] = key.second;
+        tile["file"] = file;
+        tile["origin"] = {tile_origin.x, tile_origin.y, tile_origin.z};
+
+        //coarse levels are simplified from the same members, so the hash of the members covers them
+        const nlohmann::json settings = {{"level", level}, {"resolution", level ? resolution : 0}, {"merge", merge}, {"binary", binary},
+                                         {"pretty", pretty}, {"origin", tile["origin"]}, {"tile", {width * scale, height * scale}}};
+        const auto known = previous.find(file);
+        if (known != previous.end() && known->is_object() && known->count("hash") && known->count("size") && known->count("box")
+            && filesystem::exists(folder + "/" + file)) {
+            TileHash hash(settings);
+            for (auto & child : children) {
+                hash.add(tile_models(child));
+            }
+            hashes[i] = hash.digest();
+            if (known->at("hash") == hashes[i]) {
+                tile["size"] = known->at("size");
+                tile["box"] = known->at("box");
+                states[i] = KEPT;
+                bar.update();
+                return;
+            }
+        }
 
-        tinygltf::Model gltf_model;
-        tinygltf::Asset asset;
-        asset.version = "2.0";
-        asset.generator = "Metacity";
-        gltf_model.asset = asset;
+        //the box is taken from the source members, so that it bounds the simplified geometry;
+        //members that collapse entirely are dropped, tiles without any geometry are not exported
+        TileHash hash(settings);
+        tvec3 vmin(INFINITY), vmax(-INFINITY);
+        vector<shared_ptr<Model>> models;
+        for (auto & child : children) {
+            const auto sources = tile_models(child);
+            hash.add(sources);
+            for (auto & model : sources) {
+                if (!has_geometry(model)) {
+                    continue;
+                }
+                const auto position = model->get_attribute("POSITION");
+                vmin = glm::min(vmin, position->vmin());
+                vmax = glm::max(vmax, position->vmax());
+                auto exported = level ? model->simplified(cell_size) : model;
+                if (has_geometry(exported)) {
+                    models.push_back(exported);
+                }
+            }
+        }
+        hashes[i] = hash.digest();
+        if (models.empty()) {
+            bar.update();
+            return;
+        }
 
+        tinygltf::Model gltf_model = gltf_model_init();
         if (merge) {
-            const auto & model = merge_models(pair.second);
-            model->to_gltf(gltf_model);
+            //one row per source model, referenced by the _FEATURE_ID_0 vertex attribute of the merged mesh
+            PropertyTable properties;
+            for (auto & model : models) {
+                model->export_metadata(properties);
+            }
+            properties.to_gltf(gltf_model);
+            Model::to_gltf(gltf_model, merge_models(models), center);
         } else {
-            for (auto & model : pair.second) {
-                model->to_gltf(gltf_model);
+            PropertyTable properties;
+            for (auto & model : models) {
+                if (model->to_gltf(gltf_model, false, center)) {
+                    model->export_metadata(properties);
+                }
             }
+            properties.to_gltf(gltf_model);
         }
-        
-        tinygltf::TinyGLTF gltf;
-        gltf.SetStoreOriginalJSONForExtrasAndExtensions(true);
-        gltf.WriteGltfSceneToFile(&gltf_model, filename, true, true, true, false);
-    }
+        gltf_set_origin(gltf_model, tile_origin);
+
+        gltf_write(gltf_model, folder + "/" + file, binary, pretty);
+
+        tile["size"] = models.size();
+        tile["box"] = {{vmin.x, vmin.y, vmin.z}, {vmax.x, vmax.y, vmax.z}};
+        states[i] = WRITTEN;
+        bar.update();
+    });
 
-    export_layout(folder);
+    for (size_t i = 0; i < tiles.size(); i++) {
+        if (states[i] == EMPTY) {
+            continue;
+        }
+        const string file = entries[i]["file"];
+        manifest[file] = {{"hash", hashes[i]}, {"size", entries[i]["size"]}, {"box", entries[i]["box"]}};
+        report[states[i] == WRITTEN ? "written" : "skipped"].push_back(file);
+        lod["tiles"].push_back(entries[i]);
+    }
+    return lod;
 }
 
-void Grid::export_layout(const string & folder) const
+void Grid::export_layout(const string & folder, const nlohmann::json & lods) const
 {
     nlohmann::json layout;
     layout["tileWidth"] = width;
     layout["tileHeight"] = height;
+    layout["origin"] = {origin.x, origin.y, origin.z};
     layout["tiles"] = nlohmann::json::array();
     
-    for (auto & pair : grid) {
+    for (auto & lod_tile : lods[0]["tiles"]) {
         nlohmann::json tile;
-        tile["x"] = pair.first.first;
-        tile["y"] = pair.first.second;
-        tile["file"] = "tile" + to_string(pair.first.first) + "_" + to_string(pair.first.second) + ".gltf";
-        tile["size"] = pair.second.size();
+        tile["x"] = lod_tile["x"];
+        tile["y"] = lod_tile["y"];
+        tile["file"] = lod_tile["file"];
+        tile["size"] = lod_tile["size"];
         layout["tiles"].push_back(tile);
     }
+    layout["levels"] = lods;
 
     ofstream file(folder + "/layout.json");
     file << layout.dump(4);
     file.close();
 }
+
+//===============================================================================
+// Snapshots
+
+//tiles are stored in sorted order, each as a range of models; spilled tiles are loaded one at a time
+void Grid::save(const string & filename)
+{
+    flush_spill();
+    nlohmann::json info;
+    info["width"] = width;
+    info["height"] = height;
+    info["origin"] = {origin.x, origin.y, origin.z};
+
+    const auto keys = sorted_keys();
+    SnapshotWriter writer(filename, SnapshotKind::GRID);
+    ModelArena::save(writer, [&](const function<void(const shared_ptr<Model> &)> & write) {
+        info["tiles"] = nlohmann::json::array();
+        for (const auto & key : keys) {
+            const auto tile = tile_models(key);
+            info["tiles"].push_back({key.first, key.second, tile.size()});
+            for (const auto & model : tile)
+                write(model);
+        }
+    });
+    writer.add("grid", info.dump());
+    writer.close();
+}
+
+shared_ptr<Grid> Grid::load(const string & filename, const bool mmap, const bool verify)
+{
+    SnapshotReader reader(filename, SnapshotKind::GRID, mmap, verify);
+    const auto info = nlohmann::json::parse(reader.text("grid"));
+    const auto arena = ModelArena::load(reader);
+
+    auto grid = make_shared<Grid>(info.at("width").get<tfloat>(), info.at("height").get<tfloat>());
+    const auto origin = info.at("origin").get<array<double, 3>>();
+    grid->origin = tvec3d(origin[0], origin[1], origin[2]);
+    grid->origin_set = true;
+
+    size_t index = 0;
+    for (const auto & tile : info.at("tiles")) {
+        const auto key = make_pair(tile.at(0).get<int>(), tile.at(1).get<int>());
+        const size_t count = tile.at(2).get<size_t>();
+        if (index + count > arena->size()) {
+            throw runtime_error("Corrupted snapshot tiles: " + filename);
+        }
+        auto & models = grid->grid[key];
+        for (size_t i = 0; i < count; i++) {
+            models.push_back(arena->view(index++));
+        }
+    }
+    return grid;
+}
@@ -2,8 +2,10 @@
 #include "types.hpp"
 #include "model.hpp"
 #include "layer.hpp"
+#include "gltf/json.hpp"
 #include <vector>
 #include <unordered_map>
+#include <map>
 
 
 using namespace std;
@@ -19,20 +21,48 @@ struct hash_pair {
 
 class Grid {
 public:
-    Grid(tfloat width, tfloat height);
+    Grid(tfloat width, tfloat height, const string & spill_folder = "", const size_t spill_budget = 256 << 20);
+    ~Grid();
     void add_layer(shared_ptr<Layer> layer);
     void add_model(shared_ptr<Model> model);
-    void to_gltf(const string & folder, bool merge) const;
+    map<string, vector<string>> to_gltf(const string & folder, bool merge, const bool binary = false, const bool pretty = true, const size_t threads = 0,
+                                        const size_t levels = 1, const size_t resolution = 64, const bool incremental = false);
     
-    unordered_map<pair<int, int>, vector<shared_ptr<Model>>, hash_pair> get_grid() const {
-        return grid;
-    }
+    unordered_map<pair<int, int>, vector<shared_ptr<Model>>, hash_pair> get_grid() const;
+    tvec3d get_origin() const;
+    void set_origin(const tvec3d & origin);
+    vector<shared_ptr<Model>> get_models();
+
+    void save(const string & filename);
+    static shared_ptr<Grid> load(const string & filename, const bool mmap = true, const bool verify = true);
 
 protected:
-    void export_layout(const string & folder) const;
+    nlohmann::json export_level(const string & folder, const size_t level, const size_t resolution, 
+                                const bool merge, const bool binary, const bool pretty, const size_t threads,
+                                const nlohmann::json & previous, nlohmann::json & manifest, map<string, vector<string>> & report) const;
+    void export_layout(const string & folder, const nlohmann::json & lods) const;
+    vector<pair<int, int>> sorted_keys() const;
+    vector<shared_ptr<Model>> tile_models(const pair<int, int> & key) const;
+    size_t tile_size(const pair<int, int> & key) const;
+
+    bool streaming() const;
+    string spill_file(const pair<int, int> & key) const;
+    void spill_model(const pair<int, int> & key, shared_ptr<Model> model);
+    void flush_spill();
 
 
     tfloat width;
     tfloat height;
+    //taken over from the first layer, tiles are exported relative to their center and placed by node translations
+    tvec3d origin = tvec3d(0);
+    bool origin_set = false;
     unordered_map<pair<int, int>, vector<shared_ptr<Model>>, hash_pair> grid;
+
+    //streaming mode, models are serialized into per-tile spill files instead of kept in memory
+    string spill_folder;
+    string spill_directory;
+    size_t spill_budget;
+    size_t pending_size;
+    unordered_map<pair<int, int>, string, hash_pair> pending;
+    unordered_map<pair<int, int>, size_t, hash_pair> spilled;
 };
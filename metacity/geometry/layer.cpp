@@ -1,65 +1,448 @@
 #include "layer.hpp"
 #include "gltf/tiny_gltf.h"
+#include "gltfio.hpp"
 #include "progress.hpp"
+#include "parallel.hpp"
 
-Layer::Layer() {}
+Layer::Layer(const bool compact) : properties(make_shared<PropertyTable>()) {
+    if (compact) {
+        arena = make_shared<ModelArena>();
+    }
+}
 
 void Layer::add_model(shared_ptr<Model> model) {
-    models.push_back(model);
+    if (arena) {
+        add_models({model});
+        return;
+    }
+    model->store_metadata(properties);
+    {
+        lock_guard<mutex> lock(models_mutex);
+        models.push_back(model);
+    }
+    drop_index();
 }
 
+//compact layers copy the models into the arena, later changes to the passed models are not reflected
 void Layer::add_models(const vector<shared_ptr<Model>> & models) {
-    this->models.insert(this->models.end(), models.begin(), models.end());
+    if (arena) {
+        {
+            lock_guard<mutex> lock(models_mutex);
+            arena->append(models);
+            this->models.resize(this->models.size() + models.size());
+        }
+        drop_index();
+        return;
+    }
+    for (auto & model : models) {
+        model->store_metadata(properties);
+    }
+    {
+        lock_guard<mutex> lock(models_mutex);
+        this->models.insert(this->models.end(), models.begin(), models.end());
+    }
+    drop_index();
+}
+
+void check_offsets(const int64_t * offsets, const size_t count, const size_t limit) {
+    for (size_t i = 0; i < count; i++) {
+        if (offsets[i] < 0 || offsets[i] > offsets[i + 1] || (size_t) offsets[i + 1] > limit) {
+            throw runtime_error("Offsets out of range");
+        }
+    }
+}
+
+template <typename T>
+void Layer::add_polygons_batch(const T * ivertices, const size_t count, const size_t dim,
+                               const int64_t * ring_offsets, const size_t ring_count,
+                               const int64_t * polygon_offsets, const size_t polygon_count,
+                               const int64_t * model_offsets, const size_t model_count,
+                               const size_t threads) {
+    if (dim != 2 && dim != 3) {
+        throw runtime_error("Encountered primitive with unsupported dimension " + to_string(dim));
+    }
+
+    if (count % dim) {
+        throw runtime_error("Unexpected number of elements in input array");
+    }
+
+    check_offsets(ring_offsets, ring_count, count / dim);
+    check_offsets(polygon_offsets, polygon_count, ring_count);
+    check_offsets(model_offsets, model_count, polygon_count);
+
+    //the origin is subtracted in double precision before vertices are narrowed to float,
+    //2D input stays on the local ground plane
+    vector<double> local;
+    if (origin != tvec3d(0)) {
+        local.resize(count);
+        const size_t block = 1 << 16;
+        parallel_for((count + block - 1) / block, threads, [&](size_t b) {
+            for (size_t i = b * block; i < min(count, (b + 1) * block); i++) {
+                local[i] = ivertices[i] - origin[i % dim];
+            }
+        });
+    }
+
+    //every model is triangulated independently, the output does not depend on the thread count
+    vector<shared_ptr<Model>> batch(model_count);
+    auto triangulate = [&](const auto * vertices) {
+        parallel_for(model_count, threads, [&](size_t m) {
+            auto attribute = make_shared<Attribute>();
+            for (int64_t p = model_offsets[m]; p < model_offsets[m + 1]; p++) {
+                const int64_t * rings = ring_offsets + polygon_offsets[p];
+                const size_t rcount = polygon_offsets[p + 1] - polygon_offsets[p];
+                if (dim == 2) {
+                    attribute->push_polygon2D(vertices, count, rings, rcount);
+                } else {
+                    attribute->push_polygon3D(vertices, count, rings, rcount);
+                }
+            }
+
+            auto model = make_shared<Model>();
+            model->add_attribute("POSITION", attribute);
+            batch[m] = model;
+        });
+    };
+
+    if (local.empty()) {
+        triangulate(ivertices);
+    } else {
+        triangulate(local.data());
+    }
+
+    add_models(batch);
 }
 
+#define INSTANTIATE_BATCH(T) \
+    template void Layer::add_polygons_batch<T>(const T *, const size_t, const size_t, \
+                                               const int64_t *, const size_t, const int64_t *, const size_t, \
+                                               const int64_t *, const size_t, const size_t);
+
+INSTANTIATE_BATCH(float)
+INSTANTIATE_BATCH(double)
+
 vector<shared_ptr<Model>> Layer::get_models() const {
+    materialize_all();
+    lock_guard<mutex> lock(models_mutex);
     return models;
 }
 
-void Layer::to_gltf(const string &filename) const {
-    tinygltf::Model gltf_model;
-    tinygltf::Asset asset;
-    asset.version = "2.0";
-    asset.generator = "Metacity";
-    gltf_model.asset = asset;
-    
+int Layer::size() const {
+    lock_guard<mutex> lock(models_mutex);
+    return models.size();
+}
+
+shared_ptr<Model> Layer::get_model(const size_t index) const {
+    if (index >= (size_t) size()) {
+        throw out_of_range("Model index out of range");
+    }
+    return materialize(index);
+}
+
+//cached models are returned as they are, arena models as a temporary view that is not cached
+shared_ptr<Model> Layer::view(const size_t index) const {
+    if (index >= (size_t) size()) {
+        throw out_of_range("Model index out of range");
+    }
+    {
+        lock_guard<mutex> lock(models_mutex);
+        if (!models[index] && arena) {
+            return arena->view(index);
+        }
+    }
+    return materialize(index);
+}
+
+shared_ptr<Model> Layer::cached(const size_t index) const {
+    lock_guard<mutex> lock(models_mutex);
+    return models[index];
+}
+
+//lazy models are loaded outside of the lock, a model stored meanwhile by another thread wins
+shared_ptr<Model> Layer::materialize(const size_t index) const {
+    shared_ptr<GltfMapping> source;
+    size_t first;
+    {
+        lock_guard<mutex> lock(models_mutex);
+        if (models[index]) {
+            return models[index];
+        }
+        if (arena) {
+            models[index] = arena->view(index);
+            return models[index];
+        }
+        const auto it = prev(lazy_sources.upper_bound(index));
+        first = it->first;
+        source = it->second;
+    }
+
+    auto model = source->load_model(index - first);
+    const tvec3d translation = source->model_translation(index - first);
+    if (translation != origin) {
+        model->translate(translation - origin);
+    }
+
+    lock_guard<mutex> lock(models_mutex);
+    if (!models[index]) {
+        models[index] = model;
+    }
+    return models[index];
+}
+
+void Layer::materialize_all() const {
+    {
+        lock_guard<mutex> lock(models_mutex);
+        if (lazy_sources.empty() && !arena) {
+            return;
+        }
+    }
+    parallel_for(size(), 0, [&](size_t i) {
+        materialize(i);
+    });
+    lock_guard<mutex> lock(models_mutex);
+    lazy_sources.clear();
+}
+
+//===============================================================================
+// Compact storage
+
+//moves all models into the arena, models held elsewhere are not affected by later changes of the layer
+void Layer::compact(const size_t threads) {
+    if (arena) {
+        return;
+    }
+    const auto current = get_models();
+    auto compacted = make_shared<ModelArena>();
+    compacted->append(current, threads);
+    {
+        lock_guard<mutex> lock(models_mutex);
+        arena = compacted;
+        models.assign(models.size(), nullptr);
+    }
+    properties = make_shared<PropertyTable>();
+}
+
+bool Layer::is_compact() const {
+    return arena != nullptr;
+}
+
+//===============================================================================
+// Transformations
+
+//models are moved in place so that their absolute positions stay the same
+void Layer::set_origin(const tvec3d & new_origin, const size_t threads) {
+    const tvec3d shift = origin - new_origin;
+    if (shift != tvec3d(0) && size()) {
+        if (arena) {
+            arena->detach();
+        }
+        parallel_for(size(), threads, [&](size_t i) {
+            if (!cached(i) && arena) {
+                arena->translate(i, shift);
+            } else {
+                materialize(i)->translate(shift);
+            }
+        });
+        drop_index();
+    }
+    origin = new_origin;
+}
+
+tvec3d Layer::get_origin() const {
+    return origin;
+}
+
+//affine transformation of the absolute positions, models are modified in place
+void Layer::transform(const tmat4d & matrix, const size_t threads) {
+    if (arena) {
+        arena->detach();
+    }
+    parallel_for(size(), threads, [&](size_t i) {
+        if (!cached(i) && arena) {
+            arena->transform(i, matrix, origin);
+        } else {
+            materialize(i)->transform(matrix, origin);
+        }
+    });
+    drop_index();
+}
+
+//===============================================================================
+// Spatial index
+
+void Layer::build_index(const size_t node_size) {
+    create_index(node_size);
+}
+
+shared_ptr<const RTree> Layer::create_index(const size_t node_size) {
+    vector<Box> boxes(size());
+    parallel_for(boxes.size(), 0, [&](size_t i) {
+        boxes[i] = {INFINITY, INFINITY, -INFINITY, -INFINITY};
+        tvec3 min, max;
+        if (!cached(i) && arena) {
+            if (arena->bounds(i, min, max)) {
+                boxes[i] = {min.x, min.y, max.x, max.y};
+            }
+        } else if (const auto model = materialize(i); model->attribute_exists("POSITION")) {
+            const auto position = model->get_attribute("POSITION");
+            min = position->vmin(), max = position->vmax();
+            boxes[i] = {min.x, min.y, max.x, max.y};
+        }
+    });
+    auto tree = make_shared<const RTree>(boxes, node_size);
+    lock_guard<mutex> lock(index_mutex);
+    index = tree;
+    return tree;
+}
+
+void Layer::drop_index() {
+    lock_guard<mutex> lock(index_mutex);
+    index.reset();
+}
+
+//concurrent queries wait for a single build of the index
+shared_ptr<const RTree> Layer::spatial_index() {
+    {
+        lock_guard<mutex> lock(index_mutex);
+        if (index) {
+            return index;
+        }
+    }
+    lock_guard<mutex> build(build_mutex);
+    {
+        lock_guard<mutex> lock(index_mutex);
+        if (index) {
+            return index;
+        }
+    }
+    return create_index(16);
+}
+
+vector<uint32_t> Layer::query_bbox(const tvec2d & min, const tvec2d & max) {
+    return spatial_index()->query_box({(tfloat) (min.x - origin.x), (tfloat) (min.y - origin.y),
+                                       (tfloat) (max.x - origin.x), (tfloat) (max.y - origin.y)});
+}
+
+vector<uint32_t> Layer::query_point(const double ax, const double ay) {
+    const tfloat x = ax - origin.x, y = ay - origin.y;
+    vector<uint32_t> result;
+    const auto tree = spatial_index();
+    for (const auto i : tree->query_box({x, y, x, y})) {
+        const auto model = cached(i);
+        const bool contains = !model && arena ? arena->contains_xy(i, x, y)
+                                              : model->get_attribute("POSITION")->contains_xy(x, y);
+        if (contains) {
+            result.push_back(i);
+        }
+    }
+    return result;
+}
+
+vector<uint32_t> Layer::query_nearest(const double x, const double y, const size_t k) {
+    return spatial_index()->query_nearest(x - origin.x, y - origin.y, k);
+}
+
+void Layer::to_gltf(const string &filename, const bool binary, const bool pretty) const {
+    tinygltf::Model gltf_model = gltf_model_init();
+    //lazy models are loaded in parallel, arena models are exported through temporary views
+    if (!arena) {
+        materialize_all();
+    }
+
+    //metadata of all exported meshes goes into a single property table
+    PropertyTable table;
     Progress bar("Exporting models");
-    for (auto model : models) {
+    for (size_t i = 0; i < (size_t) size(); i++) {
         bar.update();
-        model->to_gltf(gltf_model);
+        const auto model = view(i);
+        if (model->to_gltf(gltf_model, false)) {
+            model->export_metadata(table);
+        }
     }
+    table.to_gltf(gltf_model);
+    gltf_set_origin(gltf_model, origin);
 
-    tinygltf::TinyGLTF gltf;
-    //gltf.SetStoreOriginalJSONForExtrasAndExtensions(true);
-    gltf.WriteGltfSceneToFile(&gltf_model, filename, true, true, true, false);
+    gltf_write(gltf_model, filename, binary, pretty);
 }
 
-void Layer::from_gltf(const string &filename) {
-    tinygltf::TinyGLTF gltf;
-    //gltf.SetStoreOriginalJSONForExtrasAndExtensions(true);
+void Layer::from_gltf(const string &filename, const bool lazy) {
+    //compact layers import eagerly into the arena
+    if (lazy && !arena) {
+        //buffers stay mapped, models are created on first access and borrow their vertices
+        auto mapping = make_shared<GltfMapping>(filename);
+        if (mapping->model_count()) {
+            lock_guard<mutex> lock(models_mutex);
+            if (models.empty()) {
+                origin = mapping->model_translation(0);
+            }
+            lazy_sources[models.size()] = mapping;
+            models.resize(models.size() + mapping->model_count());
+        }
+        drop_index();
+        return;
+    }
+
     tinygltf::Model gltf_model;
-    string err, warn;
 
     Progress bar("Importing models");
-    bool ret = gltf.LoadASCIIFromFile(&gltf_model, &err, &warn, filename);
+    bool ret = gltf_read(gltf_model, filename);
 
-    if (!err.empty()) {
-        cout << err << endl;
+    if (!ret) {
+        cout << "Failed to load gltf file" << endl;
+        return;
     }
 
-    if (!warn.empty()) {
-        cout << warn << endl;
+    //meshes map to the rows of the property table, files without one keep metadata in extras
+    auto table = PropertyTable::from_gltf(gltf_model);
+    if (table && table->size() != gltf_model.meshes.size()) {
+        table.reset();
     }
 
-    if (!ret) {
-        cout << "Failed to load gltf file" << endl;
-        return;
+    //an empty layer adopts the offset of the file, meshes placed elsewhere are moved relative to it
+    const auto translations = gltf_mesh_translations(gltf_model);
+    if (!size() && !translations.empty()) {
+        origin = translations[0];
     }
 
-    for (int mesh_idx = 0; mesh_idx < gltf_model.meshes.size(); mesh_idx++) {
+    for (int mesh_idx = 0; mesh_idx < (int) gltf_model.meshes.size(); mesh_idx++) {
         bar.update();
-        auto model = make_shared<Model>();
-        model->from_gltf(gltf_model, mesh_idx);
-        add_model(model);
+        for (int primitive_idx = 0; primitive_idx < (int) gltf_model.meshes[mesh_idx].primitives.size(); primitive_idx++) {
+            auto model = make_shared<Model>();
+            model->from_gltf(gltf_model, mesh_idx, primitive_idx);
+            if (table) {
+                model->bind_metadata(table, mesh_idx);
+            }
+            if (translations[mesh_idx] != origin) {
+                model->translate(translations[mesh_idx] - origin);
+            }
+            add_model(model);
+        }
     } 
-}
\ No newline at end of file
+}
+//===============================================================================
+// Snapshots
+
+void Layer::save(const string & filename) const {
+    vector<shared_ptr<Model>> views(size());
+    for (size_t i = 0; i < views.size(); i++) {
+        views[i] = view(i);
+    }
+
+    SnapshotWriter writer(filename, SnapshotKind::LAYER);
+    writer.add("layer", nlohmann::json({{"origin", {origin.x, origin.y, origin.z}}}).dump());
+    ModelArena::save(writer, views);
+    writer.close();
+}
+
+//loaded layers are compact, their vertices stay in the snapshot until they are modified
+shared_ptr<Layer> Layer::load(const string & filename, const bool mmap, const bool verify) {
+    SnapshotReader reader(filename, SnapshotKind::LAYER, mmap, verify);
+    const auto info = nlohmann::json::parse(reader.text("layer"));
+    const auto origin = info.at("origin").get<array<double, 3>>();
+
+    auto layer = make_shared<Layer>(true);
+    layer->origin = tvec3d(origin[0], origin[1], origin[2]);
+    layer->arena = ModelArena::load(reader);
+    layer->models.resize(layer->arena->size());
+    return layer;
+}
@@ -1,22 +1,72 @@
 #pragma once
 #include "types.hpp"
 #include "model.hpp"
+#include "rtree.hpp"
+#include "gltfmap.hpp"
+#include "arena.hpp"
+#include <map>
+#include <mutex>
 using namespace std;
 
 class Layer {
 public:
-    Layer();
+    Layer(const bool compact = false);
     void add_model(shared_ptr<Model> model);
     void add_models(const vector<shared_ptr<Model>> & models);
+
+    template <typename T>
+    void add_polygons_batch(const T * ivertices, const size_t count, const size_t dim,
+                            const int64_t * ring_offsets, const size_t ring_count,
+                            const int64_t * polygon_offsets, const size_t polygon_count,
+                            const int64_t * model_offsets, const size_t model_count,
+                            const size_t threads);
     
     vector<shared_ptr<Model>> get_models() const;
-    void to_gltf(const string &filename) const;
-    void from_gltf(const string &filename);
+    shared_ptr<Model> get_model(const size_t index) const;
+    shared_ptr<Model> view(const size_t index) const;
+
+    void compact(const size_t threads = 0);
+    bool is_compact() const;
+
+    void set_origin(const tvec3d & origin, const size_t threads = 0);
+    tvec3d get_origin() const;
+    void transform(const tmat4d & matrix, const size_t threads = 0);
+
+    void build_index(const size_t node_size = 16);
+    //queries take absolute coordinates, the origin of the layer is subtracted before the index is searched
+    vector<uint32_t> query_bbox(const tvec2d & min, const tvec2d & max);
+    vector<uint32_t> query_point(const double x, const double y);
+    vector<uint32_t> query_nearest(const double x, const double y, const size_t k);
+    void to_gltf(const string &filename, const bool binary = false, const bool pretty = true) const;
+    void from_gltf(const string &filename, const bool lazy = false);
+    void save(const string & filename) const;
+    static shared_ptr<Layer> load(const string & filename, const bool mmap = true, const bool verify = true);
     
-    int size() const {
-        return models.size();
-    }
+    int size() const;
 
 protected:
-    vector<shared_ptr<Model>> models;
+    shared_ptr<const RTree> spatial_index();
+    shared_ptr<const RTree> create_index(const size_t node_size);
+    void drop_index();
+    shared_ptr<Model> cached(const size_t index) const;
+    shared_ptr<Model> materialize(const size_t index) const;
+    void materialize_all() const;
+
+    //models of lazily imported meshes and of the arena stay empty until they are first accessed
+    mutable vector<shared_ptr<Model>> models;
+    //mapped glTF documents keyed by the index of their first model
+    mutable map<size_t, shared_ptr<GltfMapping>> lazy_sources;
+    //guards the model slots, lazy sources and arena appends, models are materialized from methods running without the GIL
+    mutable mutex models_mutex;
+    //built on demand, dropped whenever models are added; queries keep their own reference,
+    //the pointer itself is guarded because queries run without the GIL
+    shared_ptr<const RTree> index;
+    mutex index_mutex;
+    mutex build_mutex;
+    //metadata of added models, one row per model that came with its own metadata
+    shared_ptr<PropertyTable> properties;
+    //compact storage of all models, accessed models are cached as views borrowing from it
+    shared_ptr<ModelArena> arena;
+    //vertices are stored relative to the origin to keep float precision for projected coordinates
+    tvec3d origin = tvec3d(0);
 };
\ No newline at end of file
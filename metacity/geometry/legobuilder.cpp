@@ -0,0 +1,109 @@
+#include "legobuilder.hpp"
+#include "bvh.hpp"
+#include "raster.hpp"
+#include "parallel.hpp"
+
+LegoBuilder::LegoBuilder() {}
+
+void LegoBuilder::insert_model(const shared_ptr<Model> model)
+{
+    insert_shifted(model, tvec3d(0));
+}
+
+void LegoBuilder::insert_shifted(const shared_ptr<Model> & model, const tvec3d & shift)
+{
+    if (!model->attribute_exists("POSITION"))
+        return;
+
+    const auto position = model->get_attribute("POSITION");
+    if (position->get_type() != AttributeType::POLYGON)
+        return;
+
+    const size_t start = vertices.size();
+    const auto & data = position->get_data();
+    if (position->is_indexed())
+    {
+        for (const auto i : position->get_indices())
+            vertices.push_back(data[i]);
+    }
+    else
+        vertices.insert(vertices.end(), data.begin(), data.end());
+
+    if (shift != tvec3d(0))
+        for (size_t i = start; i < vertices.size(); i++)
+            vertices[i] = tvec3(tvec3d(vertices[i]) + shift);
+}
+
+//offset of the vertices of a layer or grid with the given origin
+tvec3d LegoBuilder::adopt_origin(const tvec3d & other)
+{
+    if (vertices.empty())
+        origin = other;
+    return other - origin;
+}
+
+void LegoBuilder::insert_layer(const shared_ptr<Layer> layer)
+{
+    const tvec3d shift = adopt_origin(layer->get_origin());
+    for (const auto & model : layer->get_models())
+        insert_shifted(model, shift);
+}
+
+void LegoBuilder::insert_grid(const shared_ptr<Grid> grid)
+{
+    const tvec3d shift = adopt_origin(grid->get_origin());
+    for (const auto & model : grid->get_models())
+        insert_shifted(model, shift);
+}
+
+vector<tfloat> trace_heightmap(const vector<tvec3> & vertices, const Raster & raster, const size_t threads)
+{
+    BVH bvh(vertices);
+    vector<tfloat> heightmap(raster.dimx * raster.dimy);
+    //rows are traced independently
+    parallel_for(raster.dimy, threads, [&](size_t j) {
+        const tfloat y = raster.y(j);
+        tfloat * row = heightmap.data() + j * raster.dimx;
+        for (size_t i = 0; i < raster.dimx; ++i)
+            row[i] = bvh.trace_down(raster.x(i), y);
+    });
+    return heightmap;
+}
+
+void LegoBuilder::build_heightmap(const double xmin, const double ymin, const double xmax, const double ymax,
+                                  const tfloat resolution, const size_t threads, const HeightmapMethod method)
+{
+    if (resolution <= 0 || xmax <= xmin || ymax <= ymin)
+        throw runtime_error("Invalid heightmap extent or resolution");
+
+    raster_dimx = (xmax - xmin) * resolution;
+    raster_dimy = (ymax - ymin) * resolution;
+
+    const Raster raster = {(tfloat) (xmin - origin.x), (tfloat) (ymax - origin.y), (tfloat) (1.0 / resolution), raster_dimx, raster_dimy};
+    auto heights = method == HeightmapMethod::TRACE ? trace_heightmap(vertices, raster, threads)
+                                                    : rasterize_heightmap(vertices, raster, threads);
+    if (origin.z != 0)
+        for (auto & height : heights)
+            height = (tfloat) (height + origin.z);
+    heightmap = move(heights);
+}
+
+const CowArray<tfloat> & LegoBuilder::get_heightmap() const
+{
+    return heightmap;
+}
+
+size_t LegoBuilder::get_width() const
+{
+    return raster_dimx;
+}
+
+size_t LegoBuilder::get_height() const
+{
+    return raster_dimy;
+}
+
+tvec3d LegoBuilder::get_origin() const
+{
+    return origin;
+}
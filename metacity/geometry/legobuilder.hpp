@@ -0,0 +1,43 @@
+#pragma once
+#include "types.hpp"
+#include "model.hpp"
+#include "layer.hpp"
+#include "grid.hpp"
+#include "cow.hpp"
+
+using namespace std;
+
+enum HeightmapMethod {
+    TRACE,
+    RASTER
+};
+
+class LegoBuilder {
+public:
+    LegoBuilder();
+    //models are expected relative to the origin of the builder
+    void insert_model(const shared_ptr<Model> model);
+    //the first layer or grid inserted into an empty builder sets its origin, others are moved relative to it
+    void insert_layer(const shared_ptr<Layer> layer);
+    void insert_grid(const shared_ptr<Grid> grid);
+    //the extent is given in absolute coordinates, heights are absolute as well
+    void build_heightmap(const double xmin, const double ymin, const double xmax, const double ymax,
+                         const tfloat resolution, const size_t threads = 0, const HeightmapMethod method = HeightmapMethod::RASTER);
+
+    //row-major raster, the first row is the northernmost one, pixels without geometry are -inf
+    const CowArray<tfloat> & get_heightmap() const;
+    size_t get_width() const;
+    size_t get_height() const;
+    tvec3d get_origin() const;
+
+protected:
+    void insert_shifted(const shared_ptr<Model> & model, const tvec3d & shift);
+    tvec3d adopt_origin(const tvec3d & other);
+
+    //triangle soup collected from the POSITION attributes of inserted models, relative to the origin
+    vector<tvec3> vertices;
+    tvec3d origin = tvec3d(0);
+    CowArray<tfloat> heightmap;
+    size_t raster_dimx = 0;
+    size_t raster_dimy = 0;
+};
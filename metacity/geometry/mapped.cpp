@@ -0,0 +1,91 @@
+#include <stdexcept>
+#include "mapped.hpp"
+
+#ifdef _WIN32
+#define WIN32_LEAN_AND_MEAN
+#include <windows.h>
+
+MappedFile::MappedFile(const string & filename)
+{
+    file = CreateFileA(filename.c_str(), GENERIC_READ, FILE_SHARE_READ, nullptr, OPEN_EXISTING, FILE_ATTRIBUTE_NORMAL, nullptr);
+    if (file == INVALID_HANDLE_VALUE)
+        throw runtime_error("Failed to open " + filename);
+
+    LARGE_INTEGER size;
+    GetFileSizeEx(file, &size);
+    length = size.QuadPart;
+    if (length == 0)
+        return;
+
+    mapping = CreateFileMappingA(file, nullptr, PAGE_READONLY, 0, 0, nullptr);
+    if (mapping)
+        ptr = static_cast<const uint8_t *>(MapViewOfFile(mapping, FILE_MAP_READ, 0, 0, 0));
+    if (!ptr)
+    {
+        if (mapping)
+            CloseHandle(mapping);
+        CloseHandle(file);
+        throw runtime_error("Failed to map " + filename);
+    }
+}
+
+MappedFile::~MappedFile()
+{
+    if (ptr)
+        UnmapViewOfFile(ptr);
+    if (mapping)
+        CloseHandle(mapping);
+    if (file && file != INVALID_HANDLE_VALUE)
+        CloseHandle(file);
+}
+
+#else
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+
+MappedFile::MappedFile(const string & filename)
+{
+    const int fd = open(filename.c_str(), O_RDONLY);
+    if (fd < 0)
+        throw runtime_error("Failed to open " + filename);
+
+    struct stat info;
+    if (fstat(fd, &info) != 0)
+    {
+        close(fd);
+        throw runtime_error("Failed to open " + filename);
+    }
+
+    length = info.st_size;
+    if (length > 0)
+    {
+        void * mapped = mmap(nullptr, length, PROT_READ, MAP_PRIVATE, fd, 0);
+        if (mapped == MAP_FAILED)
+        {
+            close(fd);
+            throw runtime_error("Failed to map " + filename);
+        }
+        ptr = static_cast<const uint8_t *>(mapped);
+    }
+    //the mapping stays valid after the descriptor is closed
+    close(fd);
+}
+
+MappedFile::~MappedFile()
+{
+    if (ptr)
+        munmap(const_cast<uint8_t *>(ptr), length);
+}
+#endif
+
+const uint8_t * MappedFile::data() const
+{
+    return ptr;
+}
+
+size_t MappedFile::size() const
+{
+    return length;
+}
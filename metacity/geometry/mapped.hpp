@@ -0,0 +1,25 @@
+#pragma once
+#include <string>
+#include <cstdint>
+
+using namespace std;
+
+//read-only memory mapping of a whole file, unmapped on destruction
+class MappedFile {
+public:
+    MappedFile(const string & filename);
+    ~MappedFile();
+    MappedFile(const MappedFile &) = delete;
+    MappedFile & operator=(const MappedFile &) = delete;
+
+    const uint8_t * data() const;
+    size_t size() const;
+
+protected:
+    const uint8_t * ptr = nullptr;
+    size_t length = 0;
+#ifdef _WIN32
+    void * file = nullptr;
+    void * mapping = nullptr;
+#endif
+};
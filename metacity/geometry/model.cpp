@@ -1,26 +1,19 @@
 #include <stdexcept>
 #include <numeric>
+#include <map>
+#include <algorithm>
 #include "model.hpp"
 #include "triangulation.hpp"
 #include "cppcodec/base64_rfc4648.hpp"
 #include "gltf/tiny_gltf.h"
 #include "convert.hpp"
+#include "serialization.hpp"
+#include "gltfio.hpp"
 
 //===============================================================================
 Model::Model() {}
 
 
-void Model::merge(shared_ptr<Model> model)
-{
-    for (auto & pair : model->attrib) {
-        if (attrib.find(pair.first) == attrib.end()) {
-            throw runtime_error("Merging Failed: Attribute " + pair.first + " found in RModel does not exist in LModel");
-        } else {
-            attrib[pair.first]->merge(pair.second);
-        }
-    }
-}
-
 shared_ptr<Model> Model::clone() const
 {
     auto clone = make_shared<Model>();
@@ -28,9 +21,24 @@ shared_ptr<Model> Model::clone() const
         clone->attrib[pair.first] = pair.second->clone();
     }
     clone->metadata = metadata;
+    clone->table = table;
+    clone->row = row;
+    clone->feature_ids = feature_ids;
     return clone;
 }
 
+shared_ptr<Model> Model::simplified(const tfloat cell_size) const
+{
+    auto simplified = make_shared<Model>();
+    for (auto & pair : attrib) {
+        simplified->attrib[pair.first] = pair.second->simplified(cell_size);
+    }
+    simplified->metadata = metadata;
+    simplified->table = table;
+    simplified->row = row;
+    return simplified;
+}
+
 void Model::add_attribute(const string &name, shared_ptr<Attribute> attribute) {
     if (attrib.find(name) != attrib.end()) {
         throw runtime_error("Attribute already exists");
@@ -52,6 +60,11 @@ tvec3 Model::get_centroid() const
 
 void Model::set_metadata(nlohmann::json data)
 {
+    if (table) {
+        metadata = table->row(row);
+        table.reset();
+    }
+
     for (auto & pair : data.items()) {
         metadata[pair.key()] = pair.value();
     }
@@ -59,9 +72,47 @@ void Model::set_metadata(nlohmann::json data)
 
 nlohmann::json Model::get_metadata() const
 {
+    if (table) {
+        return table->row(row);
+    }
     return metadata;
 }
 
+void Model::bind_metadata(shared_ptr<const PropertyTable> table, const size_t row)
+{
+    this->table = table;
+    this->row = row;
+    metadata = nlohmann::json();
+}
+
+void Model::store_metadata(const shared_ptr<PropertyTable> & table)
+{
+    //models without metadata or already backed by a table are left as they are
+    if (this->table || !metadata.is_object()) {
+        return;
+    }
+    bind_metadata(table, table->append(metadata));
+}
+
+void Model::export_metadata(PropertyTable & out) const
+{
+    if (table) {
+        out.append_row(*table, row);
+    } else {
+        out.append(metadata);
+    }
+}
+
+void Model::set_feature_ids(vector<uint32_t> ids)
+{
+    feature_ids = move(ids);
+}
+
+const vector<uint32_t> & Model::get_feature_ids() const
+{
+    return feature_ids;
+}
+
 
 shared_ptr<Attribute> Model::get_attribute(const string &name) const {
     if (attrib.find(name) == attrib.end()) {
@@ -74,6 +125,15 @@ bool Model::attribute_exists(const string &name) {
     return attrib.find(name) != attrib.end();
 }
 
+vector<string> Model::get_attribute_names() const {
+    vector<string> names;
+    for (auto & pair : attrib) {
+        names.push_back(pair.first);
+    }
+    sort(names.begin(), names.end());
+    return names;
+}
+
 
 void Model::compute_normals()
 {
@@ -103,6 +163,38 @@ void Model::compute_normals()
     attrib["NORMAL"] = normals;*/
 }
 
+void Model::serialize(ostream & out) const
+{
+    vector<string> names;
+    for (auto & pair : attrib) {
+        names.push_back(pair.first);
+    }
+    sort(names.begin(), names.end());
+
+    write_value<uint32_t>(out, names.size());
+    for (auto & name : names) {
+        write_string(out, name);
+        attrib.at(name)->serialize(out);
+    }
+    write_vector(out, nlohmann::json::to_msgpack(get_metadata()));
+}
+
+void Model::deserialize(istream & in)
+{
+    const uint32_t count = read_value<uint32_t>(in);
+    for (uint32_t i = 0; i < count; i++) {
+        const string name = read_string(in);
+        auto attribute = make_shared<Attribute>();
+        attribute->deserialize(in);
+        attrib[name] = attribute;
+    }
+
+    vector<uint8_t> packed;
+    read_vector(in, packed);
+    metadata = nlohmann::json::from_msgpack(packed);
+    table.reset();
+}
+
 bool Model::has_any_geometry() const
 {
     if (attrib.find("POSITION") == attrib.end()) {
@@ -116,16 +208,52 @@ bool Model::has_any_geometry() const
     return true;
 }
 
-void Model::to_gltf(tinygltf::Model & model) const
+void Model::transform(const tmat4d & matrix, const tvec3d & origin)
+{
+    for (auto & pair : attrib) {
+        pair.second->transform(matrix, origin);
+    }
+}
+
+void Model::translate(const tvec3d & offset)
+{
+    for (auto & pair : attrib) {
+        pair.second->translate(offset);
+    }
+}
+
+bool Model::to_gltf(tinygltf::Model & model, const bool extras, const tvec3 & offset) const
 {
     int mesh_index;
     
     if (!has_any_geometry()) {
-        return;
+        return false;
     }
 
-    to_gltf_mesh(model, mesh_index);
+    to_gltf_mesh(model, mesh_index, extras, offset);
     to_gltf_scene(model, mesh_index);
+    return true;
+}
+
+//parts become primitives of a single mesh, e.g. merged models of different primitive types
+bool Model::to_gltf(tinygltf::Model & model, const vector<shared_ptr<Model>> & parts, const tvec3 & offset)
+{
+    tinygltf::Mesh mesh;
+    shared_ptr<Model> written;
+    for (auto & part : parts) {
+        if (part->has_any_geometry()) {
+            part->to_gltf_primitive(model, mesh, offset);
+            written = part;
+        }
+    }
+
+    if (!written) {
+        return false;
+    }
+
+    model.meshes.push_back(mesh);
+    written->to_gltf_scene(model, model.meshes.size() - 1);
+    return true;
 }
 
 void Model::to_gltf_scene(tinygltf::Model & model, const int mesh_index) const
@@ -149,11 +277,13 @@ void Model::to_gltf_node(tinygltf::Model & model, const int mesh_index, int & no
     node_index = model.nodes.size() - 1;
 }
 
-void Model::to_gltf_mesh(tinygltf::Model & model, int & mesh_index) const
+void Model::to_gltf_mesh(tinygltf::Model & model, int & mesh_index, const bool extras, const tvec3 & offset) const
 {
     tinygltf::Mesh mesh;
-    to_gltf_primitive(model, mesh);
-    mesh.extras = to_gltf_value(metadata);
+    to_gltf_primitive(model, mesh, offset);
+    if (extras) {
+        mesh.extras = to_gltf_value(get_metadata());
+    }
     model.meshes.push_back(mesh);
     mesh_index = model.meshes.size() - 1;
 }
@@ -173,24 +303,67 @@ int type_to_gltf(AttributeType type)
     }
 }
 
-void Model::to_gltf_primitive(tinygltf::Model & model, tinygltf::Mesh & mesh) const
+void Model::to_gltf_primitive(tinygltf::Model & model, tinygltf::Mesh & mesh, const tvec3 & offset) const
 {
     tinygltf::Primitive primitive;
-    to_gltf_attribute(model, primitive, "POSITION");
+    to_gltf_attribute(model, primitive, "POSITION", offset);
     //to_gltf_attribute(model, primitive, "NORMAL");
-    primitive.indices = -1; //no indices
+    if (!feature_ids.empty()) {
+        to_gltf_features(model, primitive);
+    }
     mesh.primitives.push_back(primitive);
 }
 
-void Model::to_gltf_attribute(tinygltf::Model & model, tinygltf::Primitive & primitive, const string &name) const
+void Model::to_gltf_features(tinygltf::Model & model, tinygltf::Primitive & primitive) const
+{
+    if (feature_ids.size() != get_attribute("POSITION")->size()) {
+        throw runtime_error("Feature IDs do not match the vertex count");
+    }
+
+    //stored as floats, exact up to 2^24 features; narrower integer attributes would need 4-byte strides anyway
+    vector<float> ids(feature_ids.begin(), feature_ids.end());
+    tinygltf::Accessor accessor;
+    accessor.bufferView = gltf_append_buffer_view(model, ids.data(), ids.size() * sizeof(float), TINYGLTF_TARGET_ARRAY_BUFFER);
+    accessor.byteOffset = 0;
+    accessor.componentType = TINYGLTF_COMPONENT_TYPE_FLOAT;
+    accessor.count = ids.size();
+    accessor.type = TINYGLTF_TYPE_SCALAR;
+    model.accessors.push_back(accessor);
+    primitive.attributes["_FEATURE_ID_0"] = model.accessors.size() - 1;
+
+    //vertices of a feature are contiguous
+    int count = 0;
+    for (size_t i = 0; i < feature_ids.size(); i++) {
+        if (i == 0 || feature_ids[i] != feature_ids[i - 1]) {
+            count++;
+        }
+    }
+
+    tinygltf::Value::Object feature_id;
+    feature_id["featureCount"] = tinygltf::Value(count);
+    feature_id["attribute"] = tinygltf::Value(0);
+    if (model.extensions.count("EXT_structural_metadata")) {
+        feature_id["propertyTable"] = tinygltf::Value(0);
+    }
+    tinygltf::Value::Object extension;
+    extension["featureIds"] = tinygltf::Value(tinygltf::Value::Array{tinygltf::Value(feature_id)});
+    primitive.extensions["EXT_mesh_features"] = tinygltf::Value(extension);
+
+    if (find(model.extensionsUsed.begin(), model.extensionsUsed.end(), "EXT_mesh_features") == model.extensionsUsed.end()) {
+        model.extensionsUsed.push_back("EXT_mesh_features");
+    }
+}
+
+void Model::to_gltf_attribute(tinygltf::Model & model, tinygltf::Primitive & primitive, const string &name, const tvec3 & offset) const
 {
-    int accessor_index;
+    int accessor_index, indices_accessor_index;
     AttributeType type;
     shared_ptr<Attribute> position_attribute = get_attribute(name);
-    position_attribute->to_gltf(model, type, accessor_index);
+    position_attribute->to_gltf(model, type, accessor_index, indices_accessor_index, offset);
 
     if (name == "POSITION") {
         primitive.mode = type_to_gltf(type);
+        primitive.indices = indices_accessor_index;
     } 
 
     primitive.attributes[name] = accessor_index;
@@ -218,17 +391,18 @@ AttributeType type_from_gltf(int mode)
 }
 
 
-void Model::from_gltf(const tinygltf::Model & model, const int mesh_index)
+//every primitive of a mesh is imported as a separate model, e.g. merged tiles of several primitive types
+void Model::from_gltf(const tinygltf::Model & model, const int mesh_index, const int primitive_index)
 {
-    mesh_validity_check(model, mesh_index);
+    mesh_validity_check(model, mesh_index, primitive_index);
     const tinygltf::Mesh & mesh = model.meshes[mesh_index];
     metadata = to_json_value(model.meshes[mesh_index].extras);
-    const tinygltf::Primitive & primitive = mesh.primitives[0];
-    from_gltf_attribute(model, primitive, "POSITION", type_from_gltf(primitive.mode));
+    const tinygltf::Primitive & primitive = mesh.primitives[primitive_index];
+    from_gltf_attribute(model, primitive, "POSITION", type_from_gltf(primitive.mode), primitive.indices);
     //from_gltf_attribute(model, primitive, "NORMAL", AttributeType::NORMAL);
 }
 
-void Model::from_gltf_attribute(const tinygltf::Model & model, const tinygltf::Primitive & primitive, const string &name, AttributeType type)
+void Model::from_gltf_attribute(const tinygltf::Model & model, const tinygltf::Primitive & primitive, const string &name, AttributeType type, const int indices_accessor_index)
 {
     if (primitive.attributes.find(name) == primitive.attributes.end()) {
         throw runtime_error("Attribute does not exist");
@@ -236,7 +410,7 @@ void Model::from_gltf_attribute(const tinygltf::Model & model, const tinygltf::P
 
     int attribute_index = primitive.attributes.at(name);
     shared_ptr<Attribute> attribute = make_shared<Attribute>();
-    attribute->from_gltf(model, type, attribute_index);
+    attribute->from_gltf(model, type, attribute_index, indices_accessor_index);
     add_attribute(name, attribute);
 }
 
@@ -244,21 +418,21 @@ void Model::from_gltf_attribute(const tinygltf::Model & model, const tinygltf::P
 //===============================================================================
 // Checks
 
-void Model::mesh_validity_check(const tinygltf::Model & model, const int mesh_index)
+void Model::mesh_validity_check(const tinygltf::Model & model, const int mesh_index, const int primitive_index)
 {
-    if (mesh_index >= model.meshes.size()) {
+    if (mesh_index < 0 || mesh_index >= (int) model.meshes.size()) {
         throw runtime_error("Mesh index out of range");
     }
 
-    if (model.meshes[mesh_index].primitives.size() != 1) {
-        throw runtime_error("Only one primitive per mesh is supported");
+    if (primitive_index < 0 || primitive_index >= (int) model.meshes[mesh_index].primitives.size()) {
+        throw runtime_error("Primitive index out of range");
     }
 
-    if (model.meshes[mesh_index].primitives[0].indices != -1) {
-        throw runtime_error("Indices are not supported");
+    size_t imported = 0;
+    for (const auto & pair : model.meshes[mesh_index].primitives[primitive_index].attributes) {
+        imported += gltf_imported_attribute(pair.first);
     }
-
-    if (model.meshes[mesh_index].primitives[0].attributes.size() != 1) {
+    if (imported != 1) {
         throw runtime_error("Only one attribute per primitive is supported");
     }
 }
@@ -266,15 +440,32 @@ void Model::mesh_validity_check(const tinygltf::Model & model, const int mesh_in
 
 //===============================================================================
 
-shared_ptr<Model> merge_models(vector<shared_ptr<Model>> models)
+//POSITION attributes are merged into one model per primitive type, every vertex keeps the index
+//of its source model as feature ID; other attributes are dropped, merged models only exist
+//to be exported and the glTF export writes POSITION only
+vector<shared_ptr<Model>> merge_models(const vector<shared_ptr<Model>> & models)
 {
-    if (models.size() == 0)
-        return make_shared<Model>();
-
-    shared_ptr<Model> model = models[0]->clone();
+    map<AttributeType, pair<vector<shared_ptr<Attribute>>, vector<uint32_t>>> groups;
+    for (size_t i = 0; i < models.size(); i++) {
+        if (!models[i]->attribute_exists("POSITION")) {
+            continue;
+        }
+        auto position = models[i]->get_attribute("POSITION");
+        if (position->size() == 0) {
+            continue;
+        }
+        auto & group = groups[position->get_type()];
+        group.first.push_back(position);
+        group.second.push_back(i);
+    }
 
-    for (int i = 1; i < models.size(); i++) {
-        model->merge(models[i]);
+    vector<shared_ptr<Model>> merged;
+    for (auto & group : groups) {
+        vector<uint32_t> ids;
+        auto model = make_shared<Model>();
+        model->add_attribute("POSITION", Attribute::merged(group.second.first, group.second.second, ids));
+        model->set_feature_ids(move(ids));
+        merged.push_back(model);
     }
-    return model;
-}
\ No newline at end of file
+    return merged;
+}
@@ -3,6 +3,7 @@
 #include <unordered_map>
 #include "types.hpp"
 #include "attribute.hpp"
+#include "properties.hpp"
 #include "gltf/json.hpp"
 
 using namespace std;
@@ -15,40 +16,61 @@ public:
 
 
     tvec3 get_centroid() const;
-    void merge(shared_ptr<Model> model);
     shared_ptr<Model> clone() const;
+    shared_ptr<Model> simplified(const tfloat cell_size) const;
 
 
     void add_attribute(const string &name, shared_ptr<Attribute> attribute);
     shared_ptr<Attribute> get_attribute(const string &name) const;
     bool attribute_exists(const string &name);
+    vector<string> get_attribute_names() const;
 
     void set_metadata(nlohmann::json data);
     nlohmann::json get_metadata() const;
+    void bind_metadata(shared_ptr<const PropertyTable> table, const size_t row);
+    void store_metadata(const shared_ptr<PropertyTable> & table);
+    void export_metadata(PropertyTable & table) const;
+    void set_feature_ids(vector<uint32_t> ids);
+    const vector<uint32_t> & get_feature_ids() const;
 
-    void from_gltf(const tinygltf::Model & model, const int mesh_index);
-    void to_gltf(tinygltf::Model & model) const;
+    void from_gltf(const tinygltf::Model & model, const int mesh_index, const int primitive_index = 0);
+    void transform(const tmat4d & matrix, const tvec3d & origin);
+    void translate(const tvec3d & offset);
+
+    bool to_gltf(tinygltf::Model & model, const bool extras = true, const tvec3 & offset = tvec3(0)) const;
+    static bool to_gltf(tinygltf::Model & model, const vector<shared_ptr<Model>> & parts, const tvec3 & offset = tvec3(0));
+
+    void serialize(ostream & out) const;
+    void deserialize(istream & in);
 
 protected:
     bool has_any_geometry() const;
 
 
-    void to_gltf_attribute(tinygltf::Model & model, tinygltf::Primitive & primitive, const string &name) const;
+    void to_gltf_attribute(tinygltf::Model & model, tinygltf::Primitive & primitive, const string &name, const tvec3 & offset) const;
+    void to_gltf_features(tinygltf::Model & model, tinygltf::Primitive & primitive) const;
     void to_gltf_scene(tinygltf::Model & model, const int mesh_index) const;
     void to_gltf_node(tinygltf::Model & model, const int mesh_index, int & node_index) const;
-    void to_gltf_mesh(tinygltf::Model & model, int & mesh_index) const;
-    void to_gltf_primitive(tinygltf::Model & model, tinygltf::Mesh & mesh) const;
+    void to_gltf_mesh(tinygltf::Model & model, int & mesh_index, const bool extras, const tvec3 & offset) const;
+    void to_gltf_primitive(tinygltf::Model & model, tinygltf::Mesh & mesh, const tvec3 & offset) const;
     void to_gltf_scene(tinygltf::Model & model, tinygltf::Scene & scene) const;
 
-    void from_gltf_attribute(const tinygltf::Model & model, const tinygltf::Primitive & primitive, const string &name, AttributeType type);
+    void from_gltf_attribute(const tinygltf::Model & model, const tinygltf::Primitive & primitive, const string &name, AttributeType type, const int indices_accessor_index = -1);
     void compute_normals();
 
-    void mesh_validity_check(const tinygltf::Model & model, const int mesh_index);
+    void mesh_validity_check(const tinygltf::Model & model, const int mesh_index, const int primitive_index);
     void attr_validity_check(const tinygltf::Model & model, const int attribute_index);
     
     unordered_map<string, shared_ptr<Attribute>> attrib;
+    //metadata either lives in the model or in a row of a shared property table,
+    //a bound row is copied into the model on the first modification
     nlohmann::json metadata;
+    shared_ptr<const PropertyTable> table;
+    size_t row = 0;
+    //per-vertex index of the source model in merged models, exported as _FEATURE_ID_0
+    vector<uint32_t> feature_ids;
 };
 
-shared_ptr<Model> merge_models(vector<shared_ptr<Model>> models);
+vector<shared_ptr<Model>> merge_models(const vector<shared_ptr<Model>> & models);
+AttributeType type_from_gltf(int mode);
 
@@ -0,0 +1,61 @@
+#pragma once
+#include <thread>
+#include <atomic>
+#include <mutex>
+#include <vector>
+#include <functional>
+#include <exception>
+#include <algorithm>
+
+using namespace std;
+
+inline size_t thread_count(const size_t threads)
+{
+    if (threads > 0)
+        return threads;
+    return max(1u, thread::hardware_concurrency());
+}
+
+// Runs task(i) for every i in [0, count) on a pool of threads, threads == 0 uses all cores.
+// Items are handed out one by one so that uneven items balance out; the first exception
+// thrown by any task stops the remaining work and is rethrown in the calling thread.
+inline void parallel_for(const size_t count, const size_t threads, const function<void(size_t)> & task)
+{
+    const size_t workers = min(thread_count(threads), count);
+    if (workers <= 1)
+    {
+        for (size_t i = 0; i < count; i++)
+            task(i);
+        return;
+    }
+
+    atomic<size_t> next(0);
+    exception_ptr error;
+    mutex error_mutex;
+
+    auto worker = [&]() {
+        size_t i;
+        while ((i = next++) < count)
+        {
+            try {
+                task(i);
+            } catch (...) {
+                lock_guard<mutex> lock(error_mutex);
+                if (!error)
+                    error = current_exception();
+                next = count;
+            }
+        }
+    };
+
+    vector<thread> pool;
+    for (size_t t = 1; t < workers; t++)
+        pool.emplace_back(worker);
+    worker();
+
+    for (auto & t : pool)
+        t.join();
+
+    if (error)
+        rethrow_exception(error);
+}
@@ -1,5 +1,6 @@
 #pragma once
 #include <thread>
+#include <atomic>
 #include <iostream>
 
 using namespace std;
@@ -33,7 +34,7 @@ protected:
             seconds = elapsed.count() - hours * 3600 - minutes * 60;
             position = (position + 1) % icon.size();
             
-            printf("\r%c %s %zu - %02d:%02d:%02d", icon[position], title.c_str(), counter, hours, minutes, seconds);
+            printf("\r%c %s %zu - %02d:%02d:%02d", icon[position], title.c_str(), counter.load(), hours, minutes, seconds);
             fflush(stdout);
 
             this_thread::sleep_for(chrono::milliseconds(100));
@@ -42,8 +43,8 @@ protected:
 
     string title;
     unique_ptr<thread> print_thread; 
-    size_t counter;
-    bool stop;
+    atomic<size_t> counter;
+    atomic<bool> stop;
     string icon = "-\\|/";
     char position; 
 };
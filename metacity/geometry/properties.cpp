@@ -0,0 +1,616 @@
+#include <limits>
+#include <cstring>
+#include <algorithm>
+#include <unordered_set>
+#include "properties.hpp"
+#include "gltfio.hpp"
+#include "convert.hpp"
+#include "serialization.hpp"
+
+#define METADATA_EXTENSION "EXT_structural_metadata"
+#define METADATA_CLASS "feature"
+
+PropertyType value_type(const nlohmann::json & value)
+{
+    if (value.is_boolean())
+        return PropertyType::BOOLEAN;
+    if (value.is_number_unsigned() && value.get<uint64_t>() > (uint64_t) numeric_limits<int64_t>::max())
+        return PropertyType::JSON;
+    if (value.is_number_integer())
+        return PropertyType::INTEGER;
+    if (value.is_number_float())
+        return PropertyType::FLOAT;
+    if (value.is_string())
+        return PropertyType::STRING;
+    return PropertyType::JSON;
+}
+
+//integers stored in FLOAT columns have to survive the conversion to double
+bool exact_float(const int64_t value)
+{
+    const int64_t limit = (int64_t) 1 << numeric_limits<double>::digits;
+    return value >= -limit && value <= limit;
+}
+
+void resize_column(PropertyColumn & column, const size_t size)
+{
+    column.valid.resize(size);
+    switch (column.type)
+    {
+    case PropertyType::BOOLEAN:
+    case PropertyType::INTEGER:
+        column.integers.resize(size);
+        break;
+    case PropertyType::FLOAT:
+        column.floats.resize(size);
+        break;
+    case PropertyType::STRING:
+    case PropertyType::JSON:
+        column.strings.resize(size);
+        break;
+    default:
+        break;
+    }
+}
+
+nlohmann::json column_value(const PropertyColumn & column, const size_t row)
+{
+    switch (column.type)
+    {
+    case PropertyType::BOOLEAN:
+        return (bool) column.integers[row];
+    case PropertyType::INTEGER:
+        return column.integers[row];
+    case PropertyType::FLOAT:
+        if (column.valid[row] == PROPERTY_INTEGRAL)
+            return (int64_t) column.floats[row];
+        return column.floats[row];
+    case PropertyType::STRING:
+        return column.strings[row];
+    case PropertyType::JSON:
+        return nlohmann::json::parse(column.strings[row]);
+    default:
+        return nullptr;
+    }
+}
+
+//===============================================================================
+
+size_t PropertyTable::size() const
+{
+    return rows;
+}
+
+size_t PropertyTable::append()
+{
+    rows++;
+    for (auto & column : columns)
+        resize_column(column, rows);
+    return rows - 1;
+}
+
+size_t PropertyTable::append(const nlohmann::json & object)
+{
+    const size_t row = append();
+    if (object.is_object())
+        for (auto & pair : object.items())
+            set(row, pair.key(), pair.value());
+    return row;
+}
+
+size_t PropertyTable::append_row(const PropertyTable & source, const size_t row)
+{
+    const size_t target = append();
+    for (size_t i = 0; i < source.columns.size(); i++)
+    {
+        const auto & from = source.columns[i];
+        if (!from.valid[row])
+            continue;
+
+        auto & to = columns[column_index(source.keys[i])];
+        if (to.type != from.type)
+        {
+            store(to, target, source.get(row, i));
+            continue;
+        }
+
+        //matching columns are copied without a JSON round trip
+        to.valid[target] = from.valid[row];
+        if (from.type == PropertyType::BOOLEAN || from.type == PropertyType::INTEGER)
+            to.integers[target] = from.integers[row];
+        else if (from.type == PropertyType::FLOAT)
+            to.floats[target] = from.floats[row];
+        else
+            to.strings[target] = from.strings[row];
+    }
+    return target;
+}
+
+void PropertyTable::set(const size_t row, const string & key, const nlohmann::json & value)
+{
+    if (row >= rows)
+        throw out_of_range("Property row out of range");
+
+    if (value.is_null())
+    {
+        const auto it = lookup.find(key);
+        if (it != lookup.end())
+            columns[it->second].valid[row] = 0;
+        return;
+    }
+
+    store(columns[column_index(key)], row, value);
+}
+
+nlohmann::json PropertyTable::get(const size_t row, const size_t column) const
+{
+    if (!columns[column].valid[row])
+        return nullptr;
+    return column_value(columns[column], row);
+}
+
+//rows without any value read as null, the same as models without metadata
+nlohmann::json PropertyTable::row(const size_t row) const
+{
+    nlohmann::json object;
+    for (size_t i = 0; i < columns.size(); i++)
+        if (columns[i].valid[row])
+            object[keys[i]] = column_value(columns[i], row);
+    return object;
+}
+
+const vector<string> & PropertyTable::get_keys() const
+{
+    return keys;
+}
+
+const PropertyColumn & PropertyTable::get_column(const string & key) const
+{
+    const auto it = lookup.find(key);
+    if (it == lookup.end())
+        throw runtime_error("Property does not exist");
+    return columns[it->second];
+}
+
+size_t PropertyTable::column_index(const string & key)
+{
+    const auto it = lookup.find(key);
+    if (it != lookup.end())
+        return it->second;
+
+    keys.push_back(key);
+    columns.emplace_back();
+    columns.back().valid.resize(rows);
+    lookup[key] = columns.size() - 1;
+    return columns.size() - 1;
+}
+
+void PropertyTable::store(PropertyColumn & column, const size_t row, const nlohmann::json & value)
+{
+    //integers and floats share a FLOAT column as long as the integers are exact doubles,
+    //other mixed columns keep their values as JSON
+    const PropertyType type = value_type(value);
+    if (column.type == PropertyType::EMPTY)
+        promote(column, type);
+    else if (column.type == PropertyType::INTEGER && type == PropertyType::FLOAT)
+        promote(column, all_of(column.integers.begin(), column.integers.end(), exact_float) ? PropertyType::FLOAT : PropertyType::JSON);
+    else if (column.type == PropertyType::FLOAT && type == PropertyType::INTEGER)
+    {
+        if (!exact_float(value.get<int64_t>()))
+            promote(column, PropertyType::JSON);
+    }
+    else if (column.type != type)
+        promote(column, PropertyType::JSON);
+
+    column.valid[row] = 1;
+    switch (column.type)
+    {
+    case PropertyType::BOOLEAN:
+        column.integers[row] = value.get<bool>();
+        break;
+    case PropertyType::INTEGER:
+        column.integers[row] = value.get<int64_t>();
+        break;
+    case PropertyType::FLOAT:
+        column.floats[row] = value.get<double>();
+        if (type == PropertyType::INTEGER)
+            column.valid[row] = PROPERTY_INTEGRAL;
+        break;
+    case PropertyType::STRING:
+        column.strings[row] = value.get<string>();
+        break;
+    default:
+        column.strings[row] = value.dump();
+        break;
+    }
+}
+
+void PropertyTable::promote(PropertyColumn & column, const PropertyType type)
+{
+    const size_t size = column.valid.size();
+    if (column.type == PropertyType::INTEGER && type == PropertyType::FLOAT)
+    {
+        column.floats.assign(column.integers.begin(), column.integers.end());
+        for (auto & valid : column.valid)
+            if (valid)
+                valid = PROPERTY_INTEGRAL;
+    }
+    else if (column.type != PropertyType::EMPTY && type == PropertyType::JSON)
+    {
+        vector<string> strings(size);
+        for (size_t i = 0; i < size; i++)
+            if (column.valid[i])
+                strings[i] = column_value(column, i).dump();
+        column.strings = move(strings);
+        for (auto & valid : column.valid)
+            valid = valid ? 1 : 0;
+    }
+
+    if (type != PropertyType::BOOLEAN && type != PropertyType::INTEGER)
+        vector<int64_t>().swap(column.integers);
+    if (type != PropertyType::FLOAT)
+        vector<double>().swap(column.floats);
+    column.type = type;
+    resize_column(column, size);
+}
+
+//===============================================================================
+
+string property_id(const string & key, unordered_set<string> & used)
+{
+    //schema identifiers are restricted to [a-zA-Z_][a-zA-Z0-9_]*, the key itself is kept as the name
+    string id = key;
+    for (auto & c : id)
+        if (!isalnum((unsigned char) c) && c != '_')
+            c = '_';
+    if (id.empty() || isdigit((unsigned char) id[0]))
+        id = "_" + id;
+
+    string unique = id;
+    for (size_t i = 1; used.count(unique); i++)
+        unique = id + "_" + to_string(i);
+    used.insert(unique);
+    return unique;
+}
+
+template <typename T>
+int column_view(tinygltf::Model & model, const vector<T> & values)
+{
+    return gltf_append_buffer_view(model, values.data(), values.size() * sizeof(T), 0, 8);
+}
+
+template <typename T>
+void string_views(tinygltf::Model & model, const vector<string> & strings, nlohmann::json & property)
+{
+    vector<uint8_t> text;
+    vector<T> offsets(1, 0);
+    for (const auto & s : strings)
+    {
+        text.insert(text.end(), s.begin(), s.end());
+        offsets.push_back(text.size());
+    }
+    //buffer views may not be empty
+    if (text.empty())
+        text.push_back(0);
+    property["values"] = column_view(model, text);
+    property["stringOffsets"] = column_view(model, offsets);
+    property["stringOffsetType"] = sizeof(T) == 4 ? "UINT32" : "UINT64";
+}
+
+void write_column(tinygltf::Model & model, const PropertyColumn & column, nlohmann::json & definition, nlohmann::json & property)
+{
+    const size_t size = column.valid.size();
+    const bool missing = find(column.valid.begin(), column.valid.end(), 0) != column.valid.end();
+    const int64_t integer_nodata = numeric_limits<int64_t>::min();
+    const double float_nodata = numeric_limits<double>::lowest();
+
+    //missing values need a noData sentinel that no present value uses, otherwise the column is written as JSON text
+    PropertyType type = column.type;
+    for (size_t i = 0; missing && i < size && type != PropertyType::JSON; i++)
+    {
+        if (type == PropertyType::BOOLEAN)
+            type = PropertyType::JSON;
+        else if (column.valid[i] && ((type == PropertyType::INTEGER && column.integers[i] == integer_nodata)
+                 || (type == PropertyType::FLOAT && column.floats[i] == float_nodata)
+                 || (type == PropertyType::STRING && column.strings[i].empty())))
+            type = PropertyType::JSON;
+    }
+
+    if (type == PropertyType::BOOLEAN)
+    {
+        vector<uint8_t> bits((size + 7) / 8, 0);
+        for (size_t i = 0; i < size; i++)
+            if (column.integers[i])
+                bits[i / 8] |= 1 << (i % 8);
+        definition["type"] = "BOOLEAN";
+        property["values"] = column_view(model, bits);
+    }
+    else if (type == PropertyType::INTEGER)
+    {
+        vector<int64_t> values(size);
+        for (size_t i = 0; i < size; i++)
+            values[i] = column.valid[i] ? column.integers[i] : integer_nodata;
+        definition["type"] = "SCALAR";
+        definition["componentType"] = "INT64";
+        if (missing)
+            definition["noData"] = (double) integer_nodata;
+        property["values"] = column_view(model, values);
+    }
+    else if (type == PropertyType::FLOAT)
+    {
+        vector<double> values(size);
+        for (size_t i = 0; i < size; i++)
+            values[i] = column.valid[i] ? column.floats[i] : float_nodata;
+        definition["type"] = "SCALAR";
+        definition["componentType"] = "FLOAT64";
+        if (missing)
+            definition["noData"] = float_nodata;
+        property["values"] = column_view(model, values);
+    }
+    else
+    {
+        vector<string> strings(size);
+        for (size_t i = 0; i < size; i++)
+            if (column.valid[i])
+                strings[i] = (type == column.type) ? column.strings[i] : column_value(column, i).dump();
+        size_t length = 0;
+        for (const auto & s : strings)
+            length += s.size();
+
+        definition["type"] = "STRING";
+        if (missing)
+            definition["noData"] = "";
+        if (type == PropertyType::JSON)
+            definition["extras"] = {{"encoding", "json"}};
+        if (length <= numeric_limits<uint32_t>::max())
+            string_views<uint32_t>(model, strings, property);
+        else
+            string_views<uint64_t>(model, strings, property);
+    }
+}
+
+void PropertyTable::to_gltf(tinygltf::Model & model) const
+{
+    if (rows == 0 || columns.empty())
+        return;
+
+    nlohmann::json definitions = nlohmann::json::object();
+    nlohmann::json properties = nlohmann::json::object();
+    unordered_set<string> used;
+    for (size_t i = 0; i < columns.size(); i++)
+    {
+        if (columns[i].type == PropertyType::EMPTY)
+            continue;
+        const string id = property_id(keys[i], used);
+        nlohmann::json definition = {{"name", keys[i]}};
+        nlohmann::json property = nlohmann::json::object();
+        write_column(model, columns[i], definition, property);
+        definitions[id] = definition;
+        properties[id] = property;
+    }
+
+    nlohmann::json schema = {{"id", "metacity"}};
+    schema["classes"][METADATA_CLASS]["properties"] = definitions;
+    nlohmann::json table = {{"class", METADATA_CLASS}, {"count", rows}};
+    table["properties"] = properties;
+
+    nlohmann::json extension = {{"schema", schema}};
+    extension["propertyTables"] = nlohmann::json::array({table});
+    model.extensions[METADATA_EXTENSION] = to_gltf_value(extension);
+    model.extensionsUsed.push_back(METADATA_EXTENSION);
+}
+
+//===============================================================================
+
+void check_range(const pair<const uint8_t *, size_t> & data, const size_t size)
+{
+    if (size > data.second)
+        throw runtime_error("Property table out of range");
+}
+
+template <typename T>
+void read_scalars(const pair<const uint8_t *, size_t> & data, const size_t count, const nlohmann::json & definition, PropertyColumn & column)
+{
+    check_range(data, count * sizeof(T));
+    const bool has_nodata = definition.count("noData");
+    const T nodata = has_nodata ? (T) definition.at("noData").get<double>() : T();
+
+    for (size_t i = 0; i < count; i++)
+    {
+        T value;
+        memcpy(&value, data.first + i * sizeof(T), sizeof(T));
+        if (has_nodata && value == nodata)
+            continue;
+        column.valid[i] = 1;
+        if (column.type == PropertyType::FLOAT)
+            column.floats[i] = value;
+        else
+            column.integers[i] = value;
+    }
+}
+
+uint64_t read_offset(const uint8_t * ptr, const size_t index, const size_t size)
+{
+    uint64_t offset = 0;
+    memcpy(&offset, ptr + index * size, size); //little endian
+    return offset;
+}
+
+void read_strings(const pair<const uint8_t *, size_t> & data, const pair<const uint8_t *, size_t> & offsets, const size_t count,
+                  const size_t offset_size, const nlohmann::json & definition, PropertyColumn & column)
+{
+    check_range(offsets, (count + 1) * offset_size);
+    const bool has_nodata = definition.count("noData");
+    const string nodata = has_nodata ? definition.at("noData").get<string>() : "";
+
+    for (size_t i = 0; i < count; i++)
+    {
+        const uint64_t begin = read_offset(offsets.first, i, offset_size), end = read_offset(offsets.first, i + 1, offset_size);
+        if (begin > end || end > data.second)
+            throw runtime_error("Property table out of range");
+        string value(data.first + begin, data.first + end);
+        if (has_nodata && value == nodata)
+            continue;
+        column.valid[i] = 1;
+        column.strings[i] = move(value);
+    }
+}
+
+size_t offset_size(const string & type)
+{
+    if (type == "UINT8")
+        return 1;
+    if (type == "UINT16")
+        return 2;
+    if (type == "UINT32")
+        return 4;
+    if (type == "UINT64")
+        return 8;
+    throw runtime_error("Unsupported string offset type");
+}
+
+shared_ptr<PropertyTable> PropertyTable::from_gltf(const nlohmann::json & extensions, const BufferViewData & view)
+{
+    if (!extensions.is_object() || !extensions.count(METADATA_EXTENSION))
+        return nullptr;
+
+    //external schemas (schemaUri) are not resolved
+    const auto & extension = extensions.at(METADATA_EXTENSION);
+    const auto tables = extension.value("propertyTables", nlohmann::json::array());
+    if (tables.empty() || !extension.count("schema"))
+        return nullptr;
+
+    const auto & table = tables[0];
+    const auto & schema_class = extension.at("schema").at("classes").at(table.at("class").get<string>());
+    const auto definitions = schema_class.value("properties", nlohmann::json::object());
+
+    auto properties = make_shared<PropertyTable>();
+    properties->rows = table.at("count").get<size_t>();
+    const size_t count = properties->rows;
+
+    const auto columns = table.value("properties", nlohmann::json::object());
+    for (auto & item : columns.items())
+    {
+        const auto & definition = definitions.at(item.key());
+        const auto & property = item.value();
+        const string type = definition.at("type");
+        //arrays, vectors, matrices and enums are not supported
+        if (definition.value("array", false) || (type != "SCALAR" && type != "STRING" && type != "BOOLEAN"))
+            continue;
+
+        const size_t index = properties->column_index(definition.value("name", item.key()));
+        auto & column = properties->columns[index];
+        const auto data = view(property.at("values").get<size_t>());
+
+        if (type == "BOOLEAN")
+        {
+            properties->promote(column, PropertyType::BOOLEAN);
+            check_range(data, (count + 7) / 8);
+            for (size_t i = 0; i < count; i++)
+            {
+                column.valid[i] = 1;
+                column.integers[i] = (data.first[i / 8] >> (i % 8)) & 1;
+            }
+        }
+        else if (type == "STRING")
+        {
+            const bool json = definition.value("extras", nlohmann::json::object()).value("encoding", "") == "json";
+            properties->promote(column, json ? PropertyType::JSON : PropertyType::STRING);
+            read_strings(data, view(property.at("stringOffsets").get<size_t>()), count,
+                         offset_size(property.value("stringOffsetType", "UINT32")), definition, column);
+        }
+        else
+        {
+            const string component = definition.at("componentType");
+            const bool floating = component == "FLOAT32" || component == "FLOAT64";
+            properties->promote(column, floating ? PropertyType::FLOAT : PropertyType::INTEGER);
+            if (component == "INT8")
+                read_scalars<int8_t>(data, count, definition, column);
+            else if (component == "UINT8")
+                read_scalars<uint8_t>(data, count, definition, column);
+            else if (component == "INT16")
+                read_scalars<int16_t>(data, count, definition, column);
+            else if (component == "UINT16")
+                read_scalars<uint16_t>(data, count, definition, column);
+            else if (component == "INT32")
+                read_scalars<int32_t>(data, count, definition, column);
+            else if (component == "UINT32")
+                read_scalars<uint32_t>(data, count, definition, column);
+            else if (component == "INT64")
+                read_scalars<int64_t>(data, count, definition, column);
+            else if (component == "UINT64")
+                read_scalars<uint64_t>(data, count, definition, column);
+            else if (component == "FLOAT32")
+                read_scalars<float>(data, count, definition, column);
+            else if (component == "FLOAT64")
+                read_scalars<double>(data, count, definition, column);
+            else
+                throw runtime_error("Unsupported property component type");
+        }
+    }
+    return properties;
+}
+
+shared_ptr<PropertyTable> PropertyTable::from_gltf(const tinygltf::Model & model)
+{
+    nlohmann::json extensions = nlohmann::json::object();
+    for (const auto & pair : model.extensions)
+        extensions[pair.first] = to_json_value(pair.second);
+
+    return from_gltf(extensions, [&model](size_t index) {
+        const auto & view = model.bufferViews.at(index);
+        const auto & buffer = model.buffers.at(view.buffer).data;
+        if (view.byteOffset + view.byteLength > buffer.size())
+            throw runtime_error("Buffer view out of range");
+        return make_pair(buffer.data() + view.byteOffset, (size_t) view.byteLength);
+    });
+}
+
+//===============================================================================
+// Binary serialization
+
+void PropertyTable::serialize(ostream & out) const
+{
+    write_value<uint64_t>(out, rows);
+    write_value<uint64_t>(out, keys.size());
+    for (size_t i = 0; i < keys.size(); i++)
+    {
+        const auto & column = columns[i];
+        write_string(out, keys[i]);
+        write_value<uint8_t>(out, (uint8_t) column.type);
+        write_vector(out, column.valid);
+        write_vector(out, column.integers);
+        write_vector(out, column.floats);
+        write_value<uint64_t>(out, column.strings.size());
+        for (const auto & value : column.strings)
+            write_string(out, value);
+    }
+}
+
+void PropertyTable::deserialize(istream & in)
+{
+    rows = read_value<uint64_t>(in);
+    const uint64_t count = read_value<uint64_t>(in);
+    keys.clear();
+    lookup.clear();
+    columns.assign(count, PropertyColumn());
+    for (size_t i = 0; i < count; i++)
+    {
+        auto & column = columns[i];
+        keys.push_back(read_string(in));
+        lookup[keys.back()] = i;
+        column.type = (PropertyType) read_value<uint8_t>(in);
+        if (column.type > PropertyType::JSON)
+            throw runtime_error("Corrupted property table");
+        read_vector(in, column.valid);
+        read_vector(in, column.integers);
+        read_vector(in, column.floats);
+        column.strings.resize(read_value<uint64_t>(in));
+        for (auto & value : column.strings)
+            value = read_string(in);
+
+        const size_t values = column.integers.size() + column.floats.size() + column.strings.size();
+        if (column.valid.size() != rows || (values != rows && !(column.type == PropertyType::EMPTY && values == 0)))
+            throw runtime_error("Corrupted property table");
+    }
+}
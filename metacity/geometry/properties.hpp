@@ -0,0 +1,69 @@
+#pragma once
+#include <vector>
+#include <string>
+#include <memory>
+#include <functional>
+#include <unordered_map>
+#include "gltf/json.hpp"
+#include "gltf/tiny_gltf.h"
+
+using namespace std;
+
+enum class PropertyType : uint8_t {
+    EMPTY,
+    BOOLEAN,
+    INTEGER,
+    FLOAT,
+    STRING,
+    JSON
+};
+
+//value of a valid flag in FLOAT columns, the row holds an integer and reads back as one
+static const uint8_t PROPERTY_INTEGRAL = 2;
+
+//a single typed column, every row has a slot and a validity flag; mixed or nested values
+//are kept as serialized JSON, every row reads back exactly as it was stored
+struct PropertyColumn {
+    PropertyType type = PropertyType::EMPTY;
+    vector<uint8_t> valid;
+    vector<int64_t> integers;
+    vector<double> floats;
+    vector<string> strings;
+};
+
+//bytes of a glTF buffer view
+using BufferViewData = function<pair<const uint8_t *, size_t>(size_t)>;
+
+//columnar metadata of a set of models, one row per model, keys are interned into columns;
+//exported as a single EXT_structural_metadata property table instead of per-mesh extras
+class PropertyTable {
+public:
+    size_t size() const;
+    size_t append();
+    size_t append(const nlohmann::json & object);
+    size_t append_row(const PropertyTable & source, const size_t row);
+
+    void set(const size_t row, const string & key, const nlohmann::json & value);
+    nlohmann::json get(const size_t row, const size_t column) const;
+    nlohmann::json row(const size_t row) const;
+
+    const vector<string> & get_keys() const;
+    const PropertyColumn & get_column(const string & key) const;
+
+    void serialize(ostream & out) const;
+    void deserialize(istream & in);
+
+    void to_gltf(tinygltf::Model & model) const;
+    static shared_ptr<PropertyTable> from_gltf(const nlohmann::json & extensions, const BufferViewData & view);
+    static shared_ptr<PropertyTable> from_gltf(const tinygltf::Model & model);
+
+protected:
+    size_t column_index(const string & key);
+    void store(PropertyColumn & column, const size_t row, const nlohmann::json & value);
+    void promote(PropertyColumn & column, const PropertyType type);
+
+    size_t rows = 0;
+    vector<string> keys;
+    unordered_map<string, size_t> lookup;
+    vector<PropertyColumn> columns;
+};
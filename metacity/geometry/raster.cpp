@@ -0,0 +1,69 @@
+#include <algorithm>
+#include <cmath>
+#include "raster.hpp"
+#include "bvh.hpp"
+#include "parallel.hpp"
+
+struct PixelRange {
+    int64_t i0, i1, j0, j1;
+};
+
+//conservative range of pixel centers under the triangle bounds, the exact test is done per pixel
+PixelRange pixel_range(const tvec3 & lo, const tvec3 & hi, const Raster & raster)
+{
+    const double unit = raster.unit;
+    PixelRange range;
+    range.i0 = max((int64_t) floor((lo.x - raster.xmin) / unit - 0.5), (int64_t) 0);
+    range.i1 = min((int64_t) ceil((hi.x - raster.xmin) / unit - 0.5), (int64_t) raster.dimx - 1);
+    range.j0 = max((int64_t) floor((raster.ymax - hi.y) / unit - 0.5), (int64_t) 0);
+    range.j1 = min((int64_t) ceil((raster.ymax - lo.y) / unit - 0.5), (int64_t) raster.dimy - 1);
+    return range;
+}
+
+vector<tfloat> rasterize_heightmap(const vector<tvec3> & soup, const Raster & raster, const size_t threads, const size_t tile_size_)
+{
+    const size_t tile_size = max(tile_size_, (size_t) 1);
+    const size_t tiles_x = (raster.dimx + tile_size - 1) / tile_size;
+    const size_t tiles_y = (raster.dimy + tile_size - 1) / tile_size;
+    vector<tfloat> heightmap(raster.dimx * raster.dimy, -INFINITY);
+
+    //bin the triangles into every tile their pixel range overlaps
+    const size_t count = soup.size() / 3;
+    vector<BVHTriangle> triangles(count);
+    vector<PixelRange> ranges(count);
+    vector<vector<uint32_t>> bins(tiles_x * tiles_y);
+    for (size_t t = 0; t < count; t++)
+    {
+        const tvec3 & a = soup[t * 3], & b = soup[t * 3 + 1], & c = soup[t * 3 + 2];
+        triangles[t] = {a, b - a, c - a};
+        const PixelRange & range = ranges[t] = pixel_range(glm::min(a, glm::min(b, c)), glm::max(a, glm::max(b, c)), raster);
+        if (range.i0 > range.i1 || range.j0 > range.j1)
+            continue;
+
+        for (int64_t ty = range.j0 / tile_size; ty <= range.j1 / (int64_t) tile_size; ty++)
+            for (int64_t tx = range.i0 / tile_size; tx <= range.i1 / (int64_t) tile_size; tx++)
+                bins[ty * tiles_x + tx].push_back(t);
+    }
+
+    //tiles cover disjoint pixels, each one is filled by a single thread
+    parallel_for(bins.size(), threads, [&](size_t tile) {
+        const int64_t tx0 = (tile % tiles_x) * tile_size, ty0 = (tile / tiles_x) * tile_size;
+        const int64_t tx1 = tx0 + tile_size - 1, ty1 = ty0 + tile_size - 1;
+        tfloat z;
+        for (const auto t : bins[tile])
+        {
+            const PixelRange & range = ranges[t];
+            const BVHTriangle & triangle = triangles[t];
+            for (int64_t j = max(range.j0, ty0); j <= min(range.j1, ty1); j++)
+            {
+                const tfloat y = raster.y(j);
+                tfloat * row = heightmap.data() + j * raster.dimx;
+                for (int64_t i = max(range.i0, tx0); i <= min(range.i1, tx1); i++)
+                    if (vertical_hit(triangle, raster.x(i), y, z))
+                        row[i] = max(row[i], z);
+            }
+        }
+    });
+
+    return heightmap;
+}
@@ -0,0 +1,21 @@
+#pragma once
+#include <vector>
+#include "types.hpp"
+
+using namespace std;
+
+//regular raster over a rectangle, pixels are sampled in their centers and rows go from ymax down
+struct Raster {
+    tfloat xmin;
+    tfloat ymax;
+    tfloat unit;
+    size_t dimx;
+    size_t dimy;
+
+    inline tfloat x(const size_t i) const { return xmin + (i + 0.5f) * unit; }
+    inline tfloat y(const size_t j) const { return ymax - (j + 0.5f) * unit; }
+};
+
+//scan-converts a triangle soup into a z-max buffer, triangles are binned into square tiles
+//of tile_size pixels which are then filled in parallel; uncovered pixels are -INFINITY
+vector<tfloat> rasterize_heightmap(const vector<tvec3> & soup, const Raster & raster, const size_t threads = 0, const size_t tile_size = 128);
@@ -0,0 +1,141 @@
+#include <algorithm>
+#include <numeric>
+#include <queue>
+#include <cmath>
+#include "rtree.hpp"
+
+bool Box::intersects(const Box & other) const
+{
+    return minx <= other.maxx && maxx >= other.minx && miny <= other.maxy && maxy >= other.miny;
+}
+
+tfloat Box::distance(const tfloat x, const tfloat y) const
+{
+    const tfloat dx = max(max(minx - x, x - maxx), (tfloat) 0);
+    const tfloat dy = max(max(miny - y, y - maxy), (tfloat) 0);
+    return sqrt(dx * dx + dy * dy);
+}
+
+Box box_union(const vector<Box> & boxes, const size_t begin, const size_t end)
+{
+    Box box = {INFINITY, INFINITY, -INFINITY, -INFINITY};
+    for (size_t i = begin; i < end; i++)
+    {
+        box.minx = min(box.minx, boxes[i].minx);
+        box.miny = min(box.miny, boxes[i].miny);
+        box.maxx = max(box.maxx, boxes[i].maxx);
+        box.maxy = max(box.maxy, boxes[i].maxy);
+    }
+    return box;
+}
+
+vector<uint32_t> str_order(const vector<Box> & items, const size_t node_size)
+{
+    vector<uint32_t> order(items.size());
+    iota(order.begin(), order.end(), 0);
+
+    auto cx = [&](uint32_t i) { return items[i].minx + items[i].maxx; };
+    auto cy = [&](uint32_t i) { return items[i].miny + items[i].maxy; };
+    sort(order.begin(), order.end(), [&](uint32_t a, uint32_t b) { return cx(a) < cx(b); });
+
+    const size_t node_count = (items.size() + node_size - 1) / node_size;
+    const size_t slice_count = max((size_t) ceil(sqrt((double) node_count)), (size_t) 1);
+    const size_t slice_size = node_size * ((node_count + slice_count - 1) / slice_count);
+    for (size_t begin = 0; begin < order.size(); begin += slice_size)
+    {
+        const size_t end = min(begin + slice_size, order.size());
+        sort(order.begin() + begin, order.begin() + end, [&](uint32_t a, uint32_t b) { return cy(a) < cy(b); });
+    }
+    return order;
+}
+
+RTree::RTree(const vector<Box> & items, const size_t node_size_) : node_size(max(node_size_, (size_t) 2)), item_count(items.size())
+{
+    const auto order = str_order(items, node_size);
+    for (const auto i : order)
+    {
+        boxes.push_back(items[i]);
+        refs.push_back(i);
+    }
+    level_ends.push_back(boxes.size());
+
+    size_t begin = 0;
+    while (boxes.size() - begin > 1)
+    {
+        const size_t end = boxes.size();
+        for (size_t i = begin; i < end; i += node_size)
+        {
+            boxes.push_back(box_union(boxes, i, min(i + node_size, end)));
+            refs.push_back(i);
+        }
+        level_ends.push_back(boxes.size());
+        begin = end;
+    }
+}
+
+size_t RTree::child_end(const size_t node, const size_t level) const
+{
+    return min(refs[node] + node_size, level_ends[level - 1]);
+}
+
+vector<uint32_t> RTree::query_box(const Box & box) const
+{
+    vector<uint32_t> result;
+    if (boxes.empty())
+        return result;
+
+    vector<pair<size_t, size_t>> stack = {{boxes.size() - 1, level_ends.size() - 1}};
+    while (!stack.empty())
+    {
+        const auto [node, level] = stack.back();
+        stack.pop_back();
+        if (!boxes[node].intersects(box))
+            continue;
+
+        if (level == 0)
+        {
+            result.push_back(refs[node]);
+            continue;
+        }
+
+        for (size_t child = refs[node]; child < child_end(node, level); child++)
+            stack.emplace_back(child, level - 1);
+    }
+
+    sort(result.begin(), result.end());
+    return result;
+}
+
+//best-first search, nodes and items are visited in order of their box distance
+vector<uint32_t> RTree::query_nearest(const tfloat x, const tfloat y, const size_t k) const
+{
+    vector<uint32_t> result;
+    if (boxes.empty())
+        return result;
+
+    using entry = tuple<tfloat, size_t, size_t>;
+    priority_queue<entry, vector<entry>, greater<entry>> queue;
+    queue.emplace(boxes.back().distance(x, y), boxes.size() - 1, level_ends.size() - 1);
+    while (!queue.empty() && result.size() < k)
+    {
+        const auto [distance, node, level] = queue.top();
+        queue.pop();
+        if (isinf(distance)) //boxes of models without geometry
+            break;
+
+        if (level == 0)
+        {
+            result.push_back(refs[node]);
+            continue;
+        }
+
+        for (size_t child = refs[node]; child < child_end(node, level); child++)
+            queue.emplace(boxes[child].distance(x, y), child, level - 1);
+    }
+    return result;
+}
+
+size_t RTree::size() const
+{
+    return item_count;
+}
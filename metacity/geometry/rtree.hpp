@@ -0,0 +1,32 @@
+#pragma once
+#include <vector>
+#include "types.hpp"
+
+using namespace std;
+
+struct Box {
+    tfloat minx, miny, maxx, maxy;
+
+    bool intersects(const Box & other) const;
+    tfloat distance(const tfloat x, const tfloat y) const;
+};
+
+//static packed R-tree over 2D boxes, bulk-loaded with Sort-Tile-Recursive packing;
+//all levels are stored in flat arrays, the items first and the root last
+class RTree {
+public:
+    RTree(const vector<Box> & items, const size_t node_size = 16);
+    vector<uint32_t> query_box(const Box & box) const;
+    vector<uint32_t> query_nearest(const tfloat x, const tfloat y, const size_t k) const;
+    size_t size() const;
+
+protected:
+    size_t child_end(const size_t node, const size_t level) const;
+
+    size_t node_size;
+    size_t item_count;
+    vector<Box> boxes;
+    //items refer to their original index, nodes to the position of their first child
+    vector<uint32_t> refs;
+    vector<size_t> level_ends;
+};
@@ -0,0 +1,55 @@
+#pragma once
+#include <iostream>
+#include <vector>
+#include <string>
+#include <stdexcept>
+
+using namespace std;
+
+template <typename T>
+void write_value(ostream & out, const T & value)
+{
+    out.write(reinterpret_cast<const char *>(&value), sizeof(T));
+}
+
+template <typename T>
+T read_value(istream & in)
+{
+    T value;
+    in.read(reinterpret_cast<char *>(&value), sizeof(T));
+    if (!in)
+        throw runtime_error("Unexpected end of serialized data");
+    return value;
+}
+
+//any contiguous array with data() and size()
+template <typename Array>
+void write_vector(ostream & out, const Array & data)
+{
+    write_value<uint64_t>(out, data.size());
+    out.write(reinterpret_cast<const char *>(data.data()), data.size() * sizeof(*data.data()));
+}
+
+template <typename T>
+void read_vector(istream & in, vector<T> & data)
+{
+    data.resize(read_value<uint64_t>(in));
+    in.read(reinterpret_cast<char *>(data.data()), data.size() * sizeof(T));
+    if (!in)
+        throw runtime_error("Unexpected end of serialized data");
+}
+
+inline void write_string(ostream & out, const string & value)
+{
+    write_value<uint32_t>(out, value.size());
+    out.write(value.data(), value.size());
+}
+
+inline string read_string(istream & in)
+{
+    string value(read_value<uint32_t>(in), '\0');
+    in.read(&value[0], value.size());
+    if (!in)
+        throw runtime_error("Unexpected end of serialized data");
+    return value;
+}
@@ -0,0 +1,271 @@
+#include <cstring>
+#include <algorithm>
+#include <stdexcept>
+#include <filesystem>
+#include "snapshot.hpp"
+#include "serialization.hpp"
+
+static const char SNAPSHOT_MAGIC[8] = {'M', 'C', 'S', 'N', 'A', 'P', '\r', '\n'};
+static const uint32_t SNAPSHOT_BYTE_ORDER = 0x01020304;
+static const size_t SNAPSHOT_ALIGNMENT = 16;
+static const size_t SNAPSHOT_NAME_SIZE = 32;
+
+struct SnapshotHeader {
+    char magic[8];
+    uint32_t version;
+    uint32_t kind;
+    uint32_t byte_order;
+    uint32_t reserved;
+    uint64_t directory_offset;
+    uint64_t section_count;
+    uint64_t directory_checksum;
+};
+
+struct SnapshotSection {
+    char name[SNAPSHOT_NAME_SIZE];
+    uint64_t offset;
+    uint64_t size;
+    uint64_t checksum;
+};
+
+static const uint64_t PRIME1 = 0x9E3779B185EBCA87ULL, PRIME2 = 0xC2B2AE3D27D4EB4FULL;
+
+static inline uint64_t rotl(const uint64_t x, const int r)
+{
+    return (x << r) | (x >> (64 - r));
+}
+
+SnapshotChecksum::SnapshotChecksum() : lanes{PRIME1 + PRIME2, PRIME2, 0, 0 - PRIME1} {}
+
+void SnapshotChecksum::consume(const uint8_t * block)
+{
+    uint64_t words[4];
+    memcpy(words, block, sizeof(words));
+    for (int l = 0; l < 4; l++)
+        lanes[l] = rotl(lanes[l] + words[l] * PRIME2, 31) * PRIME1;
+}
+
+void SnapshotChecksum::update(const uint8_t * data, const size_t size)
+{
+    if (size == 0)
+        return;
+    total += size;
+    size_t i = 0;
+    if (tail_size)
+    {
+        const size_t fill = min(sizeof(tail) - tail_size, size);
+        memcpy(tail + tail_size, data, fill);
+        tail_size += fill;
+        i = fill;
+        if (tail_size < sizeof(tail))
+            return;
+        consume(tail);
+        tail_size = 0;
+    }
+
+    for (; i + sizeof(tail) <= size; i += sizeof(tail))
+        consume(data + i);
+
+    memcpy(tail, data + i, size - i);
+    tail_size = size - i;
+}
+
+uint64_t SnapshotChecksum::digest() const
+{
+    uint64_t hash = rotl(lanes[0], 1) + rotl(lanes[1], 7) + rotl(lanes[2], 12) + rotl(lanes[3], 18) + total;
+    for (size_t i = 0; i < tail_size; i++)
+        hash = rotl(hash ^ (tail[i] * PRIME1), 11) * PRIME2;
+
+    hash ^= hash >> 33;
+    hash *= PRIME2;
+    hash ^= hash >> 29;
+    return hash;
+}
+
+uint64_t snapshot_checksum(const uint8_t * data, const size_t size)
+{
+    SnapshotChecksum checksum;
+    checksum.update(data, size);
+    return checksum.digest();
+}
+
+//===============================================================================
+// Writer
+
+SnapshotWriter::SnapshotWriter(const string & filename_, const SnapshotKind kind_)
+    : filename(filename_), partial(filename_ + ".partial"), kind(kind_)
+{
+    file.open(partial, ios::binary | ios::trunc);
+    if (!file)
+        throw runtime_error("Failed to write " + filename);
+
+    const SnapshotHeader header = {};
+    write_value(file, header);
+}
+
+//unfinished snapshots are removed
+SnapshotWriter::~SnapshotWriter()
+{
+    if (file.is_open())
+    {
+        file.close();
+        error_code ignored;
+        filesystem::remove(partial, ignored);
+    }
+}
+
+void SnapshotWriter::add(const string & name, const void * data, const size_t size)
+{
+    begin(name);
+    append(data, size);
+    end();
+}
+
+void SnapshotWriter::add(const string & name, const string & data)
+{
+    add(name, data.data(), data.size());
+}
+
+void SnapshotWriter::begin(const string & name)
+{
+    if (name.size() >= SNAPSHOT_NAME_SIZE)
+        throw runtime_error("Snapshot section name too long: " + name);
+
+    const uint64_t position = file.tellp();
+    const uint64_t offset = (position + SNAPSHOT_ALIGNMENT - 1) / SNAPSHOT_ALIGNMENT * SNAPSHOT_ALIGNMENT;
+    const char padding[SNAPSHOT_ALIGNMENT] = {0};
+    file.write(padding, offset - position);
+    current = {name, offset, 0, 0};
+    checksum = SnapshotChecksum();
+}
+
+void SnapshotWriter::append(const void * data, const size_t size)
+{
+    file.write(static_cast<const char *>(data), size);
+    checksum.update(static_cast<const uint8_t *>(data), size);
+    current.size += size;
+}
+
+void SnapshotWriter::end()
+{
+    current.checksum = checksum.digest();
+    entries.push_back(current);
+}
+
+void SnapshotWriter::close()
+{
+    vector<SnapshotSection> sections(entries.size());
+    for (size_t i = 0; i < entries.size(); i++)
+    {
+        memset(&sections[i], 0, sizeof(SnapshotSection));
+        memcpy(sections[i].name, entries[i].name.data(), entries[i].name.size());
+        sections[i].offset = entries[i].offset;
+        sections[i].size = entries[i].size;
+        sections[i].checksum = entries[i].checksum;
+    }
+
+    SnapshotHeader header = {};
+    memcpy(header.magic, SNAPSHOT_MAGIC, sizeof(SNAPSHOT_MAGIC));
+    header.version = SNAPSHOT_VERSION;
+    header.kind = (uint32_t) kind;
+    header.byte_order = SNAPSHOT_BYTE_ORDER;
+    header.directory_offset = file.tellp();
+    header.section_count = sections.size();
+    header.directory_checksum = snapshot_checksum(reinterpret_cast<const uint8_t *>(sections.data()), sections.size() * sizeof(SnapshotSection));
+
+    file.write(reinterpret_cast<const char *>(sections.data()), sections.size() * sizeof(SnapshotSection));
+    file.seekp(0);
+    write_value(file, header);
+    file.close();
+    if (!file)
+        throw runtime_error("Failed to write " + filename);
+    filesystem::rename(partial, filename);
+}
+
+//===============================================================================
+// Reader
+
+SnapshotReader::SnapshotReader(const string & filename, const SnapshotKind kind, const bool mmap, const bool verify)
+{
+    if (mmap)
+    {
+        mapping = make_shared<const MappedFile>(filename);
+        data = mapping->data();
+        size = mapping->size();
+    }
+    else
+    {
+        ifstream file(filename, ios::binary | ios::ate);
+        if (!file)
+            throw runtime_error("Failed to open " + filename);
+        auto bytes = make_shared<vector<uint8_t>>(file.tellg());
+        file.seekg(0);
+        file.read(reinterpret_cast<char *>(bytes->data()), bytes->size());
+        if (!file)
+            throw runtime_error("Failed to read " + filename);
+        buffer = bytes;
+        data = bytes->data();
+        size = bytes->size();
+    }
+
+    SnapshotHeader header;
+    if (size < sizeof(header))
+        throw runtime_error("Not a Metacity snapshot: " + filename);
+    memcpy(&header, data, sizeof(header));
+    if (memcmp(header.magic, SNAPSHOT_MAGIC, sizeof(SNAPSHOT_MAGIC)) != 0)
+        throw runtime_error("Not a Metacity snapshot: " + filename);
+    if (header.byte_order != SNAPSHOT_BYTE_ORDER)
+        throw runtime_error("Snapshot was written with a different byte order: " + filename);
+    if (header.version > SNAPSHOT_VERSION)
+        throw runtime_error("Unsupported snapshot version " + to_string(header.version) + ": " + filename);
+    if (header.kind != (uint32_t) kind)
+        throw runtime_error("Snapshot contains a different kind of object: " + filename);
+
+    const uint64_t directory_size = header.section_count * sizeof(SnapshotSection);
+    if (header.directory_offset > size || directory_size > size - header.directory_offset)
+        throw runtime_error("Corrupted snapshot directory: " + filename);
+    const uint8_t * directory = data + header.directory_offset;
+    if (snapshot_checksum(directory, directory_size) != header.directory_checksum)
+        throw runtime_error("Corrupted snapshot directory: " + filename);
+
+    for (uint64_t i = 0; i < header.section_count; i++)
+    {
+        SnapshotSection section;
+        memcpy(&section, directory + i * sizeof(SnapshotSection), sizeof(section));
+        const string name(section.name, strnlen(section.name, SNAPSHOT_NAME_SIZE));
+        if (section.offset > size || section.size > size - section.offset || section.offset % SNAPSHOT_ALIGNMENT)
+            throw runtime_error("Corrupted snapshot section " + name + ": " + filename);
+        if (verify && snapshot_checksum(data + section.offset, section.size) != section.checksum)
+            throw runtime_error("Checksum mismatch in snapshot section " + name + ": " + filename);
+        entries.push_back({name, {section.offset, section.size}});
+    }
+}
+
+bool SnapshotReader::has(const string & name) const
+{
+    for (const auto & entry : entries)
+        if (entry.first == name)
+            return true;
+    return false;
+}
+
+pair<const uint8_t *, size_t> SnapshotReader::section(const string & name) const
+{
+    for (const auto & entry : entries)
+        if (entry.first == name)
+            return {data + entry.second.offset, entry.second.size};
+    throw runtime_error("Missing snapshot section " + name);
+}
+
+string SnapshotReader::text(const string & name) const
+{
+    const auto bytes = section(name);
+    return string(reinterpret_cast<const char *>(bytes.first), bytes.second);
+}
+
+shared_ptr<const void> SnapshotReader::owner() const
+{
+    if (mapping)
+        return mapping;
+    return buffer;
+}
@@ -0,0 +1,102 @@
+#pragma once
+#include <string>
+#include <vector>
+#include <memory>
+#include <fstream>
+#include <cstdint>
+#include "mapped.hpp"
+
+using namespace std;
+
+enum class SnapshotKind : uint32_t {
+    LAYER = 1,
+    GRID = 2
+};
+
+static const uint32_t SNAPSHOT_VERSION = 1;
+
+//64-bit multiply-rotate hash over four independent lanes, word-wise so that it runs close to memory bandwidth
+class SnapshotChecksum {
+public:
+    SnapshotChecksum();
+    void update(const uint8_t * data, const size_t size);
+    uint64_t digest() const;
+
+protected:
+    void consume(const uint8_t * block);
+
+    uint64_t lanes[4];
+    uint8_t tail[32];
+    size_t tail_size = 0;
+    uint64_t total = 0;
+};
+
+uint64_t snapshot_checksum(const uint8_t * data, const size_t size);
+
+//binary snapshot: a fixed header, 16-byte aligned sections and a directory of named, checksummed sections;
+//data is stored in native little-endian layout so that it can be used straight from a memory mapping
+class SnapshotWriter {
+public:
+    SnapshotWriter(const string & filename, const SnapshotKind kind);
+    ~SnapshotWriter();
+    void add(const string & name, const void * data, const size_t size);
+    void add(const string & name, const string & data);
+    template <typename Array>
+    void add_array(const string & name, const Array & data)
+    {
+        add(name, data.data(), data.size() * sizeof(*data.data()));
+    }
+    //sections written piece by piece, e.g. vertices of many models
+    void begin(const string & name);
+    void append(const void * data, const size_t size);
+    void end();
+    void close();
+
+protected:
+    struct Entry {
+        string name;
+        uint64_t offset;
+        uint64_t size;
+        uint64_t checksum;
+    };
+
+    string filename;
+    //written next to the target and renamed on close, snapshots mapped by loaded layers stay valid
+    string partial;
+    SnapshotKind kind;
+    ofstream file;
+    vector<Entry> entries;
+    Entry current;
+    SnapshotChecksum checksum;
+};
+
+class SnapshotReader {
+public:
+    SnapshotReader(const string & filename, const SnapshotKind kind, const bool mmap = true, const bool verify = true);
+
+    bool has(const string & name) const;
+    pair<const uint8_t *, size_t> section(const string & name) const;
+    string text(const string & name) const;
+    template <typename T>
+    pair<const T *, size_t> array(const string & name) const
+    {
+        const auto data = section(name);
+        if (data.second % sizeof(T))
+            throw runtime_error("Corrupted snapshot section " + name);
+        return {reinterpret_cast<const T *>(data.first), data.second / sizeof(T)};
+    }
+    //keeps the mapped or loaded bytes alive
+    shared_ptr<const void> owner() const;
+
+protected:
+    struct Entry {
+        uint64_t offset;
+        uint64_t size;
+    };
+
+    shared_ptr<const MappedFile> mapping;
+    shared_ptr<const vector<uint8_t>> buffer;
+    const uint8_t * data = nullptr;
+    size_t size = 0;
+    vector<pair<string, Entry>> entries;
+};
@@ -99,14 +99,32 @@ void to_output(const vector<vector<tvec3>> & polygon, vector<uint32_t> & indices
     }
 }
 
+vector<uint32_t> earcut_indices(const vector<vector<tvec3>> & polygon)
+{
+    tvec3 normal = compute_polygon_with_holes_normal(polygon);
+    vector<vector<tvec2>> projected_polygon;
+    project_along_normal(polygon, normal, projected_polygon);
+    return mapbox::earcut<uint32_t>(projected_polygon);
+}
+
 void triangulate(const vector<vector<tvec3>> & polygon, vector<tvec3> &out_vertices)
 {
     if (polygon.size() == 0)
         return;
     
-    tvec3 normal = compute_polygon_with_holes_normal(polygon);
-    vector<vector<tvec2>> projected_polygon;
-    project_along_normal(polygon, normal, projected_polygon);
-    vector<uint32_t> indices = mapbox::earcut<uint32_t>(projected_polygon);
+    vector<uint32_t> indices = earcut_indices(polygon);
     to_output(polygon, indices, out_vertices);
+}
+
+void triangulate(const vector<vector<tvec3>> & polygon, vector<tvec3> &out_vertices, vector<uint32_t> &out_indices)
+{
+    if (polygon.size() == 0)
+        return;
+
+    const uint32_t base = out_vertices.size();
+    vector<uint32_t> indices = earcut_indices(polygon);
+    for (const auto & ring : polygon)
+        out_vertices.insert(out_vertices.end(), ring.begin(), ring.end());
+    for (const auto i : indices)
+        out_indices.push_back(base + i);
 }
\ No newline at end of file
@@ -6,4 +6,5 @@
 using namespace std;
 
 void triangulate(const vector<vector<tvec3>> & in_polygon, vector<tvec3> & out_vertices);
+void triangulate(const vector<vector<tvec3>> & in_polygon, vector<tvec3> & out_vertices, vector<uint32_t> & out_indices);
 
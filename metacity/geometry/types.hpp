@@ -8,4 +8,8 @@
 using tvec3 = glm::highp_f32vec3;
 using tvec2 = glm::highp_f32vec2;
 using tfloat = float;
+//absolute coordinates and transforms are kept in double precision
+using tvec3d = glm::dvec3;
+using tvec2d = glm::dvec2;
+using tmat4d = glm::dmat4;
 
@@ -1,22 +1,134 @@
-from metacity.io.geojson import parse as parse_geojson
-from metacity.io.shapefile import parse as parse_shapefile
+from metacity.io.geojson import parse as parse_geojson, iterate as iterate_geojson, SEQUENCE_SUFFIXES
+from metacity.io.shapefile import parse as parse_shapefile, iterate as iterate_shapefile
+from metacity.geometry import Grid, Layer
 import metacity.utils.filesystem as fs
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
 from tqdm import tqdm
+import os
+import time
 
-__all__ = ["parse", "parse_recursively"]
+__all__ = ["parse", "parse_recursively", "ingest", "FileReport"]
 
-def parse(file: str):
+GEOJSON = ('.json', '.geojson') + SEQUENCE_SUFFIXES
+SUPPORTED = ('.shp',) + GEOJSON
+
+
+def parse(file: str, crs=None, origin=None):
+    if file.endswith('.shp'):
+        return parse_shapefile(file, crs=crs, origin=origin)
+    elif file.endswith(GEOJSON):
+        return parse_geojson(file, crs=crs, origin=origin)
+
+
+def iterate(file: str, crs=None, origin=None):
+    """
+    Yield the models of a file in chunks. Reprojected GeoJSON is parsed at once,
+    so that the CRS declared in the file is respected.
+    """
     if file.endswith('.shp'):
-        return parse_shapefile(file)
-    elif file.endswith('.json'):
-        return parse_geojson(file)
+        yield from iterate_shapefile(file, crs=crs, origin=origin)
+    elif file.endswith(GEOJSON) and crs is None:
+        yield from iterate_geojson(file, origin=origin)
+    elif file.endswith(GEOJSON):
+        yield parse_geojson(file, crs=crs, origin=origin)
 
 
-def parse_recursively(directory: str):
+def supported_files(directory: str):
+    """
+    List supported files under a directory, files reachable through several paths are listed once.
+    """
+    seen = set()
+    files = []
+    for file in fs.list_files_recursive(directory):
+        if not file.endswith(SUPPORTED):
+            continue
+        real = os.path.realpath(file)
+        if real in seen:
+            continue
+        seen.add(real)
+        files.append(file)
+    return sorted(files)
+
+
+def parse_recursively(directory: str, workers: int = 0):
+    """
+    Parse all supported files in a directory, each file is parsed once, files are parsed in parallel
+    and the models are returned in the order of the sorted file paths.
+    """
+    files = supported_files(directory)
     models = []
-    for file in tqdm(fs.list_files_recursive(directory)):
-        data = parse(file)
-        if data is not None:
-            models.extend(parse(file))
+    with ThreadPoolExecutor(max_workers=workers or None) as pool:
+        for data in tqdm(pool.map(parse, files), total=len(files)):
+            models.extend(data)
     return models
 
+
+class FileReport:
+    """
+    Outcome of ingesting a single file.
+    """
+    def __init__(self, file: str):
+        self.file = file
+        self.models = 0
+        self.seconds = 0.0
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"error: {self.error!r}"
+        return f"FileReport({self.file!r}, models={self.models}, seconds={self.seconds:.3f}, {status})"
+
+
+def ingest(directory: str, target, workers: int = 0, crs=None, origin=None, progress: bool = True):
+    """
+    Parse all supported files in a directory in parallel and stream the models into a layer or a grid.
+
+    Every worker pushes its chunks into the target as soon as they are converted, so at most one chunk
+    per worker is held in memory. Files that fail are reported instead of interrupting the ingestion.
+
+    Args:
+        directory (str): Directory searched recursively for SHP and GeoJSON files.
+        target (Layer or Grid): Receives the models, models of a file may be interleaved with other files.
+        workers (int): Number of files parsed at once, 0 picks a default based on the number of cores.
+        crs (optional): Target coordinate reference system, anything accepted by pyproj.
+        origin (optional): Coordinates subtracted from all vertices, defaults to the origin of the target.
+            It becomes the origin of the target, a grid has to be empty to accept a different one.
+
+    Returns:
+        list: One :class:`FileReport` per file, in the order of the sorted file paths.
+    """
+    if not isinstance(target, (Layer, Grid)):
+        raise TypeError("Target must be a Layer or a Grid")
+    if origin is None:
+        origin = target.origin
+    else:
+        target.set_origin(tuple(origin))
+    if isinstance(target, Grid):
+        add = lambda models: [target.add_model(model) for model in models]
+    else:
+        add = target.add_models
+
+    lock = Lock()
+
+    def task(report: FileReport):
+        start = time.perf_counter()
+        try:
+            for chunk in iterate(report.file, crs=crs, origin=origin):
+                with lock:
+                    add(chunk)
+                report.models += len(chunk)
+        except Exception as error:
+            report.error = error
+        report.seconds = time.perf_counter() - start
+        return report
+
+    reports = [FileReport(file) for file in supported_files(directory)]
+    with ThreadPoolExecutor(max_workers=workers or None) as pool:
+        futures = [pool.submit(task, report) for report in reports]
+        for _ in tqdm(as_completed(futures), total=len(futures), disable=not progress):
+            pass
+    return reports
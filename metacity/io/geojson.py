@@ -1,8 +1,15 @@
-from metacity.utils.filesystem import read_json
-from metacity.geometry import Attribute, Model
+import re
+import orjson
+import numpy as np
+from metacity.utils.filesystem import read_bytes
+from metacity.geometry import Attribute, Model, parse_geojson_bytes
 
 
-__all__ = ["parse", "parse_data"]
+__all__ = ["parse", "parse_data", "iterate", "iterate_features"]
+
+#GeoJSON text sequences (RFC 8142) and newline-delimited GeoJSON
+SEQUENCE_SUFFIXES = ('.geojsons', '.geojsonl', '.geojsonseq', '.ndjson', '.jsonl')
+RECORD_SEPARATOR = b'\x1e'
 
 class Geometry:
     def __init__(self, data):
@@ -14,7 +21,7 @@ class Geometry:
         while isinstance(d[0], list) or isinstance(d[0], tuple):
             d = d[0]
         d = len(d)
-        if d < 2 and d > 3:
+        if d < 2 or d > 3:
             raise Exception(
                 f"Encountered primitive with unsupported dimension {d}")
         return d
@@ -42,12 +49,21 @@ class Feature:
             self.properties = { 'data': None } 
 
 
-def flatten(data):
-    return [item for sublist in data for item in sublist]
+def to_array(coordinates, origin=None):
+    array = np.asarray(coordinates, dtype=np.float64)
+    if origin is None or array.size == 0:
+        return array
+    #vertices are stored relative to the layer origin, 2D input stays on the local z = 0 plane
+    dim = array.shape[-1]
+    return array - np.asarray(origin, dtype=np.float64)[:dim]
 
 
-def flatten_polygon(polygon):
-    return [[item for sublist in ring for item in sublist] for ring in polygon]
+def to_polygon_arrays(polygon, origin=None):
+    rings = [to_array(ring, origin) for ring in polygon]
+    offsets = np.cumsum([0] + [len(ring) for ring in rings], dtype=np.int64)
+    if len(rings) == 0:
+        return np.empty(0, dtype=np.float64), offsets
+    return np.concatenate(rings), offsets
 
 
 def to_model(attr: Attribute):
@@ -56,68 +72,68 @@ def to_model(attr: Attribute):
     return model
 
 
-def model_from_point(geometry: Geometry):
+def model_from_point(geometry: Geometry, origin=None):
     attr = Attribute()
     if geometry.dim == 2:
-        attr.push_point2D(geometry.coordinates)
+        attr.push_point2D(to_array(geometry.coordinates, origin))
     elif geometry.dim == 3:
-        attr.push_point3D(geometry.coordinates)
+        attr.push_point3D(to_array(geometry.coordinates, origin))
     return [to_model(attr)]
 
 
-def model_from_multipoint(geometry: Geometry):
+def model_from_multipoint(geometry: Geometry, origin=None):
     attr = Attribute()
     if geometry.dim == 2:
-        attr.push_point2D(flatten(geometry.coordinates))
+        attr.push_point2D(to_array(geometry.coordinates, origin))
     elif geometry.dim == 3:
-        attr.push_point3D(flatten(geometry.coordinates))
+        attr.push_point3D(to_array(geometry.coordinates, origin))
     return [to_model(attr)]
 
 
-def model_from_linestring(geometry: Geometry):
+def model_from_linestring(geometry: Geometry, origin=None):
     attr = Attribute()
     if geometry.dim == 2:
-        attr.push_line2D(flatten(geometry.coordinates))
+        attr.push_line2D(to_array(geometry.coordinates, origin))
     elif geometry.dim == 3:
-        attr.push_line3D(flatten(geometry.coordinates))
+        attr.push_line3D(to_array(geometry.coordinates, origin))
     return [to_model(attr)]
 
 
-def model_from_multilinestring(geometry: Geometry):
+def model_from_multilinestring(geometry: Geometry, origin=None):
     attr = Attribute()
     dim = geometry.dim
     for line in geometry.coordinates:
         if dim == 2:
-            attr.push_line2D(flatten(line))
+            attr.push_line2D(to_array(line, origin))
         elif dim == 3:
-            attr.push_line3D(flatten(line))
+            attr.push_line3D(to_array(line, origin))
     return [to_model(attr)]
 
 
-def model_from_polygon(geometry: Geometry):
+def model_from_polygon(geometry: Geometry, origin=None):
     attr = Attribute()
     if geometry.dim == 2:
-        attr.push_polygon2D(flatten_polygon(geometry.coordinates))
+        attr.push_polygon2D(*to_polygon_arrays(geometry.coordinates, origin))
     elif geometry.dim == 3:
-        attr.push_polygon3D(flatten_polygon(geometry.coordinates))
+        attr.push_polygon3D(*to_polygon_arrays(geometry.coordinates, origin))
     return [to_model(attr)]
 
 
-def model_from_multipolygon(geometry: Geometry):
+def model_from_multipolygon(geometry: Geometry, origin=None):
     attr = Attribute()
     dim = geometry.dim
     for polygon in geometry.coordinates:
         if dim == 2:
-            attr.push_polygon2D(flatten_polygon(polygon))
+            attr.push_polygon2D(*to_polygon_arrays(polygon, origin))
         elif dim == 3:
-            attr.push_polygon3D(flatten_polygon(polygon))
+            attr.push_polygon3D(*to_polygon_arrays(polygon, origin))
     return [to_model(attr)]
 
 
-def model_from_geometrycollection(geometry: Geometry):
+def model_from_geometrycollection(geometry: Geometry, origin=None):
     models = []
     for subgeometry in geometry.geometries:
-        model_list = typedict[subgeometry.geometry_type](subgeometry)
+        model_list = typedict[subgeometry.geometry_type](subgeometry, origin)
         models.extend(model_list)
     return models
 
@@ -133,9 +149,9 @@ typedict = {
 }
 
 
-def parse_feature(feature: Feature):
+def parse_feature(feature: Feature, origin=None):
     #try:
-    model_list = typedict[feature.geometry.geometry_type](feature.geometry)
+    model_list = typedict[feature.geometry.geometry_type](feature.geometry, origin)
     #TODO parse metadata
     for model in model_list:
         model.set_metadata(feature.properties)
@@ -149,16 +165,211 @@ def parse_feature(feature: Feature):
     return []
 
 
-def parse_data(data):
+def parse_data(data, origin=None):
     models = []
     for f in data['features']:
         feature = Feature(f)
-        models.extend(parse_feature(feature))
+        models.extend(parse_feature(feature, origin))
     return models
 
 
-def parse(input_file: str):
-    contents = read_json(input_file)
-    return parse_data(contents)
+def parse(input_file: str, crs=None, origin=None):
+    """
+    Parse a GeoJSON file. All contents are transformed into Metacity objects, and returned as a list.
+
+    Args:
+        input_file (str): Path to the GeoJSON file.
+        crs (optional): Target coordinate reference system, anything accepted by pyproj.
+            The data is reprojected before it is converted.
+        origin (optional): Coordinates subtracted from all vertices, the models are meant
+            to be added to a layer with the same origin set.
+
+    Returns:
+        list: List of Metacity objects.
+    """
+    if crs is not None:
+        import geopandas
+        data = geopandas.read_file(input_file).to_crs(crs)._to_geo()
+        return parse_data(data, origin)
+    if is_sequence(input_file):
+        return [model for batch in iterate(input_file, origin=origin) for model in batch]
+    contents = read_bytes(input_file)
+    if origin is None:
+        origin = (0, 0, 0)
+    return parse_geojson_bytes(contents, origin=tuple(origin)).get_models()
+
+
+def is_sequence(input_file: str):
+    if input_file.endswith(SEQUENCE_SUFFIXES):
+        return True
+    with open(input_file, 'rb') as file:
+        return file.read(1) == RECORD_SEPARATOR
+
+
+#tokens that matter between features and inside a feature, strings are matched as a whole;
+#a lone quote is a string that continues in the next block
+COLLECTION_TOKENS = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]|"', re.S)
+FEATURE_TOKENS = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}]|"', re.S)
+
+
+def scan_collection(file, block_size: int):
+    """
+    Yield the raw bytes of every feature in the features array of a FeatureCollection,
+    the file is read in blocks and only the feature being scanned is kept in memory.
+    """
+    buffer = bytearray()
+    pos = 0
+    depth = 0           #nesting of the collection outside of features
+    braces = 0          #nesting of the current feature
+    start = None        #start of the current feature
+    key = None          #last string in the top-level object
+    in_features = False
+    eof = False
+
+    while not eof:
+        block = file.read(block_size)
+        eof = not block
+        buffer += block
+
+        while True:
+            pattern = COLLECTION_TOKENS if start is None else FEATURE_TOKENS
+            match = pattern.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            token = match.group()
+            if token == b'"':
+                if eof:
+                    raise ValueError("Unterminated string in GeoJSON file")
+                pos = match.start()
+                break
+            pos = match.end()
+
+            if token[0] == 0x22:
+                if start is None and depth == 1:
+                    key = token[1:-1]
+            elif start is not None:
+                braces += 1 if token == b'{' else -1
+                if braces == 0:
+                    yield bytes(buffer[start:pos])
+                    start = None
+            elif token in (b'{', b'['):
+                if in_features and depth == 2 and token == b'{':
+                    start = match.start()
+                    braces = 1
+                    continue
+                depth += 1
+                if depth == 2 and token == b'[' and key == b'features':
+                    in_features = True
+            else:
+                depth -= 1
+                if in_features and depth == 1:
+                    return
+
+        #drop what has been scanned, keep the current feature
+        keep = start if start is not None else pos
+        del buffer[:keep]
+        pos -= keep
+        if start is not None:
+            start -= keep
+
+    if in_features or depth:
+        raise ValueError("Unexpected end of GeoJSON file")
+    #a single Feature or a bare Geometry is not a collection, reading it as empty would hide the data
+    raise ValueError("GeoJSON file is not a FeatureCollection, no features array found")
+
+
+def scan_sequence(file):
+    """
+    Yield the raw bytes of every record of a GeoJSON text sequence or newline-delimited GeoJSON.
+    """
+    for line in file:
+        for record in line.split(RECORD_SEPARATOR):
+            record = record.strip()
+            if record:
+                yield record
+
+
+def iterate_features(input_file: str, block_size: int = 1 << 20):
+    """
+    Iterate over the features of a GeoJSON FeatureCollection or a GeoJSON sequence without reading
+    the whole file, each feature is yielded as a dictionary.
+
+    Args:
+        input_file (str): Path to the GeoJSON file.
+        block_size (int): Number of bytes read at once.
+
+    Yields:
+        dict: A single GeoJSON feature.
+    """
+    for raw in iterate_raw(input_file, block_size):
+        yield orjson.loads(raw)
+
+
+def iterate_raw(input_file: str, block_size: int):
+    with open(input_file, 'rb') as file:
+        if is_sequence(input_file):
+            yield from scan_sequence(file)
+        else:
+            yield from scan_collection(file, block_size)
+
+
+def iterate(input_file: str, batch_size: int = 1000, crs=None, origin=None, source_crs="EPSG:4326", threads: int = 0):
+    """
+    Stream a GeoJSON FeatureCollection or GeoJSON sequence in batches, conversion starts after
+    the first batch is read and memory use depends on the batch size rather than on the file size.
+
+    Args:
+        input_file (str): Path to the GeoJSON file.
+        batch_size (int): Number of features converted at once.
+        crs (optional): Target coordinate reference system, anything accepted by pyproj.
+        origin (optional): Coordinates subtracted from all vertices.
+        source_crs (optional): Coordinate reference system of the file, WGS 84 by default as in RFC 7946.
+        threads (int): Number of threads used to convert a batch, 0 uses all cores.
+
+    Yields:
+        list: List of Metacity objects converted from a single batch.
+    """
+    if origin is None:
+        origin = (0, 0, 0)
+    transformer = None
+    if crs is not None:
+        from pyproj import CRS, Transformer
+        transformer = Transformer.from_crs(CRS.from_user_input(source_crs), CRS.from_user_input(crs), always_xy=True)
+
+    def convert(batch):
+        if transformer is None:
+            collection = b'{"type":"FeatureCollection","features":[' + b','.join(batch) + b']}'
+            return parse_geojson_bytes(collection, threads=threads, origin=tuple(origin)).get_models()
+        features = [orjson.loads(raw) for raw in batch]
+        geometries = reproject([f.get('geometry') for f in features], transformer)
+        for feature, geometry in zip(features, geometries):
+            feature['geometry'] = geometry
+        return parse_data({'features': features}, origin)
+
+    batch = []
+    for raw in iterate_raw(input_file, 1 << 20):
+        batch.append(raw)
+        if len(batch) == batch_size:
+            yield convert(batch)
+            batch = []
+    if batch:
+        yield convert(batch)
+
+
+def reproject(geometries, transformer):
+    """
+    Reproject GeoJSON-like geometries with a single vectorized call per dimension.
+    """
+    import shapely
+    shapes = np.array([shapely.geometry.shape(g) if g else None for g in geometries], dtype=object)
+    project = lambda coords: np.column_stack(transformer.transform(*coords.T))
+    #2D and 3D geometries are transformed separately, heights are reprojected as well
+    has_z = shapely.has_z(shapes)
+    for include_z in (False, True):
+        selected = has_z == include_z
+        if selected.any():
+            shapes[selected] = shapely.transform(shapes[selected], project, include_z=include_z)
+    return [shapely.geometry.mapping(s) if s is not None else None for s in shapes]
 
 
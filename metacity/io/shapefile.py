@@ -1,26 +1,129 @@
 import fiona
-import geopandas
-from metacity.utils import filesystem as fs
-from metacity.io.geojson import parse_data as parse_geojson
+import numpy as np
+from pyproj import CRS, Transformer
+from metacity.geometry import Layer
+from metacity.io.geojson import Geometry, typedict, reproject
 
-__all__ = ["parse"]
+__all__ = ["parse", "iterate"]
 
 
-def parse(shp_file: str):
+def polygons_of(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+
+def models_from_polygons(geometries, origin, threads: int):
+    """
+    Triangulate polygon geometries of the same dimension in a single native batch,
+    returns one list of models per geometry.
+    """
+    vertices, rings, polygons, models = [], [0], [0], [0]
+    for geometry in geometries:
+        for polygon in polygons_of(geometry):
+            for ring in polygon:
+                vertices.extend(ring)
+                rings.append(len(vertices))
+            polygons.append(len(rings) - 1)
+        models.append(len(polygons) - 1)
+
+    layer = Layer()
+    if origin is not None:
+        layer.set_origin(tuple(origin))
+    layer.add_polygons_batch(np.asarray(vertices, dtype=np.float64),
+                             np.asarray(rings, dtype=np.int64),
+                             np.asarray(polygons, dtype=np.int64),
+                             np.asarray(models, dtype=np.int64),
+                             threads=threads)
+    return [[model] for model in layer.get_models()]
+
+
+def models_from_records(geometries, properties, origin, threads: int):
+    """
+    Convert a chunk of GeoJSON-like geometries into models, polygons go through the native batch,
+    other geometry types through the GeoJSON converters.
+    """
+    converted = [[] for _ in geometries]
+    batches = {}
+    for i, geometry in enumerate(geometries):
+        if geometry is None or not geometry.get("coordinates", geometry.get("geometries")):
+            continue
+        geometry = Geometry(geometry)
+        if geometry.geometry_type in ("polygon", "multipolygon"):
+            batches.setdefault(geometry.dim, []).append(i)
+        else:
+            converted[i] = typedict[geometry.geometry_type](geometry, origin)
+
+    for indices in batches.values():
+        for i, models in zip(indices, models_from_polygons([geometries[i] for i in indices], origin, threads)):
+            converted[i] = models
+
+    chunk = []
+    for metadata, models in zip(properties, converted):
+        for model in models:
+            model.set_metadata(metadata)
+        chunk.extend(models)
+    return chunk
+
+
+def iterate(shp_file: str, chunk_size: int = 10000, crs=None, origin=None, threads: int = 0):
+    """
+    Stream a SHP file in chunks, records are read one by one and converted straight into
+    Metacity objects, so memory use depends on the chunk size rather than on the file size.
+
+    Args:
+        shp_file (str): Path to the SHP file.
+        chunk_size (int): Number of records converted at once.
+        crs (optional): Target coordinate reference system, anything accepted by pyproj.
+        origin (optional): Coordinates subtracted from all vertices.
+        threads (int): Number of threads used to triangulate polygons, 0 uses all cores.
+
+    Yields:
+        list: List of Metacity objects converted from a single chunk.
+    """
+    with fiona.open(shp_file) as source:
+        transformer = None
+        if crs is not None:
+            if not source.crs:
+                raise ValueError("Cannot transform naive geometries, the shapefile has no CRS")
+            transformer = Transformer.from_crs(CRS.from_user_input(source.crs), CRS.from_user_input(crs), always_xy=True)
+
+        def convert(geometries, properties):
+            if transformer is not None:
+                geometries = reproject(geometries, transformer)
+            return models_from_records(geometries, properties, origin, threads)
+
+        geometries, properties = [], []
+        for record in source:
+            geometries.append(record.geometry)
+            properties.append(dict(record.properties))
+            if len(geometries) < chunk_size:
+                continue
+            yield convert(geometries, properties)
+            geometries, properties = [], []
+
+        if geometries:
+            yield convert(geometries, properties)
+
+
+def parse(shp_file: str, crs=None, origin=None):
     """
     Parse a SHP file. All contents are transformed into Metacity objects, and returned as a list.
 
     Args:
         shp_file (str): Path to the SHP file.
-    
+        crs (optional): Target coordinate reference system, anything accepted by pyproj.
+        origin (optional): Coordinates subtracted from all vertices.
+
     Returns:
         list: List of Metacity objects.
 
     See Also:
             :func:`metacity.io.parse' to see other formats.
+            :func:`metacity.io.shapefile.iterate' to read large files in chunks.
 
     """
-    file = geopandas.read_file(shp_file)
-    data = file._to_geo()
-    return parse_geojson(data)
-
+    models = []
+    for chunk in iterate(shp_file, crs=crs, origin=origin):
+        models.extend(chunk)
+    return models
@@ -74,6 +74,11 @@ def write_json(filename, data):
         file.write(sdata)
 
 
+def read_bytes(filename):
+    with open(filename, 'rb') as file:
+        return file.read()
+
+
 def read_json(filename):
     with open(filename, 'r') as file:
         sdata = file.read()
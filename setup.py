@@ -143,6 +143,9 @@ setup(
         "numpy>=1.22.0",
         "tqdm>=4.62.0",
         "geopandas>=0.9.0",
+        "fiona>=1.9.0",
+        "pyproj>=3.1.0",
+        "shapely>=2.0.0",
         "setuptools>=42",
         "wheel",
         "lark>=0.11.3",
@@ -0,0 +1,115 @@
+from metacity.geometry import Attribute, AttributeType, Model, Layer
+import numpy as np
+import os
+
+
+def layer_roundtrip(attr: Attribute, tmp_directory: str):
+    model = Model()
+    model.add_attribute("POSITION", attr)
+    layer = Layer()
+    layer.add_model(model)
+    path = os.path.join(tmp_directory, "attr.gltf")
+    layer.to_gltf(path)
+    return open(path).read()
+
+
+def test_push_array_matches_list(tmp_directory: str):
+    polygon = [[0, 0, 1, 0, 1, 1, 0, 1], [0.2, 0.2, 0.4, 0.2, 0.4, 0.4]]
+    listed = Attribute()
+    listed.push_polygon2D(polygon)
+
+    vertices = np.array([0, 0, 1, 0, 1, 1, 0, 1, 0.2, 0.2, 0.4, 0.2, 0.4, 0.4], dtype=np.float32)
+    offsets = np.array([0, 4, 7])
+    buffered = Attribute()
+    buffered.push_polygon2D(vertices, offsets)
+
+    assert layer_roundtrip(listed, tmp_directory) == layer_roundtrip(buffered, tmp_directory)
+
+
+def test_push_array_dtypes():
+    for dtype in (np.float32, np.float64):
+        attr = Attribute()
+        attr.push_point3D(np.arange(9, dtype=dtype).reshape(3, 3))
+        attr.push_point3D(np.arange(3, dtype=dtype))
+
+
+def test_push_array_invalid():
+    attr = Attribute()
+    try:
+        attr.push_line3D(np.arange(4, dtype=np.float64))
+        assert False
+    except RuntimeError:
+        pass
+
+    try:
+        attr.push_polygon3D(np.zeros(9, dtype=np.float64), np.array([0, 4]))
+        assert False
+    except RuntimeError:
+        pass
+
+
+def test_vertices_view():
+    attr = Attribute()
+    attr.push_point3D(np.arange(12, dtype=np.float64))
+    vertices = attr.vertices
+    assert vertices.shape == (4, 3)
+    assert vertices.dtype == np.float32
+    assert not vertices.flags.writeable
+    assert np.all(vertices.flatten() == np.arange(12))
+    assert attr.size == 4
+    assert attr.type == AttributeType.POINT
+    assert np.allclose(attr.vmin, vertices.min(axis=0))
+    assert np.allclose(attr.vmax, vertices.max(axis=0))
+    assert np.allclose(attr.sum, vertices.sum(axis=0))
+
+    del attr
+    assert np.all(vertices.flatten() == np.arange(12))
+
+
+def test_vertices_view_modified():
+    attr = Attribute()
+    attr.push_polygon2D([[0, 0, 10, 0, 10, 10, 0, 10]])
+    vertices, indices = attr.vertices, attr.indices
+    before, before_indices = vertices.copy(), indices.copy()
+
+    #views keep the data they were created from, modifications work on a copy
+    angles = np.linspace(0, 2 * np.pi, 20000, endpoint=False)
+    circle = np.stack([np.cos(angles), np.sin(angles)], axis=1).flatten() * 100
+    attr.push_polygon2D(circle, np.array([0, 20000]))
+    assert np.array_equal(vertices, before)
+    assert np.array_equal(indices, before_indices)
+    assert attr.size > len(before)
+    assert np.array_equal(attr.vertices[:len(before)], before)
+
+
+def test_indexed(tmp_directory: str):
+    polygon = [[0, 0, 0, 1, 0, 0, 1, 1, 0, 0, 1, 0, 0, 0, 0]]
+    soup = Attribute()
+    soup.push_polygon3D(polygon)
+    indexed = Attribute(indexed=True)
+    indexed.push_polygon3D(polygon)
+    assert indexed.indexed and not soup.indexed
+    assert indexed.size == 4
+    assert len(indexed.indices) == soup.size
+
+    converted = Attribute()
+    converted.push_polygon3D(polygon)
+    converted.to_indexed()
+    assert converted.size == 4
+    assert np.array_equal(converted.vertices[converted.indices], soup.vertices)
+    converted.to_soup()
+    assert np.array_equal(converted.vertices, soup.vertices)
+
+    model = Model()
+    model.add_attribute("POSITION", indexed)
+    layer = Layer()
+    layer.add_model(model)
+    path = os.path.join(tmp_directory, "indexed.gltf")
+    layer.to_gltf(path)
+
+    loaded = Layer()
+    loaded.from_gltf(path)
+    attr = loaded.get_models()[0].get_attribute("POSITION")
+    assert attr.indexed
+    assert np.array_equal(attr.indices, indexed.indices)
+    assert np.array_equal(attr.vertices, indexed.vertices)
@@ -0,0 +1,427 @@
+from metacity.geometry import Attribute, Grid, Layer, Model
+from metacity.io.geojson import parse as parse_geojson
+import base64
+import json
+import numpy as np
+import os
+
+
+def export_grid(geojson_dataset: str, folder: str, threads: int):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    os.makedirs(folder)
+    grid.to_gltf(folder, False, threads=threads)
+    return grid
+
+
+def test_grid_parallel(tmp_directory: str, geojson_dataset: str):
+    serial_dir = os.path.join(tmp_directory, "serial")
+    parallel_dir = os.path.join(tmp_directory, "parallel")
+    grid = export_grid(geojson_dataset, serial_dir, 1)
+    export_grid(geojson_dataset, parallel_dir, 4)
+
+    with open(os.path.join(serial_dir, "layout.json")) as file:
+        serial = file.read()
+    with open(os.path.join(parallel_dir, "layout.json")) as file:
+        parallel = file.read()
+    assert serial == parallel
+
+    layout = json.loads(serial)
+    assert len(layout["tiles"]) == len(grid.grid)
+    for tile in layout["tiles"]:
+        with open(os.path.join(serial_dir, tile["file"]), "rb") as a, open(os.path.join(parallel_dir, tile["file"]), "rb") as b:
+            assert a.read() == b.read()
+
+
+def test_grid_streaming(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+    memory = Grid(1000, 1000)
+    memory.add_layer(layer)
+    streamed = Grid(1000, 1000, spill_folder=os.path.join(tmp_directory, "spill"), spill_budget=1024)
+    streamed.add_layer(layer)
+
+    memory_dir = os.path.join(tmp_directory, "memory")
+    streamed_dir = os.path.join(tmp_directory, "streamed")
+    os.makedirs(memory_dir)
+    os.makedirs(streamed_dir)
+    memory.to_gltf(memory_dir, False)
+    streamed.to_gltf(streamed_dir, False)
+
+    assert sorted(os.listdir(memory_dir)) == sorted(os.listdir(streamed_dir))
+    for name in os.listdir(memory_dir):
+        with open(os.path.join(memory_dir, name), "rb") as a, open(os.path.join(streamed_dir, name), "rb") as b:
+            assert a.read() == b.read()
+
+
+def test_grid_streaming_shared_folder(tmp_directory: str):
+    spill = os.path.join(tmp_directory, "spill")
+    os.makedirs(spill)
+    with open(os.path.join(spill, "tile0_0.spill"), "wb") as file:
+        file.write(b"leftover")
+
+    first = Grid(1000, 1000, spill_folder=spill, spill_budget=0)
+    second = Grid(1000, 1000, spill_folder=spill, spill_budget=0)
+    for grid, offset in ((first, 0), (second, 100)):
+        square = np.array([[0, 0], [5, 0], [5, 5], [0, 5]], dtype=np.float64) + offset
+        layer = Layer()
+        layer.add_polygons_batch(square, np.array([0, 4]), np.array([0, 1]), np.array([0, 1]))
+        grid.add_layer(layer)
+
+    for grid, offset in ((first, 0), (second, 100)):
+        folder = os.path.join(tmp_directory, f"export_{offset}")
+        os.makedirs(folder)
+        grid.to_gltf(folder, False)
+        with open(os.path.join(folder, "layout.json")) as file:
+            tiles = json.load(file)["levels"][0]["tiles"]
+        assert len(tiles) == 1 and tiles[0]["size"] == 1
+        assert tiles[0]["box"][0][:2] == [offset, offset]
+
+    del first, second, grid
+    assert os.listdir(spill) == ["tile0_0.spill"]
+
+
+def test_grid_levels(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    grid.to_gltf(tmp_directory, False, levels=3, resolution=4)
+
+    with open(os.path.join(tmp_directory, "layout.json")) as file:
+        layout = json.load(file)
+
+    assert len(layout["levels"]) == 3
+    assert layout["levels"][0]["geometricError"] == 0
+    assert len(layout["levels"][0]["tiles"]) == len(layout["tiles"])
+    for lower, upper in zip(layout["levels"], layout["levels"][1:]):
+        assert upper["geometricError"] > lower["geometricError"]
+        assert len(upper["tiles"]) <= len(lower["tiles"])
+        assert sum(t["size"] for t in upper["tiles"]) <= sum(t["size"] for t in lower["tiles"])
+    for level in layout["levels"]:
+        for tile in level["tiles"]:
+            assert os.path.exists(os.path.join(tmp_directory, tile["file"]))
+
+
+def test_grid_levels_collapsed(tmp_directory: str):
+    squares = np.array([[10, 10], [15, 10], [15, 15], [10, 15], [0, 0], [900, 0], [900, 900], [0, 900]], dtype=np.float64)
+    layer = Layer()
+    layer.add_polygons_batch(squares, np.array([0, 4, 8]), np.array([0, 1, 2]), np.array([0, 1, 2]))
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    report = grid.to_gltf(tmp_directory, False, levels=3, resolution=4)
+
+    #the small square collapses at level 1, the large one at level 2 which leaves the level empty
+    with open(os.path.join(tmp_directory, "layout.json")) as file:
+        layout = json.load(file)
+    assert [[t["size"] for t in level["tiles"]] for level in layout["levels"]] == [[2], [1], []]
+    assert sorted(report["written"]) == ["lod1_tile0_0.gltf", "tile0_0.gltf"]
+    assert not os.path.exists(os.path.join(tmp_directory, "lod2_tile0_0.gltf"))
+    boxes = [level["tiles"][0]["box"] for level in layout["levels"][:2]]
+    assert boxes[0] == boxes[1] == [[0, 0, 0], [900, 900, 0]]
+
+
+def test_grid_merged_features(tmp_directory: str):
+    layer = Layer()
+    for i in range(6):
+        model = Model()
+        attr = Attribute()
+        x = i * 100
+        attr.push_polygon2D([[x, 0, x + 50, 0, x + 50, 50, x, 50]])
+        model.add_attribute("POSITION", attr)
+        model.set_metadata({"id": i, "name": f"building {i}"})
+        layer.add_model(model)
+
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    folder = os.path.join(tmp_directory, "merged")
+    os.makedirs(folder)
+    grid.to_gltf(folder, True)
+
+    with open(os.path.join(folder, "layout.json")) as file:
+        layout = json.load(file)
+    assert len(layout["tiles"]) == 1
+    with open(os.path.join(folder, layout["tiles"][0]["file"])) as file:
+        document = json.load(file)
+
+    assert len(document["meshes"]) == 1
+    primitive = document["meshes"][0]["primitives"][0]
+    features = primitive["extensions"]["EXT_mesh_features"]["featureIds"][0]
+    assert features["featureCount"] == 6
+    assert features["propertyTable"] == 0
+    assert "_FEATURE_ID_0" in primitive["attributes"]
+
+    accessors = document["accessors"]
+    ids = accessors[primitive["attributes"]["_FEATURE_ID_0"]]
+    assert ids["count"] == accessors[primitive["attributes"]["POSITION"]]["count"]
+
+    view = document["bufferViews"][ids["bufferView"]]
+    data = base64.b64decode(document["buffers"][0]["uri"].split(",", 1)[1])
+    values = np.frombuffer(data, dtype=np.float32, count=ids["count"], offset=view.get("byteOffset", 0))
+    assert np.array_equal(values, np.repeat(np.arange(6), 6))
+
+    table = document["extensions"]["EXT_structural_metadata"]["propertyTables"][0]
+    assert table["count"] == 6
+    assert set(table["properties"]) == {"id", "name"}
+
+
+def test_grid_merged_position_only(tmp_directory: str):
+    layer = Layer()
+    for i in range(3):
+        model = Model()
+        x = i * 100
+        attr = Attribute()
+        attr.push_polygon2D([[x, 0, x + 50, 0, x + 50, 50, x, 50]])
+        model.add_attribute("POSITION", attr)
+        outline = Attribute()
+        outline.push_line2D([x, 0, x + 50, 0, x + 50, 50])
+        model.add_attribute("OUTLINE", outline)
+        layer.add_model(model)
+
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    folder = os.path.join(tmp_directory, "merged")
+    os.makedirs(folder)
+    grid.to_gltf(folder, True)
+
+    #merged models keep only POSITION, the one attribute written to glTF
+    with open(os.path.join(folder, "tile0_0.gltf")) as file:
+        document = json.load(file)
+    primitives = document["meshes"][0]["primitives"]
+    assert len(primitives) == 1 and primitives[0].get("mode", 4) == 4
+    assert set(primitives[0]["attributes"]) == {"POSITION", "_FEATURE_ID_0"}
+    assert document["accessors"][primitives[0]["attributes"]["POSITION"]]["count"] == 18
+
+
+def test_grid_merged_types(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+
+    folders = []
+    for threads in (1, 4):
+        folder = os.path.join(tmp_directory, f"merged_types_{threads}")
+        os.makedirs(folder)
+        grid.to_gltf(folder, True, threads=threads)
+        folders.append(folder)
+
+    with open(os.path.join(folders[0], "layout.json")) as file:
+        layout = json.load(file)
+    types = set()
+    for tile in layout["tiles"]:
+        with open(os.path.join(folders[0], tile["file"]), "rb") as a, open(os.path.join(folders[1], tile["file"]), "rb") as b:
+            content = a.read()
+            assert content == b.read()
+        document = json.loads(content)
+        if "meshes" not in document:
+            continue
+        assert len(document["meshes"]) == 1
+        modes = [p.get("mode", 4) for p in document["meshes"][0]["primitives"]]
+        assert len(modes) == len(set(modes))
+        types.update(modes)
+        for primitive in document["meshes"][0]["primitives"]:
+            accessors = document["accessors"]
+            assert accessors[primitive["attributes"]["_FEATURE_ID_0"]]["count"] == accessors[primitive["attributes"]["POSITION"]]["count"]
+    assert len(types) > 1
+
+
+def test_grid_merged_roundtrip(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    folder = os.path.join(tmp_directory, "merged")
+    os.makedirs(folder)
+    grid.to_gltf(folder, True)
+
+    with open(os.path.join(folder, "layout.json")) as file:
+        layout = json.load(file)
+    imported_tiles = 0
+    for tile in layout["tiles"]:
+        path = os.path.join(folder, tile["file"])
+        with open(path) as file:
+            document = json.load(file)
+        if "meshes" not in document:
+            continue
+        primitives = document["meshes"][0]["primitives"]
+        counts = [document["accessors"][p["attributes"]["POSITION"]]["count"] for p in primitives]
+        #every primitive of a merged mesh is imported as a model, feature IDs are skipped
+        for lazy in (False, True):
+            imported = Layer()
+            imported.from_gltf(path, lazy=lazy)
+            assert imported.size == len(primitives)
+            assert [m.get_attribute("POSITION").vertices.size // 3 for m in imported.get_models()] == counts
+        imported_tiles += 1
+    assert imported_tiles > 0
+
+
+def test_grid_origin(tmp_directory: str):
+    origin = (-742000.0, -1043000.0, 0.0)
+    square = np.array([[10, 10], [60, 10], [60, 60], [10, 60]], dtype=np.float64) + origin[:2]
+    layer = Layer()
+    layer.set_origin(origin)
+    layer.add_polygons_batch(square, np.array([0, 4]), np.array([0, 1]), np.array([0, 1]))
+    other = Layer()
+    other.add_polygons_batch(square, np.array([0, 4]), np.array([0, 1]), np.array([0, 1]))
+
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    grid.add_layer(other)
+    assert grid.origin == origin
+    assert len(grid.grid) == 1
+
+    folder = os.path.join(tmp_directory, "origin")
+    os.makedirs(folder)
+    grid.to_gltf(folder, False)
+    with open(os.path.join(folder, "layout.json")) as file:
+        layout = json.load(file)
+    assert layout["origin"] == list(origin)
+
+    tile = layout["tiles"][0]
+    with open(os.path.join(folder, tile["file"])) as file:
+        document = json.load(file)
+    assert len(document["nodes"]) == 2
+    for node in document["nodes"]:
+        assert node["translation"] == [origin[0] + 500, origin[1] + 500, 0]
+    positions = [a for a in document["accessors"] if a["type"] == "VEC3"]
+    for accessor in positions:
+        assert np.allclose(accessor["min"][:2], (-490, -490))
+        assert np.allclose(accessor["max"][:2], (-440, -440))
+
+
+def test_grid_compact(tmp_directory: str, geojson_dataset: str):
+    folders = []
+    for compact in (False, True):
+        layer = Layer(compact=compact)
+        layer.add_models(parse_geojson(geojson_dataset))
+        grid = Grid(1000, 1000)
+        grid.add_layer(layer)
+        folders.append(os.path.join(tmp_directory, f"compact_{compact}"))
+        os.makedirs(folders[-1])
+        grid.to_gltf(folders[-1], True)
+
+    assert sorted(os.listdir(folders[0])) == sorted(os.listdir(folders[1]))
+    for name in os.listdir(folders[0]):
+        with open(os.path.join(folders[0], name), "rb") as a, open(os.path.join(folders[1], name), "rb") as b:
+            assert a.read() == b.read()
+
+
+def test_grid_compact_transform(geojson_dataset: str):
+    models = parse_geojson(geojson_dataset)
+    layer = Layer(compact=True)
+    layer.add_models(models)
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    before = {k: [m.get_attribute("POSITION").vertices.copy() for m in v] for k, v in grid.grid.items()}
+
+    #models bucketed in the grid keep their geometry when the layer is modified afterwards
+    translation = np.identity(4)
+    translation[0, 3] = 500
+    layer.transform(translation)
+    layer.set_origin((100.0, 0.0, 0.0))
+    for key, tile in grid.grid.items():
+        for vertices, model in zip(before[key], tile):
+            assert np.array_equal(vertices, model.get_attribute("POSITION").vertices)
+
+    original = models[0].get_attribute("POSITION").vertices.reshape(-1, 3)
+    moved = layer.get_model(0).get_attribute("POSITION").vertices.reshape(-1, 3)
+    assert np.allclose(moved, original + (400, 0, 0))
+
+
+def test_grid_snapshot(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+    grid = Grid(1000, 1000, spill_folder=os.path.join(tmp_directory, "spill"), spill_budget=1024)
+    grid.add_layer(layer)
+    path = os.path.join(tmp_directory, "grid.snapshot")
+    grid.save(path)
+    loaded = Grid.load(path)
+    assert loaded.origin == grid.origin
+    assert {k: len(v) for k, v in loaded.grid.items()} == {k: len(v) for k, v in Grid.load(path, mmap=False).grid.items()}
+
+    folders = []
+    for name, g in (("original", grid), ("loaded", loaded)):
+        folders.append(os.path.join(tmp_directory, name))
+        os.makedirs(folders[-1])
+        g.to_gltf(folders[-1], True)
+    assert sorted(os.listdir(folders[0])) == sorted(os.listdir(folders[1]))
+    for name in os.listdir(folders[0]):
+        with open(os.path.join(folders[0], name), "rb") as a, open(os.path.join(folders[1], name), "rb") as b:
+            assert a.read() == b.read()
+
+
+def squares_grid(corners):
+    vertices = np.concatenate([np.array([[0, 0], [50, 0], [50, 50], [0, 50]], dtype=np.float64) + corner for corner in corners])
+    offsets = np.arange(len(corners) + 1)
+    layer = Layer()
+    layer.add_polygons_batch(vertices, offsets * 4, offsets, offsets)
+    grid = Grid(1000, 1000)
+    grid.add_layer(layer)
+    return grid
+
+
+def test_grid_incremental(tmp_directory: str):
+    folder = os.path.join(tmp_directory, "incremental")
+    os.makedirs(folder)
+    report = squares_grid([(10, 10), (1010, 10), (5010, 5010)]).to_gltf(folder, False, levels=2, incremental=True)
+    assert sorted(report["written"]) == ["lod1_tile0_0.gltf", "lod1_tile2_2.gltf", "tile0_0.gltf", "tile1_0.gltf", "tile5_5.gltf"]
+    assert report["skipped"] == [] and report["removed"] == []
+    with open(os.path.join(folder, "layout.json")) as file:
+        layout = file.read()
+
+    report = squares_grid([(10, 10), (1010, 10), (5010, 5010)]).to_gltf(folder, False, levels=2, incremental=True)
+    assert report["written"] == [] and report["removed"] == []
+    assert len(report["skipped"]) == 5
+    with open(os.path.join(folder, "layout.json")) as file:
+        assert file.read() == layout
+
+    report = squares_grid([(10, 10), (1020, 10)]).to_gltf(folder, False, levels=2, incremental=True)
+    assert sorted(report["written"]) == ["lod1_tile0_0.gltf", "tile1_0.gltf"]
+    assert report["skipped"] == ["tile0_0.gltf"]
+    assert sorted(report["removed"]) == ["lod1_tile2_2.gltf", "tile5_5.gltf"]
+    assert sorted(os.listdir(folder)) == ["layout.json", "lod1_tile0_0.gltf", "manifest.json", "tile0_0.gltf", "tile1_0.gltf"]
+
+    with open(os.path.join(folder, "manifest.json")) as file:
+        manifest = json.load(file)
+    assert sorted(manifest["tiles"]) == ["lod1_tile0_0.gltf", "tile0_0.gltf", "tile1_0.gltf"]
+    full = os.path.join(tmp_directory, "full")
+    os.makedirs(full)
+    squares_grid([(10, 10), (1020, 10)]).to_gltf(full, False, levels=2)
+    for name in os.listdir(full):
+        with open(os.path.join(full, name), "rb") as a, open(os.path.join(folder, name), "rb") as b:
+            assert a.read() == b.read()
+
+    report = squares_grid([(10, 10), (1020, 10)]).to_gltf(folder, False, levels=2)
+    assert len(report["written"]) == 3 and report["skipped"] == []
+
+
+def test_grid_incremental_manifest_names(tmp_directory: str):
+    folder = os.path.join(tmp_directory, "export")
+    os.makedirs(folder)
+    outside = os.path.join(tmp_directory, "outside.gltf")
+    with open(outside, "w") as file:
+        file.write("{}")
+    with open(os.path.join(folder, "notes.txt"), "w") as file:
+        file.write("keep")
+    tiles = {name: {} for name in ["../outside.gltf", "notes.txt", "tile7_7.gltf"]}
+    with open(os.path.join(folder, "manifest.json"), "w") as file:
+        json.dump({"version": 1, "tiles": tiles}, file)
+    with open(os.path.join(folder, "tile7_7.gltf"), "w") as file:
+        file.write("{}")
+
+    report = squares_grid([(10, 10)]).to_gltf(folder, False, incremental=True)
+    assert report["removed"] == ["tile7_7.gltf"]
+    assert os.path.exists(outside)
+    assert sorted(os.listdir(folder)) == ["layout.json", "manifest.json", "notes.txt", "tile0_0.gltf"]
+
+
+def test_simplified():
+    attr = Attribute()
+    attr.push_polygon2D([[0, 0, 10, 0, 10, 10, 0, 10], [1, 1, 1.1, 1, 1.1, 1.1]])
+    simplified = attr.simplified(5)
+    assert simplified.type == attr.type
+    assert simplified.size % 3 == 0
+    assert simplified.size <= attr.size
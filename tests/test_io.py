@@ -1,6 +1,13 @@
-from metacity.io.geojson import parse as parse_geojson
-from metacity.io.shapefile import parse as parse_shp
-from metacity.io import parse_recursively
+import json
+import os
+import numpy as np
+import pytest
+from metacity.io.geojson import parse as parse_geojson, parse_data, iterate as iterate_geojson, iterate_features
+from metacity.geometry import parse_geojson_bytes
+from metacity.utils.filesystem import read_bytes, read_json
+from metacity.io.shapefile import parse as parse_shp, iterate as iterate_shp
+from metacity.io import parse_recursively, ingest
+from metacity.geometry import Grid, Layer
 
 
 def test_geojson(geojson_dataset: str):
@@ -21,3 +28,167 @@ def test_recursive_parse(data_directory):
     
 
 
+
+def test_geojson_native(geojson_dataset: str):
+    native = parse_geojson_bytes(read_bytes(geojson_dataset)).get_models()
+    python = parse_data(read_json(geojson_dataset))
+    assert len(native) == len(python)
+    for a, b in zip(native, python):
+        assert a.metadata == b.metadata
+        va, vb = a.get_attribute("POSITION"), b.get_attribute("POSITION")
+        assert va.type == vb.type
+        assert np.array_equal(va.vertices, vb.vertices)
+
+
+def test_geojson_origin(geojson_dataset: str):
+    origin = (7000.0, 5000.0, 0.0)
+    native = parse_geojson_bytes(read_bytes(geojson_dataset), origin=origin).get_models()
+    python = parse_data(read_json(geojson_dataset), origin=origin)
+    reference = parse_geojson(geojson_dataset)
+    for a, b, c in zip(native, python, reference):
+        va, vb, vc = (m.get_attribute("POSITION").vertices.reshape(-1, 3) for m in (a, b, c))
+        assert np.allclose(va, vb)
+        assert np.allclose(va + origin, vc, atol=1e-3)
+
+
+def test_shp_iterate(tmp_directory: str):
+    import fiona
+    import geopandas
+    path = os.path.join(tmp_directory, "polygons.shp")
+    schema = {"geometry": "MultiPolygon", "properties": {"name": "str", "height": "float"}}
+    square = [(0, 0), (10, 0), (10, 10), (0, 10), (0, 0)]
+    hole = [(2, 2), (4, 2), (4, 4), (2, 2)]
+    with fiona.open(path, "w", driver="ESRI Shapefile", schema=schema, crs="EPSG:5514") as file:
+        for i in range(25):
+            shifted = lambda ring: [(x + i * 20, y) for x, y in ring]
+            polygons = [[shifted(square), shifted(hole)]]
+            if i % 2:
+                polygons.append([[(x, y + 20) for x, y in shifted(square)]])
+            file.write({"geometry": {"type": "MultiPolygon", "coordinates": polygons},
+                        "properties": {"name": f"building {i}", "height": i * 1.5}})
+
+    chunks = list(iterate_shp(path, chunk_size=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+    streamed = sum(chunks, [])
+    reference = parse_data(geopandas.read_file(path)._to_geo())
+    assert len(streamed) == len(reference) == 25
+    for a, b in zip(streamed, reference):
+        assert a.metadata == b.metadata
+        va, vb = a.get_attribute("POSITION"), b.get_attribute("POSITION")
+        assert va.type == vb.type
+        assert np.array_equal(va.vertices, vb.vertices)
+
+    projected = parse_shp(path, crs="EPSG:4326")
+    expected = parse_data(geopandas.read_file(path).to_crs("EPSG:4326")._to_geo())
+    for a, b in zip(projected, expected):
+        assert np.allclose(a.get_attribute("POSITION").vertices, b.get_attribute("POSITION").vertices)
+
+
+def test_ingest(tmp_directory: str, data_directory: str):
+    layer = Layer()
+    reports = ingest(data_directory, layer, workers=4, progress=False)
+    assert all(report.ok for report in reports)
+    assert sum(report.models for report in reports) == layer.size == len(parse_recursively(data_directory))
+
+    broken = os.path.join(tmp_directory, "broken")
+    os.makedirs(broken)
+    with open(os.path.join(broken, "broken.json"), "w") as file:
+        file.write("{not json")
+    grid = Grid(1000, 1000)
+    reports = ingest(broken, grid, progress=False)
+    assert len(reports) == 1 and not reports[0].ok and reports[0].models == 0
+
+
+def test_ingest_grid_origin(tmp_directory: str, data_directory: str):
+    origin = (1000.0, 2000.0, 0.0)
+    shifted, plain = Grid(1000, 1000), Grid(1000, 1000)
+    ingest(data_directory, shifted, origin=origin, progress=False)
+    ingest(data_directory, plain, progress=False)
+    assert shifted.origin == origin and plain.origin == (0, 0, 0)
+
+    shifted_min = np.min([m.get_attribute("POSITION").vmin for tile in shifted.grid.values() for m in tile], axis=0)
+    plain_min = np.min([m.get_attribute("POSITION").vmin for tile in plain.grid.values() for m in tile], axis=0)
+    assert np.allclose(shifted_min + origin, plain_min, atol=1e-2)
+
+    with pytest.raises(RuntimeError):
+        shifted.set_origin((0.0, 0.0, 0.0))
+
+
+def test_geojson_iterate(tmp_directory: str, geojson_dataset: str):
+    data = read_json(geojson_dataset)
+    for block_size in (1, 13, 1 << 20):
+        assert list(iterate_features(geojson_dataset, block_size=block_size)) == data["features"]
+
+    reference = parse_geojson(geojson_dataset)
+    batches = list(iterate_geojson(geojson_dataset, batch_size=5))
+    assert len(batches) > 1
+    streamed = sum(batches, [])
+    assert len(streamed) == len(reference)
+    for a, b in zip(streamed, reference):
+        assert a.metadata == b.metadata
+        assert np.array_equal(a.get_attribute("POSITION").vertices, b.get_attribute("POSITION").vertices)
+
+    sequence = os.path.join(tmp_directory, "features.geojsonl")
+    with open(sequence, "w") as file:
+        for feature in data["features"]:
+            file.write("\x1e" + json.dumps(feature) + "\n")
+    assert list(iterate_features(sequence)) == data["features"]
+    assert len(parse_geojson(sequence)) == len(reference)
+
+
+def test_geojson_iterate_strings(tmp_directory: str):
+    point = {"type": "Point", "coordinates": [1.0, 2.0]}
+    collection = {
+        "properties": {"features": [{"fake": "}"}]},
+        "features": [
+            {"type": "Feature", "geometry": point, "properties": {"name": "a}\"{]\\", "features": []}},
+            {"type": "Feature", "geometry": point, "properties": {"name": "b"}},
+        ],
+        "type": "FeatureCollection",
+    }
+    path = os.path.join(tmp_directory, "strings.json")
+    with open(path, "w") as file:
+        json.dump(collection, file, indent=2)
+    for block_size in (1, 2, 3, 64):
+        assert list(iterate_features(path, block_size=block_size)) == collection["features"]
+
+
+def test_geojson_iterate_not_collection(tmp_directory: str):
+    point = {"type": "Point", "coordinates": [1.0, 2.0]}
+    feature = {"type": "Feature", "geometry": point, "properties": {"features": [1]}}
+    for name, data in (("feature", feature), ("geometry", point)):
+        directory = os.path.join(tmp_directory, name)
+        os.makedirs(directory)
+        path = os.path.join(directory, name + ".json")
+        with open(path, "w") as file:
+            json.dump(data, file)
+        with pytest.raises(ValueError):
+            list(iterate_features(path))
+        report, = ingest(directory, Layer(), progress=False)
+        assert not report.ok and report.models == 0
+
+    path = os.path.join(tmp_directory, "empty.json")
+    with open(path, "w") as file:
+        json.dump({"type": "FeatureCollection", "features": []}, file)
+    assert list(iterate_features(path)) == []
+
+
+def test_geojson_iterate_reproject_z(tmp_directory: str):
+    from pyproj import Transformer
+    features = [
+        {"type": "Feature", "geometry": {"type": "LineString", "coordinates": [[14.4, 50.1, 300.0], [14.5, 50.2, 310.0]]}, "properties": {}},
+        {"type": "Feature", "geometry": {"type": "LineString", "coordinates": [[14.4, 50.1], [14.5, 50.2]]}, "properties": {}},
+    ]
+    path = os.path.join(tmp_directory, "heights.json")
+    with open(path, "w") as file:
+        json.dump({"type": "FeatureCollection", "features": features}, file)
+
+    transformer = Transformer.from_crs("EPSG:4326", "EPSG:5514", always_xy=True)
+    x, y = transformer.transform([14.4, 14.5], [50.1, 50.2])
+    models = sum(iterate_geojson(path, crs="EPSG:5514"), [])
+    assert len(models) == 2
+    for model, z in zip(models, ([300.0, 310.0], [0.0, 0.0])):
+        vertices = model.get_attribute("POSITION").vertices.reshape(-1, 3)
+        assert np.allclose(vertices[:, 0], x)
+        assert np.allclose(vertices[:, 1], y)
+        assert np.allclose(vertices[:, 2], z)
@@ -1,6 +1,11 @@
-from metacity.geometry import Layer
+import numpy as np
+from metacity.geometry import Attribute, Grid, Layer
 from metacity.io.shapefile import parse
+from metacity.io.geojson import parse as parse_geojson
 import os
+import json
+import pytest
+from concurrent.futures import ThreadPoolExecutor
 
 
 def test_layer(tmp_directory: str, shp_poly_dataset: str):
@@ -20,4 +25,354 @@ def test_layer(tmp_directory: str, shp_poly_dataset: str):
 
 
 
-    
\ No newline at end of file
+    
+def test_polygons_batch():
+    square = [[0, 0], [1, 0], [1, 1], [0, 1]]
+    hole = [[0.2, 0.2], [0.4, 0.2], [0.4, 0.4]]
+    vertices = np.array(square + hole + square + square, dtype=np.float64)
+    rings = np.array([0, 4, 7, 11, 15])
+    polygons = np.array([0, 2, 3, 4])
+    models = np.array([0, 1, 3])
+
+    serial = Layer()
+    serial.add_polygons_batch(vertices, rings, polygons, models, threads=1)
+    parallel = Layer()
+    parallel.add_polygons_batch(vertices, rings, polygons, models, threads=4)
+    assert serial.size == parallel.size == 2
+
+    for a, b in zip(serial.get_models(), parallel.get_models()):
+        assert np.array_equal(a.get_attribute("POSITION").vertices, b.get_attribute("POSITION").vertices)
+
+    reference = Attribute()
+    reference.push_polygon2D([sum(square, []), sum(hole, [])])
+    assert np.array_equal(serial.get_models()[0].get_attribute("POSITION").vertices, reference.vertices)
+
+
+def test_layer_glb(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+    path = os.path.join(tmp_directory, "test.glb")
+    layer.to_gltf(path, binary=True)
+
+    with open(path, "rb") as file:
+        assert file.read(4) == b"glTF"
+
+    layer2 = Layer()
+    layer2.from_gltf(path)
+    assert layer2.size > 0
+    for model in layer2.get_models():
+        assert model.get_attribute("POSITION").size >= 3
+
+
+def test_layer_lazy_gltf(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.add_models(parse_geojson(geojson_dataset))
+
+    for name, binary in (("lazy.glb", True), ("lazy.gltf", False)):
+        path = os.path.join(tmp_directory, name)
+        layer.to_gltf(path, binary=binary)
+
+        eager = Layer()
+        eager.from_gltf(path)
+        lazy = Layer()
+        lazy.from_gltf(path, lazy=True)
+        assert lazy.size == eager.size
+
+        for a, b in zip(eager.get_models(), lazy.get_models()):
+            ea, la = a.get_attribute("POSITION"), b.get_attribute("POSITION")
+            assert la.borrowed and not ea.borrowed
+            assert la.type == ea.type
+            assert np.array_equal(la.vertices, ea.vertices)
+            assert b.metadata == a.metadata
+
+    #modifications copy the borrowed vertices and leave the mapped file untouched
+    attribute = lazy.get_model(0).get_attribute("POSITION")
+    size = attribute.size
+    attribute.push_point2D([0.0, 0.0, 1.0, 1.0])
+    assert not attribute.borrowed
+    assert attribute.size == size + 2
+    assert np.array_equal(attribute.vertices[:size], eager.get_model(0).get_attribute("POSITION").vertices)
+
+
+def test_layer_properties(tmp_directory: str):
+    layer = square_layer(6)
+    models = layer.get_models()
+    rows = [
+        {"height": 10, "name": "a", "flag": True, "tags": [1, 2], "street no.": "1"},
+        {"height": 12.5, "name": "", "flag": False, "tags": {"k": "v"}},
+        {"height": -3, "flag": True},
+        {"name": "d", "mixed": 1},
+        {"mixed": "text"},
+        None,
+    ]
+    layer2 = Layer()
+    for model, row in zip(models, rows):
+        if row is not None:
+            model.set_metadata(row)
+        layer2.add_model(model)
+    #models keep their metadata once stored in the layer table
+    assert [m.metadata for m in layer2.get_models()] == rows
+
+    for name, binary in (("properties.glb", True), ("properties.gltf", False)):
+        path = os.path.join(tmp_directory, name)
+        layer2.to_gltf(path, binary=binary)
+
+        for lazy in (False, True):
+            imported = Layer()
+            imported.from_gltf(path, lazy=lazy)
+            assert [m.metadata for m in imported.get_models()] == rows
+
+    with open(os.path.join(tmp_directory, "properties.gltf")) as file:
+        document = json.load(file)
+    assert "EXT_structural_metadata" in document["extensionsUsed"]
+    assert all("extras" not in mesh for mesh in document["meshes"])
+    table = document["extensions"]["EXT_structural_metadata"]["propertyTables"][0]
+    assert table["count"] == 6
+    assert "street_no_" in table["properties"]
+
+    #modified models detach from the table
+    model = imported.get_model(0)
+    model.set_metadata({"height": 11})
+    assert model.metadata["height"] == 11
+    assert imported.get_model(1).metadata == rows[1]
+
+
+def test_layer_metadata_unchanged(tmp_directory: str):
+    models = square_layer(3).get_models()
+    rows = [{"h": 1, "big": 2**60 + 1, "n": 7}, {"h": 2.5, "big": 0.5, "n": 2.0}, {"h": -(2**62), "n": 3}]
+    for model, row in zip(models, rows):
+        model.set_metadata(row)
+    layer = Layer()
+    layer.add_model(models[0])
+    layer.add_models(models[1:])
+
+    #stored rows keep their values and types when later rows widen a column
+    for model, row in zip(models, rows):
+        assert model.metadata == row
+        assert [type(v) for v in model.metadata.values()] == [type(row[k]) for k in sorted(row)]
+    assert [m.metadata for m in layer.get_models()] == rows
+
+    path = os.path.join(tmp_directory, "metadata.glb")
+    layer.to_gltf(path, binary=True)
+    imported = Layer()
+    imported.from_gltf(path)
+    assert [m.metadata["big"] for m in imported.get_models()[:2]] == [2**60 + 1, 0.5]
+    assert imported.get_model(2).metadata["h"] == -(2**62)
+
+
+def square_layer(count: int):
+    layer = Layer()
+    vertices = []
+    for i in range(count):
+        x, y = i % 10 * 10, i // 10 * 10
+        vertices += [[x, y], [x + 5, y], [x + 5, y + 5], [x, y + 5]]
+    rings = np.arange(0, 4 * count + 1, 4)
+    polygons = np.arange(count + 1)
+    layer.add_polygons_batch(np.array(vertices, dtype=np.float64), rings, polygons, polygons)
+    return layer
+
+
+def test_spatial_queries():
+    layer = square_layer(100)
+    layer.build_index(node_size=4)
+
+    assert layer.query_bbox((0, 0), (12, 3)) == [0, 1]
+    assert layer.query_point(2, 2) == [0]
+    assert layer.query_point(7, 7) == []
+    assert layer.query_nearest(16, 1, k=2) == [1, 2]
+    assert layer.get_model(11).get_attribute("POSITION").vmin == (10.0, 10.0, 0.0)
+
+    brute = [i for i, m in enumerate(layer.get_models())
+             if m.get_attribute("POSITION").vmax[0] >= 20 and m.get_attribute("POSITION").vmin[0] <= 45
+             and m.get_attribute("POSITION").vmax[1] >= 30 and m.get_attribute("POSITION").vmin[1] <= 62]
+    assert layer.query_bbox((20, 30), (45, 62)) == brute
+
+
+def test_spatial_queries_concurrent():
+    layer = square_layer(100)
+    squares = [square_layer(1).get_model(0) for _ in range(50)]
+
+    def query(_):
+        return [layer.query_point(2, 2) for _ in range(200)]
+
+    #the index is dropped by every added model while queries are running without the GIL
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = pool.map(query, range(8))
+        for model in squares:
+            layer.add_model(model)
+    assert all(0 in found for result in results for found in result)
+    assert layer.query_point(2, 2) == [0] + list(range(100, 150))
+
+
+def test_layer_concurrent_materialize(tmp_directory: str):
+    path = os.path.join(tmp_directory, "concurrent.glb")
+    square_layer(400).to_gltf(path, binary=True)
+
+    for compact in (False, True):
+        for _ in range(5):
+            layer = Layer(compact=compact)
+            layer.from_gltf(path, lazy=True)
+            #build_index materializes models without the GIL while get_model does so with it
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                built = pool.submit(layer.build_index)
+                models = [layer.get_model(i) for i in range(layer.size)]
+                built.result()
+            assert all(a is b for a, b in zip(models, layer.get_models()))
+            assert layer.query_point(2, 2) == [0]
+
+
+def test_layer_origin(tmp_directory: str):
+    origin = (-742000.25, -1043000.5, 250.0)
+    square = np.array([[0, 0], [0.01, 0], [0.01, 0.01], [0, 0.01]], dtype=np.float64) + origin[:2]
+    layer = Layer()
+    layer.set_origin(origin)
+    layer.add_polygons_batch(square, np.array([0, 4]), np.array([0, 1]), np.array([0, 1]))
+    assert layer.origin == origin
+
+    vertices = layer.get_model(0).get_attribute("POSITION").vertices.reshape(-1, 3).copy()
+    assert np.allclose(vertices[:, :2].min(axis=0), (0, 0))
+    assert np.allclose(vertices[:, :2].max(axis=0), (0.01, 0.01))
+
+    #queries take absolute coordinates
+    assert layer.query_bbox((origin[0] - 1, origin[1] - 1), (origin[0] + 1, origin[1] + 1)) == [0]
+    assert layer.query_bbox((0, 0), (1, 1)) == []
+    assert layer.query_point(origin[0] + 0.005, origin[1] + 0.005) == [0]
+    assert layer.query_point(0.005, 0.005) == []
+    assert layer.query_nearest(origin[0] + 5, origin[1], k=1) == [0]
+
+    shifted = (origin[0] + 10, origin[1], origin[2])
+    layer.set_origin(shifted)
+    moved = layer.get_model(0).get_attribute("POSITION").vertices.reshape(-1, 3)
+    assert np.allclose(moved[:, 0], vertices[:, 0] - 10, atol=1e-4)
+    assert np.allclose(moved[:, 2], vertices[:, 2] + origin[2] - shifted[2])
+
+    path = os.path.join(tmp_directory, "origin.gltf")
+    layer.to_gltf(path)
+    with open(path) as file:
+        document = json.load(file)
+    assert all(node["translation"] == list(shifted) for node in document["nodes"])
+
+    loaded = Layer()
+    loaded.from_gltf(path)
+    assert loaded.origin == shifted
+    assert np.allclose(loaded.get_model(0).get_attribute("POSITION").vertices.reshape(-1, 3), moved)
+
+
+def test_layer_transform():
+    layer = square_layer(4)
+    before = [m.get_attribute("POSITION").vertices.reshape(-1, 3).copy() for m in layer.get_models()]
+    matrix = np.array([[0, -1, 0, 5], [1, 0, 0, 0], [0, 0, 2, 1], [0, 0, 0, 1]], dtype=np.float64)
+    layer.transform(matrix, threads=2)
+
+    for vertices, model in zip(before, layer.get_models()):
+        homogeneous = np.hstack([vertices, np.ones((len(vertices), 1))])
+        expected = (homogeneous @ matrix.T)[:, :3]
+        assert np.allclose(model.get_attribute("POSITION").vertices.reshape(-1, 3), expected)
+
+
+def test_layer_compact(tmp_directory: str, geojson_dataset: str):
+    models = parse_geojson(geojson_dataset)
+    regular = Layer()
+    regular.add_models(models)
+    compact = Layer(compact=True)
+    compact.add_models(models[:10])
+    for model in models[10:]:
+        compact.add_model(model)
+    converted = Layer()
+    converted.add_models(models)
+    converted.compact()
+
+    assert compact.is_compact and converted.is_compact and not regular.is_compact
+    assert compact.size == converted.size == regular.size
+    for layer in (compact, converted):
+        for a, b in zip(layer.get_models(), regular.get_models()):
+            assert a.metadata == b.metadata
+            va, vb = a.get_attribute("POSITION"), b.get_attribute("POSITION")
+            assert va.borrowed
+            assert va.type == vb.type
+            assert np.array_equal(va.vertices, vb.vertices)
+
+    paths = []
+    for name, layer in (("regular", regular), ("compact", compact)):
+        paths.append(os.path.join(tmp_directory, f"{name}.glb"))
+        layer.to_gltf(paths[-1], binary=True)
+    with open(paths[0], "rb") as a, open(paths[1], "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_layer_compact_views():
+    layer = square_layer(20)
+    compact = square_layer(20)
+    compact.compact(threads=2)
+    assert compact.query_bbox((0, 0), (12, 3)) == layer.query_bbox((0, 0), (12, 3))
+    assert compact.query_point(2, 2) == [0]
+
+    #modified views are copied out of the arena and stay cached
+    model = compact.get_model(0)
+    model.set_metadata({"name": "first"})
+    model.get_attribute("POSITION").push_polygon2D([[0, 0, 1, 0, 1, 1]])
+    assert not model.get_attribute("POSITION").borrowed
+    assert compact.get_model(0).metadata == {"name": "first"}
+
+    compact.set_origin((10, 0, 0))
+    compact.transform(np.diag([2.0, 2.0, 1.0, 1.0]))
+    layer.set_origin((10, 0, 0))
+    layer.transform(np.diag([2.0, 2.0, 1.0, 1.0]))
+    for i in range(1, 20):
+        assert np.array_equal(compact.get_model(i).get_attribute("POSITION").vertices,
+                              layer.get_model(i).get_attribute("POSITION").vertices)
+    assert compact.get_model(0).get_attribute("POSITION").size == layer.get_model(0).get_attribute("POSITION").size + 3
+
+
+def test_layer_snapshot(tmp_directory: str, geojson_dataset: str):
+    layer = Layer()
+    layer.set_origin((100.0, 200.0, 0.0))
+    layer.add_models(parse_geojson(geojson_dataset, origin=(100, 200, 0)))
+    path = os.path.join(tmp_directory, "layer.snapshot")
+    layer.save(path)
+
+    for mmap in (True, False):
+        loaded = Layer.load(path, mmap=mmap)
+        assert loaded.is_compact
+        assert loaded.size == layer.size
+        assert loaded.origin == layer.origin
+        for a, b in zip(loaded.get_models(), layer.get_models()):
+            assert a.metadata == b.metadata
+            va, vb = a.get_attribute("POSITION"), b.get_attribute("POSITION")
+            assert va.borrowed and va.type == vb.type
+            assert np.array_equal(va.vertices, vb.vertices)
+
+    #a loaded layer can be modified and saved over its own snapshot
+    loaded = Layer.load(path)
+    loaded.set_origin((0.0, 200.0, 0.0))
+    loaded.save(path)
+    moved = Layer.load(path)
+    assert moved.origin == (0.0, 200.0, 0.0)
+    for a, b in zip(moved.get_models(), layer.get_models()):
+        assert np.allclose(a.get_attribute("POSITION").vertices.reshape(-1, 3),
+                           b.get_attribute("POSITION").vertices.reshape(-1, 3) + (100, 0, 0))
+
+
+def test_layer_snapshot_corrupted(tmp_directory: str):
+    layer = square_layer(10)
+    path = os.path.join(tmp_directory, "squares.snapshot")
+    layer.save(path)
+    with open(path, "rb") as file:
+        data = bytearray(file.read())
+
+    #first vertex of the first square
+    offset = data.index(np.array([0, 5, 0], dtype=np.float32).tobytes())
+    data[offset] ^= 0xFF
+    corrupted = os.path.join(tmp_directory, "corrupted.snapshot")
+    with open(corrupted, "wb") as file:
+        file.write(data)
+    with pytest.raises(RuntimeError, match="Checksum"):
+        Layer.load(corrupted)
+    assert Layer.load(corrupted, verify=False).size == 10
+
+    with open(corrupted, "wb") as file:
+        file.write(data[:len(data) // 2])
+    with pytest.raises(RuntimeError):
+        Layer.load(corrupted, verify=False)
+    with pytest.raises(RuntimeError, match="kind"):
+        Grid.load(path)
@@ -0,0 +1,191 @@
+from metacity.core.heightmap import box_filters, clamp, decode_png16, decode_raw, denoise, encode_png16, write_heightmap_tiles
+from metacity.core.legofy import legofy
+from metacity.geometry import Attribute, Grid, HeightmapMethod, LegoBuilder, Layer, Model
+import json
+import numpy as np
+import os
+
+
+def triangle_layer(triangles: np.ndarray, origin=(0.0, 0.0, 0.0)):
+    layer = Layer()
+    layer.set_origin(origin)
+    for triangle in triangles:
+        attribute = Attribute()
+        attribute.push_polygon3D(triangle.astype(np.float32), np.array([0, 3]))
+        model = Model()
+        model.add_attribute("POSITION", attribute)
+        layer.add_model(model)
+    return layer
+
+
+def random_triangles(count: int):
+    rng = np.random.default_rng(7)
+    centers = rng.random((count, 1, 3)) * [100, 100, 20]
+    triangles = centers + rng.random((count, 3, 3)) * [10, 10, 5]
+    #ground covering the whole raster so that every pixel is hit
+    ground = np.array([[[-1, -1, 0], [120, -1, 0], [120, 120, 0]], [[-1, -1, 0], [120, 120, 0], [-1, 120, 0]]])
+    return np.concatenate([triangles, ground])
+
+
+def brute_heightmap(triangles: np.ndarray, size: int):
+    centers = np.arange(size) + 0.5
+    x, y = np.meshgrid(centers, size - centers)
+    heights = np.full((size, size), -np.inf)
+    for a, b, c in triangles.astype(np.float64):
+        det = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        if abs(det) < 1e-9:
+            continue
+        px, py = x - a[0], y - a[1]
+        u = (px * (c[1] - a[1]) - py * (c[0] - a[0])) / det
+        v = ((b[0] - a[0]) * py - (b[1] - a[1]) * px) / det
+        inside = (u >= 0) & (v >= 0) & (u + v <= 1)
+        z = a[2] + u * (b[2] - a[2]) + v * (c[2] - a[2])
+        heights = np.where(inside, np.maximum(heights, z), heights)
+    return heights
+
+
+def test_heightmap():
+    triangles = random_triangles(500)
+    builder = LegoBuilder()
+    builder.insert_layer(triangle_layer(triangles))
+    builder.build_heightmap(0, 0, 100, 100, 1, method=HeightmapMethod.TRACE)
+
+    heightmap = builder.heightmap
+    assert heightmap.dtype == np.float32
+    assert heightmap.shape == (100, 100)
+    assert np.allclose(heightmap, brute_heightmap(triangles, 100), atol=1e-3)
+
+    parallel = LegoBuilder()
+    parallel.insert_layer(triangle_layer(triangles))
+    parallel.build_heightmap(0, 0, 100, 100, 1, threads=4, method=HeightmapMethod.TRACE)
+    assert np.array_equal(heightmap, parallel.heightmap)
+
+    #rebuilding does not change heightmaps handed out before
+    before = heightmap.copy()
+    builder.build_heightmap(0, 0, 50, 50, 3)
+    assert builder.heightmap.shape == (150, 150)
+    assert np.array_equal(heightmap, before)
+
+
+def test_heightmap_origin(tmp_directory: str):
+    triangles = random_triangles(200)
+    expected = brute_heightmap(triangles, 100)
+    origin = (-742000.0, -1043000.0, 250.0)
+    east = (origin[0] + 200, origin[1], origin[2])
+
+    #layers with different origins are placed relative to the first one, the extent is absolute
+    builder = LegoBuilder()
+    builder.insert_layer(triangle_layer(triangles, origin))
+    builder.insert_layer(triangle_layer(triangles, east))
+    assert builder.origin == origin
+    builder.build_heightmap(origin[0], origin[1], origin[0] + 300, origin[1] + 100, 1)
+    assert np.allclose(builder.heightmap[:, :100], expected + origin[2], atol=1e-2)
+    assert np.allclose(builder.heightmap[:, 200:], expected + origin[2], atol=1e-2)
+
+    heightmap = legofy(triangle_layer(triangles, origin), tmp_directory, origin[:2], (origin[0] + 100, origin[1] + 100),
+                       coordinates_decimal_precision=0, box_filter_size_range=(5, 10))
+    assert np.allclose(heightmap, expected + origin[2], atol=1e-2)
+
+
+def test_heightmap_raster():
+    triangles = random_triangles(2000)
+    layer = triangle_layer(triangles)
+    traced, rasterized = LegoBuilder(), LegoBuilder()
+    traced.insert_layer(layer)
+    rasterized.insert_layer(layer)
+    for resolution in [0.5, 1, 3.3]:
+        traced.build_heightmap(0, 0, 100, 80, resolution, method=HeightmapMethod.TRACE)
+        rasterized.build_heightmap(0, 0, 100, 80, resolution, threads=3, method=HeightmapMethod.RASTER)
+        assert rasterized.heightmap.shape == traced.heightmap.shape
+        assert np.allclose(rasterized.heightmap, traced.heightmap, atol=1e-4)
+
+    grid = Grid(25, 25)
+    grid.add_layer(layer)
+    gridded = LegoBuilder()
+    gridded.insert_grid(grid)
+    gridded.build_heightmap(0, 0, 100, 80, 3.3)
+    assert np.allclose(gridded.heightmap, traced.heightmap, atol=1e-4)
+
+
+def test_denoise():
+    heightmap = np.array([[1, 2, -np.inf, 4],
+                          [-np.inf, -np.inf, 8, 100],
+                          [-np.inf, -np.inf, -np.inf, 2]], dtype=np.float32)
+    denoised = denoise(heightmap, 1, 10)
+    assert denoised.dtype == np.float32
+    #neighbours are read before any pixel is replaced
+    assert denoised[1, 0] == 1.5
+    assert np.isclose(denoised[0, 2], 14 / 3)
+    assert denoised[2, 0] == 1
+    assert np.isclose(denoised[1, 3], 14 / 3)
+    assert np.array_equal(denoised[::-1, ::-1], denoise(heightmap[::-1, ::-1], 1, 10))
+    assert np.array_equal(clamp(heightmap, 1, 10)[1], [1, 1, 8, 10])
+
+
+def test_box_filters():
+    heightmap = np.random.default_rng(3).random((53, 71)).astype(np.float32) * 50
+    filters = box_filters(heightmap, [1, 5, 10, 20])
+    for size, bricks in filters.items():
+        rows, cols = 53 // size, 71 // size
+        blocks = heightmap[:rows * size, :cols * size].reshape(rows, size, cols, size)
+        assert bricks.shape == (rows, cols)
+        assert np.allclose(bricks, blocks.mean(axis=(1, 3)), atol=1e-4)
+
+
+def test_legofy(tmp_directory: str):
+    triangles = random_triangles(50)
+    heightmap = legofy(triangle_layer(triangles), tmp_directory, (0, 0), (100, 100), coordinates_decimal_precision=0,
+                       box_filter_size_range=(5, 15), box_filter_step=5)
+    assert heightmap.shape == (100, 100)
+    assert np.all(np.isfinite(heightmap))
+    assert sorted(os.listdir(tmp_directory)) == ["heightmap.png", "lego_10.json", "lego_5.json"]
+
+    with open(os.path.join(tmp_directory, "lego_10.json")) as file:
+        lego = json.load(file)
+    assert lego["lego_size"]["x"] == 10 and lego["lego_size"]["y"] == 10
+    assert len(lego["map"]) == 10 and len(lego["map"][0]) == 10
+    assert min(min(row) for row in lego["map"]) == 0
+
+
+def test_heightmap_png():
+    rows, cols = np.mgrid[0:60, 0:90]
+    heightmap = (np.sin(rows / 7) * np.cos(cols / 11) * 20 + 100).astype(np.float32)
+    step = 40 / 65535
+    for filter in ["none", "sub", "up", "average", "paeth", "adaptive"]:
+        data = encode_png16(heightmap, filter=filter)
+        assert np.allclose(decode_png16(data), heightmap, atol=step)
+    assert len(encode_png16(heightmap, level=9)) < len(encode_png16(heightmap, level=9, filter="none"))
+
+    #flat roofs and ground compress well below the 2 bytes per pixel of the raw samples
+    plateaus = np.floor(heightmap / 5) * 5
+    assert len(encode_png16(plateaus, level=9)) < plateaus.size * 2 / 10
+
+    #pixels without geometry are kept apart from the lowest height
+    heightmap[10, 20], heightmap[30, 40] = -np.inf, np.nan
+    decoded = decode_png16(encode_png16(heightmap, filter="paeth"))
+    covered = np.isfinite(heightmap)
+    assert np.all(np.isneginf(decoded[~covered]))
+    assert np.allclose(decoded[covered], heightmap[covered], atol=step)
+
+
+def test_heightmap_tiles(tmp_directory: str):
+    heightmap = np.random.default_rng(5).random((300, 200)).astype(np.float32) * 30
+    heightmap[0, 0] = -np.inf
+
+    layout = write_heightmap_tiles(os.path.join(tmp_directory, "raw"), heightmap, tile_size=128, format="raw", threads=3)
+    assert len(layout["tiles"]) == 6
+    restored = np.zeros_like(heightmap)
+    for tile in layout["tiles"]:
+        with open(os.path.join(tmp_directory, "raw", tile["file"]), "rb") as file:
+            data = decode_raw(file.read(), tile["height"], tile["width"])
+        restored[tile["y"] * 128:tile["y"] * 128 + tile["height"], tile["x"] * 128:tile["x"] * 128 + tile["width"]] = data
+    assert np.array_equal(restored, heightmap)
+
+    layout = write_heightmap_tiles(os.path.join(tmp_directory, "png"), heightmap, tile_size=128)
+    with open(os.path.join(tmp_directory, "png", "layout.json")) as file:
+        assert json.load(file) == layout
+    with open(os.path.join(tmp_directory, "png", "tile1_2.png"), "rb") as file:
+        tile = decode_png16(file.read())
+    assert tile.shape == (44, 72)
+    assert layout["nodata"] == 65535
+    assert np.allclose(tile, heightmap[256:, 128:], atol=layout["high"] / 65535)